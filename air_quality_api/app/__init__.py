@@ -1,7 +1,10 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, g, jsonify, request
+import hmac
+import time
 from config import Config
 from flask_cors import CORS
 import structlog
+from .services import metrics, tracing
 
 # Configure structured logging
 structlog.configure(
@@ -14,6 +17,41 @@ structlog.configure(
 
 logger = structlog.get_logger()
 
+def _is_admin():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(Config.ADMIN_TOKEN) and hmac.compare_digest(token, Config.ADMIN_TOKEN)
+
+def _route_label():
+    """Route template (e.g. /api/locations/<location_id>) to keep label cardinality bounded."""
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+def _build_health_prober():
+    from .services.database_service import DatabaseService
+    from .services.cache_service import CacheService
+    from .services.health_prober import HealthCheck, HealthProber
+
+    def probe_mongodb():
+        db_service = DatabaseService(db_uri=Config.MONGO_URI, db_name=Config.MONGO_DB_NAME)
+        if db_service.client is None:
+            return "disconnected"
+        db_service.client.admin.command('ping')
+        return "connected"
+
+    def probe_redis():
+        cache_service = CacheService()
+        if not cache_service.client:
+            return "disconnected"
+        # A single read is enough to prove the REST endpoint answers
+        cache_service.client.get("__health_check__")
+        return "connected"
+
+    return HealthProber(
+        [HealthCheck("mongodb", probe_mongodb), HealthCheck("redis", probe_redis, critical=False)],
+        interval_seconds=Config.HEALTH_PROBE_INTERVAL,
+        timeout_seconds=Config.HEALTH_PROBE_TIMEOUT,
+        snapshot_path=Config.HEALTH_SNAPSHOT_PATH
+    )
+
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
@@ -27,7 +65,7 @@ def create_app():
         r"/api/*": {
             "origins": "*",  # TODO: Restrict to specific domains in production
             "methods": ["GET", "POST", "DELETE"],
-            "allow_headers": ["Content-Type"]
+            "allow_headers": ["Content-Type", Config.RATELIMIT_KEY_HEADER]
         }
     })
     
@@ -49,6 +87,7 @@ def create_app():
     @app.errorhandler(429)
     def ratelimit_handler(e):
         logger.warning("rate_limit_exceeded", error=str(e))
+        metrics.record_rate_limit_rejection(_route_label())
         return jsonify({
             "error": "Rate limit exceeded",
             "message": "Too many requests. Please try again later."
@@ -71,75 +110,104 @@ def create_app():
         }), 500
     
     # Health check endpoint
+    health_prober = _build_health_prober()
+
     @app.route('/api/health', methods=['GET'])
     def health_check():
         """
         Health check endpoint to verify service status.
         Returns 200 if all critical services are operational.
+        Serves the background prober's latest snapshot; ?deep=1 probes live.
         """
-        from .services.database_service import DatabaseService
-        from .services.cache_service import CacheService
-        
-        health_status = {
-            "status": "healthy",
-            "services": {}
-        }
-        
-        # Check MongoDB connection
-        try:
-            db_service = DatabaseService(
-                db_uri=Config.MONGO_URI,
-                db_name=Config.MONGO_DB_NAME
-            )
-            if db_service.client is not None:
-                db_service.client.admin.command('ping')
-                health_status["services"]["mongodb"] = "connected"
-            else:
-                health_status["services"]["mongodb"] = "disconnected"
-                health_status["status"] = "degraded"
-        except Exception as e:
-            logger.error("health_check_mongodb_failed", error=str(e))
-            health_status["services"]["mongodb"] = "error"
-            health_status["status"] = "unhealthy"
-        
-        # Check Upstash Redis connection
-        try:
-            cache_service = CacheService()
-            if cache_service.client:
-                # Test with a simple operation instead of ping()
-                # Upstash REST API doesn't support ping() reliably
-                test_key = "__health_check__"
-                cache_service.client.set(test_key, "ok", ex=10)
-                result = cache_service.client.get(test_key)
-                if result:
-                    health_status["services"]["redis"] = "connected"
-                else:
-                    health_status["services"]["redis"] = "disconnected"
-                    health_status["status"] = "degraded"
-            else:
-                health_status["services"]["redis"] = "disconnected"
-                health_status["status"] = "degraded"
-        except Exception as e:
-            logger.error("health_check_redis_failed", error=str(e))
-            health_status["services"]["redis"] = "error"
-            # Redis is non-critical, so don't mark as unhealthy
-        
+        if request.args.get('deep') == '1':
+            health_status = health_prober.probe_now()
+        else:
+            health_status = health_prober.snapshot()
         status_code = 200 if health_status["status"] in ["healthy", "degraded"] else 503
         return jsonify(health_status), status_code
     
     # Metrics endpoint
+    from .services.cache_service import CacheService
+    slow_requests = tracing.SlowRequestLog(CacheService(), size=Config.SLOW_REQUEST_BUFFER_SIZE)
+
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        tracing.start()
+        if request.headers.get('X-Profile') == '1' and _is_admin():
+            g.profiler = tracing.Profiler()
+    # First hook of all, so the rate limiter's own time is measured too
+    app.before_request_funcs.setdefault(None, []).insert(0, start_request_timer)
+
+    @app.before_request
+    def mark_rate_limit_done():
+        # Runs right after Flask-Limiter's check
+        trace = tracing.current()
+        if trace is not None:
+            trace.add("ratelimit", time.perf_counter() - trace.started)
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            metrics.record_request(request.method, _route_label(), response.status_code,
+                                   time.perf_counter() - started)
+
+        trace = tracing.finish()
+        if trace is None:
+            return response
+        # Span timings and slow-request ids are internals: only admins see them
+        admin = _is_admin()
+        if Config.SERVER_TIMING_ENABLED and admin:
+            response.headers['Server-Timing'] = tracing.server_timing_header(trace)
+
+        total_ms = round(trace.elapsed_ms(), 2)
+        record = {
+            "method": request.method,
+            "route": _route_label(),
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": total_ms,
+            "spans": trace.breakdown()
+        }
+        slow = total_ms >= Config.SLOW_REQUEST_THRESHOLD_MS
+        if slow and Config.REQUEST_TIMING_LOG != "off":
+            logger.warning("slow_request", **record)
+        elif Config.REQUEST_TIMING_LOG == "all":
+            logger.info("request_timing", **record)
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            record["profile"] = profiler.stop()
+        if slow or profiler is not None:
+            request_id = slow_requests.add(record)
+            if admin:
+                response.headers['X-Slow-Request-Id'] = request_id
+        return response
+
+    @app.route('/api/admin/slow-requests', methods=['GET'])
+    def get_slow_requests():
+        """Most recent slow or profiled requests with their timing breakdown."""
+        if not _is_admin():
+            return jsonify({"error": "Forbidden"}), 403
+        limit = request.args.get('limit', type=int)
+        return jsonify(slow_requests.recent(limit)), 200
+
     @app.route('/api/metrics', methods=['GET'])
     def get_metrics():
         """
-        Simple metrics endpoint for monitoring.
-        Returns basic statistics about the service.
+        Prometheus metrics, aggregated across all gunicorn workers.
+        ?format=json returns the per-worker component stats instead.
         """
+        if request.args.get('format') != 'json':
+            body, content_type = metrics.render()
+            return Response(body, mimetype=content_type)
+
         from .services.cache_service import CacheService
         
-        metrics = {
+        stats = {
             "service": "air_quality_api",
             "version": "1.0.0",
-            "uptime": "calculated_on_demand"
+            "uptime_seconds": round(time.time() - metrics.STARTED_AT, 1)
         }
         
         # Try to get Upstash Redis info
@@ -148,21 +216,35 @@ def create_app():
             if cache_service.client:
                 # Upstash REST API doesn't support INFO command
                 # Just report that Redis is available
-                metrics["redis"] = {
+                stats["redis"] = {
                     "status": "connected",
                     "note": "Upstash REST API - detailed stats unavailable"
                 }
+            stats["local_cache"] = cache_service.local_stats()
+            from .controllers.quality_routes import (
+                prewarmer, gemini_service, gazetteer, nominatim_client, upstream_archive
+            )
+            stats["prewarm"] = prewarmer.stats()
+            stats["gemini_cache"] = gemini_service.cache_stats()
+            stats["gazetteer"] = gazetteer.stats()
+            stats["nominatim"] = nominatim_client.stats()
+            if upstream_archive is not None:
+                stats["upstream_archive"] = upstream_archive.stats()
         except Exception as e:
             logger.error("metrics_redis_error", error=str(e))
-            metrics["redis"] = "unavailable"
+            stats["redis"] = "unavailable"
         
-        return jsonify(metrics), 200
+        return jsonify(stats), 200
     
     # Register API routes blueprint
     from .controllers.quality_routes import quality_bp, limiter as routes_limiter
     routes_limiter._limiter = limiter  # Share limiter instance
     app.register_blueprint(quality_bp, url_prefix='/api')
     
+    # Maintenance commands (flask ensure-schema, ...)
+    from .cli import register_commands
+    register_commands(app)
+    
     logger.info("application_initialized", debug=app.config['DEBUG'])
     
     return app
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""
+Maintenance commands, run with the Flask CLI:
+
+    flask --app main ensure-schema [--plan]
+    flask --app main rebuild-rollups [--days N]
+    flask --app main migrate-visits
+    flask --app main prewarm [--once]
+"""
+import json
+import click
+
+
+def register_commands(app):
+    @app.cli.command("ensure-schema")
+    @click.option("--plan", "dry_run", is_flag=True, help="Only show what would change.")
+    def ensure_schema(dry_run):
+        """Create/update Mongo indexes and backfill schema changes."""
+        from .controllers.quality_routes import db_service
+        changes = db_service.ensure_schema(dry_run=dry_run)
+        if not changes:
+            click.echo("Schema is up to date.")
+            return
+        for change in changes:
+            click.echo(json.dumps(change, default=str))
+        if dry_run:
+            click.echo(f"{len(changes)} change(s) pending.")
+            return
+        failed = sum(1 for change in changes if "error" in change)
+        click.echo(f"{len(changes) - failed} change(s) applied, {failed} failed.")
+
+    @app.cli.command("rebuild-rollups")
+    @click.option("--days", type=int, default=None, help="Only rebuild the last N days.")
+    def rebuild_rollups(days):
+        """Rebuild air_readings_daily from raw readings."""
+        from .controllers.quality_routes import db_service
+        count = db_service.rebuild_rollups(days=days)
+        click.echo(f"Rebuilt {count} daily rollup(s).")
+
+    @app.cli.command("migrate-visits")
+    def migrate_visits():
+        """Fold raw location_visits documents into daily counters."""
+        from .controllers.quality_routes import db_service
+        try:
+            folded, touched = db_service.migrate_location_visits()
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Folded {folded} visit(s) into {touched} daily counter(s).")
+
+    @app.cli.command("prewarm")
+    @click.option("--once", is_flag=True, help="Run a single cycle and exit.")
+    def prewarm(once):
+        """Keep saved locations warm in the cache (standalone process)."""
+        from .controllers.quality_routes import prewarmer
+        if once:
+            count = prewarmer.run_cycle()
+            click.echo(f"Pre-warmed {count} key(s).")
+            return
+        prewarmer.run_forever()
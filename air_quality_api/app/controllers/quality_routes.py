@@ -1,19 +1,68 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 import json
-import requests
+import os
+import time
 import sys # Importamos sys para forzar el flush de los logs
 from config import Config
 from ..services.weather_service import WeatherService
 from ..services.cache_service import CacheService
 from ..services.database_service import DatabaseService
 from ..services.gemini_service import GeminiService
+from ..services.request_coalescer import RequestCoalescer
+from ..services.swr_cache import StaleWhileRevalidateCache, is_cacheable
+from ..services.prewarm_service import PrewarmScheduler, PrewarmTarget
+from ..services.upstream_executor import run_parallel
+from ..services.gazetteer import Gazetteer
+from ..services.nominatim_client import NominatimClient
+from ..services.upstream_archive import UpstreamArchive
+from ..services import geo_keys
 
 quality_bp = Blueprint('quality', __name__)
 
-weather_service = WeatherService(api_key=Config.OPENWEATHER_API_KEY)
+# Optional record/replay of upstream traffic; replay archives load before the workers fork
+upstream_archive = UpstreamArchive(
+    Config.UPSTREAM_ARCHIVE_PATH,
+    mode=Config.UPSTREAM_ARCHIVE_MODE,
+    latency_scale=Config.UPSTREAM_REPLAY_LATENCY_SCALE,
+    live_misses=Config.UPSTREAM_REPLAY_MISSES == "live"
+) if Config.UPSTREAM_ARCHIVE_MODE != "off" else None
+
+weather_service = WeatherService(
+    api_key=Config.OPENWEATHER_API_KEY,
+    base_url=Config.OPENWEATHER_BASE_URL,
+    archive=upstream_archive
+)
 cache_service = CacheService()  # Uses Upstash Redis from environment
 db_service = DatabaseService(db_uri=Config.MONGO_URI, db_name=Config.MONGO_DB_NAME)
-gemini_service = GeminiService(api_key=Config.GEMINI_API_KEY)
+gemini_service = GeminiService(api_key=Config.GEMINI_API_KEY, archive=upstream_archive)
+coalescer = RequestCoalescer(
+    cache_service,
+    lock_ttl_seconds=Config.COALESCE_LOCK_TTL,
+    wait_timeout_seconds=Config.COALESCE_WAIT_TIMEOUT
+)
+swr_cache = StaleWhileRevalidateCache(cache_service, coalescer, beta=Config.SWR_BETA)
+nominatim_client = NominatimClient(
+    cache_service,
+    coalescer,
+    base_url=Config.NOMINATIM_URL,
+    user_agent=Config.NOMINATIM_USER_AGENT,
+    cache_ttl_seconds=Config.NOMINATIM_CACHE_TTL,
+    rate_per_second=Config.NOMINATIM_RATE_PER_SECOND,
+    max_queue_seconds=Config.NOMINATIM_MAX_QUEUE_SECONDS,
+    archive=upstream_archive
+)
+
+# Loaded once before the workers fork, so they all share the index
+gazetteer = Gazetteer()
+if os.path.exists(Config.GAZETTEER_PATH):
+    try:
+        gazetteer.load(
+            Config.GAZETTEER_PATH,
+            alternate_names=Config.GAZETTEER_ALTERNATE_NAMES,
+            min_population=Config.GAZETTEER_MIN_POPULATION
+        )
+    except Exception as e:
+        print(f"Could not load gazetteer from {Config.GAZETTEER_PATH}: {e}")
 
 # Placeholder limiter object (will be replaced by app initialization)
 class _LimiterPlaceholder:
@@ -26,64 +75,247 @@ def log_and_flush(message):
     print(message, file=sys.stderr)
     sys.stderr.flush()
 
+def _coordinates_arg():
+    """(lat, lon) from the query string, or a 400 response if missing or invalid."""
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if lat is None or lon is None:
+        return None, (jsonify({"error": "Faltan los parámetros 'lat' y 'lon'"}), 400)
+    try:
+        return geo_keys.validate_coordinates(lat, lon), None
+    except ValueError:
+        return None, (jsonify({"error": "Parámetros 'lat' y 'lon' inválidos"}), 400)
+
+def _fetch_air_quality(lat, lon):
+    """
+    Upstream path for /air_quality: fetch and persist a single reading. The
+    result is cached for the whole cell, so it is fetched at the cell center
+    rather than wherever the first requester happened to be.
+    """
+    cell_lat, cell_lon = geo_keys.cell_center(lat, lon, "air_quality")
+    data = weather_service.get_air_quality(cell_lat, cell_lon)
+    if is_cacheable(data):
+        db_service.save_reading(data)
+    return data
+
+def _get_air_quality(lat, lon):
+    """
+    Cached AQI reading for a coordinate's cell. Misses are coalesced per
+    cell; stale entries are served immediately and refreshed in the background.
+    """
+    return swr_cache.get(
+        geo_keys.cache_keys("air_quality", lat, lon),
+        lambda: _fetch_air_quality(lat, lon),
+        soft_ttl=Config.AIR_QUALITY_SOFT_TTL,
+        hard_ttl=Config.AIR_QUALITY_HARD_TTL
+    )
+
+def _fetch_history(lat, lon, days):
+    cell_lat, cell_lon = geo_keys.cell_center(lat, lon, "history")
+    return weather_service.get_air_quality_history(cell_lat, cell_lon, days)
+
+def _upstream_ttl(grace=0):
+    """TTL until an entry's upstream "expires_at" (plus grace), never below WEATHER_MIN_TTL."""
+    def ttl(entry):
+        return max(Config.WEATHER_MIN_TTL, int(entry["expires_at"] - time.time())) + grace
+    return ttl
+
+def _fetch_current_weather(lat, lon, lang):
+    cell_lat, cell_lon = geo_keys.cell_center(lat, lon, "weather")
+    return weather_service.fetch_current_weather(cell_lat, cell_lon, lang)
+
+def _fetch_forecast(lat, lon):
+    cell_lat, cell_lon = geo_keys.cell_center(lat, lon, "forecast")
+    return weather_service.fetch_forecast(cell_lat, cell_lon)
+
+def _get_current_weather(lat, lon, lang):
+    """Current weather for the cell in lang, cached until the next observation is due."""
+    entry = swr_cache.get(
+        geo_keys.cache_keys("weather", lat, lon, lang),
+        lambda: _fetch_current_weather(lat, lon, lang),
+        soft_ttl=_upstream_ttl(),
+        hard_ttl=_upstream_ttl(Config.WEATHER_STALE_GRACE)
+    )
+    return entry["current"] if entry else None
+
+def _get_forecast(lat, lon):
+    """Daily forecast for the cell, shared by all languages, cached until the next 3h slot."""
+    entry = swr_cache.get(
+        geo_keys.cache_keys("forecast", lat, lon),
+        lambda: _fetch_forecast(lat, lon),
+        soft_ttl=_upstream_ttl(),
+        hard_ttl=_upstream_ttl(Config.FORECAST_STALE_GRACE)
+    )
+    return entry["forecast"] if entry else []
+
+# Keeps saved locations warm; started per worker from gunicorn.conf.py
+prewarmer = PrewarmScheduler(
+    db_service,
+    swr_cache,
+    targets=[
+        PrewarmTarget(
+            "air_quality",
+            keys_for=lambda lat, lon: geo_keys.cache_keys("air_quality", lat, lon),
+            loader_for=lambda lat, lon: lambda: _fetch_air_quality(lat, lon),
+            soft_ttl=Config.AIR_QUALITY_SOFT_TTL,
+            hard_ttl=Config.AIR_QUALITY_HARD_TTL
+        ),
+        PrewarmTarget(
+            "history",
+            keys_for=lambda lat, lon: geo_keys.cache_keys("history", lat, lon, 7),
+            loader_for=lambda lat, lon: lambda: _fetch_history(lat, lon, 7),
+            soft_ttl=Config.HISTORY_SOFT_TTL,
+            hard_ttl=Config.HISTORY_HARD_TTL
+        ),
+        PrewarmTarget(
+            "forecast",
+            keys_for=lambda lat, lon: geo_keys.cache_keys("forecast", lat, lon),
+            loader_for=lambda lat, lon: lambda: _fetch_forecast(lat, lon),
+            soft_ttl=_upstream_ttl(),
+            hard_ttl=_upstream_ttl(Config.FORECAST_STALE_GRACE)
+        ),
+    ] + [
+        PrewarmTarget(
+            f"weather:{lang}",
+            keys_for=lambda lat, lon, lang=lang: geo_keys.cache_keys("weather", lat, lon, lang),
+            loader_for=lambda lat, lon, lang=lang: lambda: _fetch_current_weather(lat, lon, lang),
+            soft_ttl=_upstream_ttl(),
+            hard_ttl=_upstream_ttl(Config.WEATHER_STALE_GRACE)
+        )
+        for lang in Config.PREWARM_WEATHER_LANGS
+    ],
+    interval_seconds=Config.PREWARM_INTERVAL,
+    lead_seconds=Config.PREWARM_LEAD_SECONDS,
+    rate_per_second=Config.PREWARM_RATE_PER_SECOND
+)
+
 @quality_bp.route('/air_quality', methods=['GET'])
 def get_air_quality_data():
     try:
-        lat = request.args.get('lat', type=float)
-        lon = request.args.get('lon', type=float)
-        if lat is None or lon is None:
-            return jsonify({"error": "Faltan los parámetros 'lat' y 'lon'"}), 400
-
-        cache_key = f"air_quality:{round(lat, 4)}:{round(lon, 4)}"
-        cached_data = cache_service.get(cache_key)
-        if cached_data:
-            return jsonify(json.loads(cached_data)), 200
+        coordinates, error = _coordinates_arg()
+        if error:
+            return error
+        lat, lon = coordinates
 
-        data = weather_service.get_air_quality(lat, lon)
+        data = _get_air_quality(lat, lon)
         if not data:
             return jsonify({"error": "No se pudieron obtener los datos de la API externa"}), 502
-        
-        db_service.save_reading(data)
-        cache_service.set(cache_key, json.dumps(data), ttl_seconds=900)
         return jsonify(data), 200
     except Exception as e:
         log_and_flush(f"ERROR en /air_quality: {e}")
         return jsonify({"error": "Error interno del servidor"}), 500
 
+@quality_bp.route('/air_quality/batch', methods=['POST'])
+def get_air_quality_batch():
+    """
+    AQI for many coordinates in one request.
+
+    Body: {"coordinates": [{"lat": .., "lon": ..}, ...]}
+    Points are deduplicated by cache cell, all cells are looked up in one
+    batched cache read, and only the misses go to OpenWeather with bounded
+    concurrency. Results keep the input order, each with its own status.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        coordinates = data.get('coordinates')
+        if not isinstance(coordinates, list) or not coordinates:
+            return jsonify({"error": "Se requiere una lista 'coordinates'"}), 400
+        if len(coordinates) > Config.BATCH_MAX_POINTS:
+            return jsonify({"error": f"Máximo {Config.BATCH_MAX_POINTS} coordenadas por petición"}), 400
+
+        # Validate and group points by cell
+        points = []
+        cells = {}
+        for item in coordinates:
+            try:
+                lat, lon = geo_keys.validate_coordinates(item['lat'], item['lon'])
+            except (KeyError, TypeError, ValueError):
+                points.append(None)
+                continue
+            cache_keys = geo_keys.cache_keys("air_quality", lat, lon)
+            points.append((lat, lon, cache_keys[0]))
+            cells.setdefault(cache_keys[0], (lat, lon, cache_keys))
+
+        # One batched read for every cell (and its parent, if enabled)
+        all_keys = [key for _, _, keys in cells.values() for key in keys]
+        cached_values = dict(zip(all_keys, swr_cache.read(all_keys)))
+        cell_data = {}
+        cell_status = {}
+        misses = {}
+        for cell_key, (lat, lon, keys) in cells.items():
+            hit = swr_cache.resolve(
+                keys, [cached_values[key] for key in keys],
+                lambda lat=lat, lon=lon: _fetch_air_quality(lat, lon),
+                soft_ttl=Config.AIR_QUALITY_SOFT_TTL,
+                hard_ttl=Config.AIR_QUALITY_HARD_TTL
+            )
+            if hit is not None:
+                cell_data[cell_key] = hit[0]
+                cell_status[cell_key] = "cached" if hit[1] == "fresh" else "stale"
+            else:
+                misses[cell_key] = (lat, lon, keys)
+
+        # Fetch only the misses, a few at a time
+        results, failures = run_parallel({
+            cell_key: (lambda lat=lat, lon=lon, keys=keys: swr_cache.load(
+                keys,
+                lambda: _fetch_air_quality(lat, lon),
+                soft_ttl=Config.AIR_QUALITY_SOFT_TTL,
+                hard_ttl=Config.AIR_QUALITY_HARD_TTL
+            ))
+            for cell_key, (lat, lon, keys) in misses.items()
+        }, timeout_seconds=Config.BATCH_REQUEST_DEADLINE, max_concurrency=Config.BATCH_FETCH_CONCURRENCY)
+        for cell_key, value in results.items():
+            if is_cacheable(value):
+                cell_data[cell_key] = value
+                cell_status[cell_key] = "fetched"
+            else:
+                failures[cell_key] = (value or {}).get("error", "unavailable")
+
+        response = []
+        for item, point in zip(coordinates, points):
+            if point is None:
+                response.append({"input": item, "status": "invalid", "error": "Coordenadas inválidas"})
+                continue
+            lat, lon, cell_key = point
+            if cell_key in cell_data:
+                response.append({"lat": lat, "lon": lon, "status": cell_status[cell_key], "data": cell_data[cell_key]})
+            else:
+                response.append({"lat": lat, "lon": lon, "status": "error", "error": failures.get(cell_key, "unavailable")})
+
+        return jsonify({"results": response}), 200
+    except Exception as e:
+        log_and_flush(f"ERROR en /air_quality/batch: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
 @quality_bp.route('/history', methods=['GET'])
 def get_history_data():
     try:
-        lat = request.args.get('lat', type=float)
-        lon = request.args.get('lon', type=float)
+        coordinates, error = _coordinates_arg()
+        if error:
+            return error
+        lat, lon = coordinates
         days = request.args.get('days', default=7, type=int)
+
+        # Daily rollups of our own readings, when they cover every day asked for
+        try:
+            history = db_service.get_history(lat, lon, days)
+        except Exception as e:
+            log_and_flush(f"ERROR leyendo rollups en /history: {e}")
+            history = []
+        if len(history) < days:
+            # Keyed (and fetched) per history cell so nearby users share one entry.
+            # Cached for hours (historical data doesn't change); past the soft TTL
+            # the stale copy is served while OpenWeather is queried in the background
+            history = swr_cache.get(
+                geo_keys.cache_keys("history", lat, lon, days),
+                lambda: _fetch_history(lat, lon, days),
+                soft_ttl=Config.HISTORY_SOFT_TTL,
+                hard_ttl=Config.HISTORY_HARD_TTL
+            )
         
-        if lat is None or lon is None:
-            return jsonify({"error": "Faltan los parámetros 'lat' y 'lon'"}), 400
-        
-        # Round coordinates to 2 decimal places for better cache hit rate (~1km precision)
-        lat_rounded = round(lat, 2)
-        lon_rounded = round(lon, 2)
-        
-        # Try cache first
-        cache_key = f"history:{lat_rounded}:{lon_rounded}:{days}"
-        cached_data = cache_service.get(cache_key)
-        if cached_data:
-            log_and_flush(f"Cache HIT for history: {cache_key}")
-            return jsonify(json.loads(cached_data)), 200
-        
-        log_and_flush(f"Cache MISS for history: {cache_key}, fetching from API...")
-        
-        # Fetch from OpenWeather API
-        history = weather_service.get_air_quality_history(lat_rounded, lon_rounded, days)
-        
-        if history:
-            # Cache for 6 hours (historical data doesn't change)
-            cache_service.set(cache_key, json.dumps(history), ttl_seconds=21600)
-            log_and_flush(f"Cached {len(history)} historical data points")
-            return jsonify(history), 200
-        else:
-            # Return empty array if no data available
-            return jsonify([]), 200
+        # Return empty array if no data available
+        return jsonify(history or []), 200
             
     except Exception as e:
         log_and_flush(f"ERROR en /history: {e}")
@@ -140,24 +372,97 @@ def delete_saved_location(location_id):
 @quality_bp.route('/weather', methods=['GET'])
 def get_weather_data():
     try:
-        lat = request.args.get('lat', type=float)
-        lon = request.args.get('lon', type=float)
+        coordinates, error = _coordinates_arg()
+        if error:
+            return error
+        lat, lon = coordinates
         lang = request.args.get('lang', default='es', type=str)
-        
-        if lat is None or lon is None:
-            return jsonify({"error": "Faltan los parámetros 'lat' y 'lon'"}), 400
 
-        current_weather = weather_service.get_current_weather(lat, lon, lang)
-        forecast = weather_service.get_forecast(lat, lon, lang)
+        # Both lookups go out at once: on a miss, latency is the slower of the two
+        results, _ = run_parallel({
+            "current": lambda: _get_current_weather(lat, lon, lang),
+            "forecast": lambda: _get_forecast(lat, lon)
+        }, timeout_seconds=Config.WEATHER_REQUEST_DEADLINE)
 
         return jsonify({
-            "current": current_weather,
-            "forecast": forecast
+            "current": results.get("current"),
+            "forecast": results.get("forecast", [])
         }), 200
     except Exception as e:
         log_and_flush(f"ERROR en /weather: {e}")
         return jsonify({"error": "Error interno del servidor"}), 500
 
+@quality_bp.route('/dashboard', methods=['GET'])
+def get_dashboard_data():
+    """
+    Everything a location screen needs in one request: AQI, current weather,
+    forecast and both Gemini advices. Each section degrades on its own; the
+    reasons for missing sections are reported under "errors".
+    """
+    try:
+        coordinates, error = _coordinates_arg()
+        if error:
+            return error
+        lat, lon = coordinates
+        lang = request.args.get('lang', default='es', type=str)
+
+        deadline = time.monotonic() + Config.DASHBOARD_REQUEST_DEADLINE
+        errors = {}
+
+        # Phase 1: upstream data, all at once
+        results, failures = run_parallel({
+            "air_quality": lambda: _get_air_quality(lat, lon),
+            "current": lambda: _get_current_weather(lat, lon, lang),
+            "forecast": lambda: _get_forecast(lat, lon)
+        }, timeout_seconds=Config.DASHBOARD_REQUEST_DEADLINE)
+        errors.update(failures)
+
+        air_quality = results.get("air_quality")
+        if not air_quality or "error" in air_quality:
+            errors.setdefault("air_quality", (air_quality or {}).get("error", "unavailable"))
+            air_quality = None
+        current = results.get("current")
+        if not current:
+            errors.setdefault("current", "unavailable")
+        forecast = results.get("forecast") or []
+        if not forecast:
+            errors.setdefault("forecast", "unavailable")
+
+        # Phase 2: advice, fed straight from the data fetched above
+        advice_tasks = {}
+        if air_quality and current:
+            advice_tasks["advice"] = lambda: gemini_service.get_health_advice(
+                current['condition'], air_quality, lang
+            )
+        if current and forecast:
+            advice_tasks["weather_advice"] = lambda: gemini_service.get_weather_advice({
+                'temp': current['temp'],
+                'condition': current['condition'],
+                'min_temp': forecast[0]['min_temp'],
+                'max_temp': forecast[0]['max_temp']
+            }, lang)
+        advice_results, failures = run_parallel(
+            advice_tasks, timeout_seconds=max(0, deadline - time.monotonic())
+        )
+        errors.update(failures)
+        for section in ("advice", "weather_advice"):
+            if section not in advice_results:
+                errors.setdefault(section, "missing input data")
+
+        return jsonify({
+            "air_quality": air_quality,
+            "weather": {
+                "current": current,
+                "forecast": forecast
+            },
+            "advice": advice_results.get("advice"),
+            "weather_advice": advice_results.get("weather_advice"),
+            "errors": errors
+        }), 200
+    except Exception as e:
+        log_and_flush(f"ERROR en /dashboard: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
 @quality_bp.route('/advice', methods=['POST'])
 def get_health_advice():
     try:
@@ -172,6 +477,55 @@ def get_health_advice():
         log_and_flush(f"ERROR en /advice: {e}")
         return jsonify({"error": "Error interno del servidor"}), 500
 
+def _sse_response(chunks):
+    """
+    Streams text chunks as Server-Sent Events: one `data: {"text": ...}`
+    event per chunk, then `event: done` carrying the full advice.
+    """
+    def generate():
+        parts = []
+        try:
+            for text in chunks:
+                parts.append(text)
+                yield f"data: {json.dumps({'text': text})}\n\n"
+        except Exception as e:
+            log_and_flush(f"ERROR en stream de consejo: {e}")
+            yield f"event: error\ndata: {json.dumps({'error': 'Error interno del servidor'})}\n\n"
+            return
+        yield f"event: done\ndata: {json.dumps({'advice': ''.join(parts).strip()})}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Don't let proxies buffer the stream
+    })
+
+@quality_bp.route('/advice/stream', methods=['POST'])
+def stream_health_advice():
+    """Same as /advice, streamed over SSE as Gemini generates it"""
+    data = request.get_json(silent=True)
+    if not data or 'weather' not in data or 'aqi' not in data:
+        return jsonify({"error": "Datos incompletos"}), 400
+
+    language = data.get('language', 'es')
+    return _sse_response(gemini_service.stream_health_advice(data['weather'], data['aqi'], language))
+
+@quality_bp.route('/weather-advice/stream', methods=['POST'])
+def stream_weather_advice():
+    """Same as /weather-advice, streamed over SSE as Gemini generates it"""
+    data = request.get_json(silent=True) or {}
+    temp = data.get('temp')
+    condition = data.get('condition')
+    if temp is None or not condition:
+        return jsonify({"error": "Missing required fields"}), 400
+
+    language = data.get('language', 'es')
+    return _sse_response(gemini_service.stream_weather_advice({
+        'temp': temp,
+        'condition': condition,
+        'min_temp': data.get('min_temp'),
+        'max_temp': data.get('max_temp')
+    }, language))
+
 # --- LOCATION VISIT TRACKING ---
 @quality_bp.route('/locations/visit', methods=['POST'])
 def record_location_visit():
@@ -214,25 +568,29 @@ def get_location_history():
 
 @quality_bp.route('/search', methods=['GET'])
 def search_locations():
-    """Proxy for Nominatim search to avoid CORS issues on frontend"""
+    """
+    Place search for autocomplete. Answered from the local gazetteer when it
+    has matches; only misses are proxied to Nominatim (also avoids CORS
+    issues on the frontend).
+    """
     query = request.args.get('q')
     if not query:
         return jsonify({"error": "Query required"}), 400
     
     try:
-        # Call Nominatim API
-        headers = {'User-Agent': 'AuraClimaApp/1.0'}
-        response = requests.get(
-            f'https://nominatim.openstreetmap.org/search?format=json&q={query}&limit=5',
-            headers=headers,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            return jsonify(response.json()), 200
-        else:
-            return jsonify({"error": "Failed to fetch from Nominatim"}), 502
-            
+        local_results = gazetteer.search(query, limit=5)
+        if local_results:
+            return jsonify(local_results), 200
+
+        results = nominatim_client.search(query, limit=5)
+        if isinstance(results, dict) and "error" in results:
+            if "retry_after" in results:
+                response = jsonify({"error": results["error"]})
+                response.headers["Retry-After"] = str(results["retry_after"])
+                return response, 503
+            return jsonify(results), 502
+        return jsonify(results), 200
+
     except Exception as e:
         log_and_flush(f"ERROR en /search: {e}")
         return jsonify({"error": "Error interno del servidor"}), 500
@@ -0,0 +1,181 @@
+"""
+Rate limit storage that never blocks a request on Redis.
+
+Flask-Limiter's counters live in process memory and are checked locally.
+A background thread pushes the hits each worker has counted to Redis
+every few hundred milliseconds (one pipelined call) and reads the global
+totals back, so every worker sees what the others have spent. Only keys
+hit since the last sync are sent, at most max_batch per sync, taking
+turns so none is starved; idle keys cost no Redis commands. Enforcement
+across workers is therefore approximate: a burst can overshoot a limit by
+what the other workers counted since this worker last synced that key
+(one sync interval for a key in steady use).
+
+Selected with storage_uri="localsync://" (see rate_limiter.init_limiter).
+"""
+import os
+import threading
+import time
+from limits.storage import Storage
+
+
+class _Counter:
+    __slots__ = ("synced", "pending", "expires_at", "hit")
+
+    def __init__(self, expires_at):
+        self.synced = 0       # global total as of the last sync
+        self.pending = 0      # local hits not yet pushed to Redis
+        self.expires_at = expires_at
+        self.hit = False      # used since the last sync
+
+
+class LocalSyncStorage(Storage):
+    STORAGE_SCHEME = ["localsync"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, sync_interval_ms=250, max_batch=500, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.sync_interval = float(sync_interval_ms) / 1000
+        self.max_batch = int(max_batch)
+
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._stats = {"syncs": 0, "sync_errors": 0}
+
+    @property
+    def base_exceptions(self):
+        return Exception
+
+    def incr(self, key, expiry, amount=1):
+        self._ensure_sync_thread()
+        now = time.time()
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None or counter.expires_at <= now:
+                counter = self._counters[key] = _Counter(now + expiry)
+            counter.pending += amount
+            counter.hit = True
+            return counter.synced + counter.pending
+
+    def get(self, key):
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None or counter.expires_at <= time.time():
+                return 0
+            return counter.synced + counter.pending
+
+    def get_expiry(self, key):
+        with self._lock:
+            counter = self._counters.get(key)
+            return counter.expires_at if counter is not None else time.time()
+
+    def check(self):
+        return True
+
+    def reset(self):
+        with self._lock:
+            count = len(self._counters)
+            self._counters.clear()
+        return count
+
+    def clear(self, key):
+        with self._lock:
+            self._counters.pop(key, None)
+        client = self._redis()
+        if client is not None:
+            client.delete(key)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, keys=len(self._counters))
+
+    def sync(self):
+        """Pushes pending hits to Redis and adopts the global totals and windows."""
+        client = self._redis()
+        now = time.time()
+        with self._lock:
+            for key in [k for k, c in self._counters.items() if c.expires_at <= now]:
+                del self._counters[key]
+            if client is None:
+                return
+            batch = []
+            for key, c in self._counters.items():
+                if c.hit or c.pending:
+                    batch.append((key, c.pending, c.expires_at))
+                    if len(batch) >= self.max_batch:
+                        break
+            for key, pending, _ in batch:
+                # Move to the back so the next sync starts with keys left out of this one
+                counter = self._counters[key] = self._counters.pop(key)
+                counter.pending -= pending
+                counter.hit = False
+        if not batch:
+            return
+
+        try:
+            pipeline = client.pipeline()
+            for key, pending, _ in batch:
+                if pending:
+                    pipeline.incrby(key, pending)
+                else:
+                    pipeline.get(key)
+                pipeline.ttl(key)
+            results = pipeline.exec()
+
+            # Counters created by this push still need their window
+            new_windows = [(key, expires_at) for (key, pending, expires_at), ttl in zip(batch, results[1::2])
+                           if pending and (ttl is None or ttl < 0)]
+            if new_windows:
+                pipeline = client.pipeline()
+                for key, expires_at in new_windows:
+                    pipeline.expire(key, max(1, int(expires_at - now)))
+                pipeline.exec()
+        except Exception as e:
+            print(f"Rate limit sync with Redis failed: {e}")
+            with self._lock:
+                self._stats["sync_errors"] += 1
+                # Keep the hits for the next attempt
+                for key, pending, _ in batch:
+                    counter = self._counters.get(key)
+                    if counter is not None:
+                        counter.pending += pending
+                        counter.hit = True
+            return
+
+        now = time.time()
+        with self._lock:
+            self._stats["syncs"] += 1
+            for (key, _, expires_at), total, ttl in zip(batch, results[0::2], results[1::2]):
+                counter = self._counters.get(key)
+                if counter is None or counter.expires_at != expires_at:
+                    # Gone, or a new window opened while we were syncing
+                    continue
+                counter.synced = int(total or 0)
+                if ttl is not None and ttl > 0:
+                    # Align with the window the first worker opened
+                    counter.expires_at = now + ttl
+
+    def _ensure_sync_thread(self):
+        # Started lazily so each forked gunicorn worker gets its own thread
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="ratelimit-sync", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Rate limit sync failed: {e}")
+
+    @staticmethod
+    def _redis():
+        from ..services.cache_service import CacheService
+        return CacheService().client
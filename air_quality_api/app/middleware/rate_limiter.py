@@ -8,12 +8,21 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask import request
 import os
+from config import Config
+from .local_rate_storage import LocalSyncStorage  # registers the localsync:// scheme
 
 def get_user_id():
     """
     Determine the rate limiting key (user ID from request or IP address).
+    Checks the header, then the query string, then (POST only) the JSON
+    body's user_id, which older clients send instead of the header. Flask
+    caches the parsed body, so the view doesn't parse it twice.
     """
-    user_id = request.args.get('user_id') or request.json.get('user_id') if request.is_json else None
+    user_id = request.headers.get(Config.RATELIMIT_KEY_HEADER) or request.args.get('user_id')
+    if not user_id and request.method == 'POST':
+        body = request.get_json(silent=True)
+        if isinstance(body, dict) and isinstance(body.get('user_id'), str):
+            user_id = body['user_id']
     return user_id if user_id else get_remote_address()
 
 def init_limiter(app, redis_url=None):
@@ -27,6 +36,19 @@ def init_limiter(app, redis_url=None):
     Returns:
         Configured Limiter instance
     """
+    if Config.RATELIMIT_STORAGE == "local":
+        # Counters checked in-process, reconciled with Redis in the background
+        limiter = Limiter(
+            app=app,
+            key_func=get_user_id,
+            default_limits=["200 per hour", "100 per minute"],
+            storage_uri="localsync://",
+            storage_options={"sync_interval_ms": Config.RATELIMIT_SYNC_INTERVAL_MS},
+            headers_enabled=True,
+        )
+        print("Rate limiter initialized with local counters synced to Redis")
+        return limiter
+
     # Get Upstash Redis endpoint from environment
     # Note: We need the REDIS endpoint with TLS (rediss://), not the REST endpoint (https://)
     upstash_redis_endpoint = os.getenv('UPSTASH_REDIS_ENDPOINT')
@@ -0,0 +1,148 @@
+"""
+Canonical feature vectors for Gemini advice.
+
+Raw readings almost never repeat exactly, so prompts and cache keys are
+built from a coarse, canonical description instead: AQI level, banded
+pollutant concentrations, temperature band, weather condition class and
+language. Nearby readings collapse onto the same prompt, and the set of
+distinct prompts stays small and bounded.
+
+Band boundaries can be overridden with the ADVICE_BANDS environment
+variable (a JSON object with the same shape as DEFAULT_BANDS).
+"""
+import hashlib
+import json
+from config import Config
+
+POLLUTANT_LEVELS = ["good", "fair", "moderate", "poor", "very_poor"]
+TEMPERATURE_LEVELS = ["freezing", "cold", "cool", "mild", "warm", "hot"]
+
+DEFAULT_BANDS = {
+    # Upper bounds (µg/m³) of each level, following OpenWeather's AQI scale
+    "pollutants": {
+        "pm2_5": [10, 25, 50, 75],
+        "pm10": [20, 50, 100, 200],
+        "o3": [60, 100, 140, 180],
+        "no2": [40, 70, 150, 200],
+    },
+    # Upper bounds (°C) of each temperature level
+    "temperature": [0, 10, 18, 25, 32],
+}
+
+# Keywords (es/en) that map free-text conditions onto a small set of classes,
+# covering OpenWeather's lang=es descriptions ("muy nuboso", "nevada ligera"...)
+CONDITION_CLASSES = [
+    ("storm", ["storm", "thunder", "tormenta", "eléctrica"]),
+    ("snow", ["snow", "sleet", "nieve", "nevada", "aguanieve"]),
+    ("rain", ["rain", "drizzle", "shower", "lluvia", "llovizna", "chubasco"]),
+    ("fog", ["fog", "mist", "haze", "smoke", "dust", "sand", "volcanic", "niebla", "neblina", "bruma", "calima",
+             "humo", "polvo", "arena", "ceniza"]),
+    ("clouds", ["cloud", "overcast", "nube", "nublado", "nubos"]),
+    ("clear", ["clear", "sun", "despejado", "cielo claro", "soleado"]),
+]
+
+
+# Labels used when rendering canonical features into a prompt
+LABELS = {
+    "en": {
+        "good": "good", "fair": "fair", "moderate": "moderate", "poor": "poor", "very_poor": "very poor",
+        "freezing": "freezing", "cold": "cold", "cool": "cool", "mild": "mild", "warm": "warm", "hot": "hot",
+        "clear": "clear sky", "clouds": "cloudy", "rain": "rain", "storm": "thunderstorm",
+        "snow": "snow", "fog": "fog or haze", "other": "variable",
+    },
+    "es": {
+        "good": "bueno", "fair": "aceptable", "moderate": "moderado", "poor": "malo", "very_poor": "muy malo",
+        "freezing": "helado", "cold": "frío", "cool": "fresco", "mild": "templado", "warm": "cálido", "hot": "caluroso",
+        "clear": "cielo despejado", "clouds": "nublado", "rain": "lluvia", "storm": "tormenta",
+        "snow": "nieve", "fog": "niebla o bruma", "other": "variable",
+    },
+}
+
+POLLUTANT_NAMES = {"pm2_5": "PM2.5", "pm10": "PM10", "o3": "O3", "no2": "NO2", "so2": "SO2", "co": "CO", "nh3": "NH3", "no": "NO"}
+
+
+def normalize_language(language):
+    """Supported advice language for a request's language ('en' or 'es')."""
+    return "en" if language == 'en' else "es"
+
+
+def label(value, language):
+    return LABELS[normalize_language(language)].get(value, value)
+
+
+def _load_bands():
+    bands = json.loads(json.dumps(DEFAULT_BANDS))
+    if Config.ADVICE_BANDS:
+        overrides = json.loads(Config.ADVICE_BANDS)
+        bands["pollutants"].update(overrides.get("pollutants", {}))
+        bands["temperature"] = overrides.get("temperature", bands["temperature"])
+    return bands
+
+
+BANDS = _load_bands()
+
+
+def band_index(value, bounds):
+    for i, bound in enumerate(bounds):
+        if value < bound:
+            return i
+    return len(bounds)
+
+
+def temperature_band(temp):
+    if not isinstance(temp, (int, float)):
+        return None
+    return TEMPERATURE_LEVELS[min(band_index(temp, BANDS["temperature"]), len(TEMPERATURE_LEVELS) - 1)]
+
+
+def temperature_range(band):
+    """Human-readable °C range of a temperature band, e.g. '18–25°C'."""
+    bounds = BANDS["temperature"]
+    i = TEMPERATURE_LEVELS.index(band)
+    if i == 0:
+        return f"< {bounds[0]}°C"
+    if i >= len(bounds):
+        return f"> {bounds[-1]}°C"
+    return f"{bounds[i - 1]}–{bounds[i]}°C"
+
+
+def condition_class(condition):
+    text = (condition or "").lower()
+    for name, keywords in CONDITION_CLASSES:
+        if any(keyword in text for keyword in keywords):
+            return name
+    return "other"
+
+
+def health_features(weather_summary, aqi_data, language):
+    components = aqi_data.get('components') or {}
+    pollutants = {}
+    for name, bounds in sorted(BANDS["pollutants"].items()):
+        value = components.get(name)
+        if isinstance(value, (int, float)):
+            level = min(band_index(value, bounds), len(POLLUTANT_LEVELS) - 1)
+            pollutants[name] = POLLUTANT_LEVELS[level]
+    return {
+        "kind": "health",
+        # Anything else would mint a new cache key (and Gemini call) per string
+        "language": normalize_language(language),
+        "aqi": aqi_data.get('aqi'),
+        "pollutants": pollutants,
+        "condition": condition_class(weather_summary),
+    }
+
+
+def weather_features(weather_data, language):
+    return {
+        "kind": "weather",
+        "language": normalize_language(language),
+        "temp": temperature_band(weather_data.get('temp')),
+        "min_temp": temperature_band(weather_data.get('min_temp')),
+        "max_temp": temperature_band(weather_data.get('max_temp')),
+        "condition": condition_class(weather_data.get('condition')),
+    }
+
+
+def feature_key(features):
+    canonical = json.dumps(features, sort_keys=True, separators=(',', ':'))
+    return f"gemini:v2:{hashlib.md5(canonical.encode()).hexdigest()}"
@@ -1,4 +1,41 @@
+import time
+import uuid
 from upstash_redis import Redis
+from config import Config
+from .local_cache import LocalCache
+from . import metrics
+from . import tracing
+
+# Deletes a lock only if it still holds our token (it may have expired and
+# been taken over by another worker in the meantime)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Pushes a lock's expiry out only if it still holds our token
+_EXTEND_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# GCRA slot reservation: KEYS[1] holds the theoretical arrival time (ms) of
+# the next call. Returns how long the caller must wait before its slot, or
+# -1 if that would exceed the allowed queueing delay (nothing is reserved).
+_RESERVE_SLOT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local tat = tonumber(redis.call('get', KEYS[1]) or now)
+if tat < now then tat = now end
+local wait = tat - now
+if wait > tonumber(ARGV[3]) then return -1 end
+redis.call('set', KEYS[1], tat + interval, 'PX', wait + interval + 1000)
+return wait
+"""
 
 class CacheService:
     _instance = None
@@ -9,6 +46,13 @@ class CacheService:
         return cls._instance
 
     def __init__(self):
+        if not hasattr(self, 'local'):
+            # In-process L1 tier: hot keys never leave the worker
+            self.local = LocalCache(
+                max_entries=Config.L1_CACHE_MAX_ENTRIES,
+                max_bytes=Config.L1_CACHE_MAX_BYTES,
+                max_ttl_seconds=Config.L1_CACHE_MAX_TTL or None
+            ) if Config.L1_CACHE_ENABLED else None
         if not hasattr(self, 'client'):
             try:
                 # Use Upstash Redis from environment variables
@@ -23,18 +67,144 @@ class CacheService:
                 self.client = None
 
     def get(self, key):
+        with tracing.span("cache"):
+            value = self._get(key)
+        metrics.record_cache_lookup(key, value is not None)
+        return value
+
+    def _get(self, key):
+        if self.local is not None:
+            value = self.local.get(key)
+            if value is not None:
+                return value
         if self.client:
             try:
-                return self.client.get(key)
+                if self.local is None:
+                    return self.client.get(key)
+                # Fetch the remaining TTL in the same round trip so the
+                # local copy never outlives the Redis entry
+                pipeline = self.client.pipeline()
+                pipeline.get(key)
+                pipeline.ttl(key)
+                value, ttl = pipeline.exec()
+                if value is not None and ttl and ttl > 0:
+                    self.local.set(key, value, ttl)
+                return value
             except Exception as e:
                 print(f"Error getting key {key} from Redis: {e}")
                 return None
         return None
 
-    def set(self, key, value, ttl_seconds):
+    def get_many(self, keys, skip_local=False, local_ttl=None):
+        """
+        Looks up several keys at once. Keys served by the local tier skip
+        Redis; the rest are read in a single pipelined round trip.
+        Returns values aligned with keys (None for misses).
+
+        skip_local: read Redis even for keys held locally (values are
+            still copied to the local tier)
+        local_ttl: optional callable(value) capping how long (seconds) a
+            value read from Redis may be kept locally
+        """
+        values = [None] * len(keys)
+        missing = []
+        for i, key in enumerate(keys):
+            if self.local is not None and not skip_local:
+                values[i] = self.local.get(key)
+            if values[i] is None:
+                missing.append(i)
+
+        if missing and self.client:
+            try:
+                pipeline = self.client.pipeline()
+                for i in missing:
+                    pipeline.get(keys[i])
+                    pipeline.ttl(keys[i])
+                with tracing.span("cache"):
+                    replies = pipeline.exec()
+                for n, i in enumerate(missing):
+                    value, ttl = replies[2 * n], replies[2 * n + 1]
+                    values[i] = value
+                    if self.local is not None and value is not None and ttl and ttl > 0:
+                        if local_ttl is not None:
+                            ttl = min(ttl, local_ttl(value))
+                        if ttl > 0:
+                            self.local.set(keys[i], value, ttl)
+                        else:
+                            self.local.delete(keys[i])
+            except Exception as e:
+                print(f"Error getting {len(missing)} keys from Redis: {e}")
+        for key, value in zip(keys, values):
+            metrics.record_cache_lookup(key, value is not None)
+        return values
+
+    def set(self, key, value, ttl_seconds, local_ttl_seconds=None):
+        """local_ttl_seconds: keep the local copy for less than the Redis TTL"""
+        if self.local is not None:
+            self.local.set(key, value, min(ttl_seconds, local_ttl_seconds)
+                           if local_ttl_seconds is not None else ttl_seconds)
         if self.client:
             try:
-                self.client.setex(key, ttl_seconds, value)
+                with tracing.span("cache"):
+                    self.client.setex(key, ttl_seconds, value)
             except Exception as e:
                 print(f"Error setting key {key} in Redis: {e}")
 
+    def local_stats(self):
+        """Hit/miss/eviction counters of the in-process tier."""
+        return self.local.stats() if self.local is not None else {"enabled": False}
+
+
+    def acquire_lock(self, key, ttl_seconds, fail_open=True):
+        """
+        Try to take a short-lived cross-worker lock.
+        Returns an ownership token, or None if someone else holds the lock.
+        Without Redis there is nobody to coordinate with, so the lock is
+        granted, unless fail_open is False (exclusive work that must not run
+        in every worker at once).
+        """
+        token = uuid.uuid4().hex
+        if not self.client:
+            return token if fail_open else None
+        try:
+            with tracing.span("cache"):
+                acquired = self.client.set(key, token, nx=True, ex=ttl_seconds)
+            return token if acquired else None
+        except Exception as e:
+            print(f"Error acquiring lock {key} in Redis: {e}")
+            return token if fail_open else None
+
+    def extend_lock(self, key, token, ttl_seconds):
+        """Resets a held lock's TTL. False if it is no longer ours or Redis can't confirm it."""
+        if not self.client:
+            return False
+        try:
+            with tracing.span("cache"):
+                return bool(self.client.eval(_EXTEND_LOCK_SCRIPT, keys=[key], args=[token, int(ttl_seconds)]))
+        except Exception as e:
+            print(f"Error extending lock {key} in Redis: {e}")
+            return False
+
+    def release_lock(self, key, token):
+        if self.client:
+            try:
+                with tracing.span("cache"):
+                    self.client.eval(_RELEASE_LOCK_SCRIPT, keys=[key], args=[token])
+            except Exception as e:
+                print(f"Error releasing lock {key} in Redis: {e}")
+
+    def reserve_slot(self, key, interval_ms, max_wait_ms):
+        """
+        Reserves the next slot of a global rate limit shared by all workers.
+        Returns milliseconds to wait before going ahead, -1 if the queue is
+        already longer than max_wait_ms, or None if Redis is unavailable.
+        """
+        if not self.client:
+            return None
+        try:
+            now_ms = int(time.time() * 1000)
+            with tracing.span("cache"):
+                return int(self.client.eval(_RESERVE_SLOT_SCRIPT, keys=[key], args=[now_ms, int(interval_ms), int(max_wait_ms)]))
+        except Exception as e:
+            print(f"Error reserving rate slot {key} in Redis: {e}")
+            return None
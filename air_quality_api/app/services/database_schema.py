@@ -0,0 +1,133 @@
+"""
+Index and schema management for the MongoDB collections.
+
+INDEX_SPECS declares every index the services rely on. plan() compares it
+with what exists and reports what would change; apply() makes the changes.
+Both are idempotent, so this runs safely on every startup.
+"""
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE
+from config import Config
+
+
+def index_specs():
+    """Declared indexes per collection: (name, keys, options)."""
+    return {
+        "air_readings": [
+            ("location_2dsphere", [("location", GEOSPHERE)], {}),
+            ("saved_at_ttl", [("saved_at", ASCENDING)],
+             {"expireAfterSeconds": Config.READINGS_RETENTION_DAYS * 86400}),
+        ],
+        "air_readings_daily": [
+            ("cell_day", [("cell", ASCENDING), ("day", ASCENDING)], {"unique": True}),
+        ],
+        "saved_locations": [
+            # Backs the upsert in add_saved_location
+            ("user_id_name", [("user_id", ASCENDING), ("name", ASCENDING)], {"unique": True}),
+        ],
+        # Legacy one-document-per-visit collection, kept until migrated
+        "location_visits": [
+            ("user_id_visited_at", [("user_id", ASCENDING), ("visited_at", DESCENDING)], {}),
+            ("visited_at_ttl", [("visited_at", ASCENDING)],
+             {"expireAfterSeconds": Config.VISITS_RETENTION_DAYS * 86400}),
+        ],
+        "location_visits_daily": [
+            ("user_id_day", [("user_id", ASCENDING), ("day", DESCENDING)], {}),
+            # One counter per visit key: concurrent upserts can't create duplicates
+            ("visit_key", [("user_id", ASCENDING), ("location_name", ASCENDING), ("latitude", ASCENDING),
+                           ("longitude", ASCENDING), ("day", ASCENDING)], {"unique": True}),
+            ("date_ttl", [("date", ASCENDING)],
+             {"expireAfterSeconds": Config.VISITS_RETENTION_DAYS * 86400}),
+        ],
+    }
+
+
+# Readings saved before the GeoJSON field existed only carry "coordinates"
+_MISSING_LOCATION = {"location": {"$exists": False}, "coordinates.lat": {"$exists": True}}
+_SET_LOCATION = [{"$set": {"location": {
+    "type": "Point",
+    "coordinates": ["$coordinates.lon", "$coordinates.lat"]
+}}}]
+
+
+def plan(db):
+    """
+    Returns the list of changes needed, without applying them. Each change is
+    a dict with "action" (create, make_unique, update_ttl, backfill_location),
+    "collection" and details.
+    """
+    changes = []
+    for collection_name, specs in index_specs().items():
+        existing = db[collection_name].index_information()
+        existing_by_keys = {tuple(info["key"]): (name, info) for name, info in existing.items()}
+        for name, keys, options in specs:
+            match = existing_by_keys.get(tuple(keys))
+            if match is None:
+                changes.append({"action": "create", "collection": collection_name,
+                                "index": name, "keys": keys, "options": options})
+                continue
+            existing_name, info = match
+            if options.get("unique") and not info.get("unique"):
+                # Same keys but not unique: rebuilt (fails if duplicates exist)
+                changes.append({"action": "make_unique", "collection": collection_name,
+                                "index": existing_name, "name": name, "keys": keys, "options": options})
+                continue
+            ttl = options.get("expireAfterSeconds")
+            if ttl is not None and info.get("expireAfterSeconds") != ttl:
+                changes.append({"action": "update_ttl", "collection": collection_name,
+                                "index": existing_name, "from": info.get("expireAfterSeconds"), "to": ttl})
+
+    pending = db.air_readings.count_documents(_MISSING_LOCATION)
+    if pending:
+        changes.append({"action": "backfill_location", "collection": "air_readings", "documents": pending})
+    return changes
+
+
+def apply(db, changes=None):
+    """
+    Applies a plan (computing it first if not given) and returns it. A change
+    that fails gets an "error" entry and the rest are still applied.
+    """
+    if changes is None:
+        changes = plan(db)
+    for change in changes:
+        try:
+            _apply_change(db, change)
+        except Exception as e:
+            change["error"] = str(e)
+            print(f"Schema change {change['action']} on {change['collection']} failed: {e}")
+    return changes
+
+
+def _apply_change(db, change):
+    collection = db[change["collection"]]
+    if change["action"] == "create":
+        collection.create_index(change["keys"], name=change["index"], **change["options"])
+    elif change["action"] == "make_unique":
+        _make_unique(collection, change)
+    elif change["action"] == "update_ttl":
+        db.command("collMod", change["collection"],
+                   index={"name": change["index"], "expireAfterSeconds": change["to"]})
+    elif change["action"] == "backfill_location":
+        collection.update_many(_MISSING_LOCATION, _SET_LOCATION)
+
+
+def _make_unique(collection, change):
+    # Mongo won't hold a unique and a plain index on the same keys, so the old
+    # one has to go first: only drop it once no duplicates stand in the way
+    fields = [field for field, _ in change["keys"]]
+    duplicates = list(collection.aggregate([
+        {"$group": {"_id": {field.replace(".", "_"): f"${field}" for field in fields}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": 1}
+    ], allowDiskUse=True))
+    if duplicates:
+        raise ValueError(f"duplicate {', '.join(fields)} values (e.g. {duplicates[0]['_id']}); "
+                         f"kept the non-unique {change['index']} index")
+
+    collection.drop_index(change["index"])
+    try:
+        collection.create_index(change["keys"], name=change["name"], **change["options"])
+    except Exception:
+        # Duplicates written in the meantime: put the old index back
+        collection.create_index(change["keys"], name=change["index"])
+        raise
@@ -1,8 +1,15 @@
 from pymongo import MongoClient, errors
-from datetime import datetime, timedelta
+from datetime import datetime
 from bson import ObjectId
 import certifi
 import threading 
+from config import Config
+from .write_buffer import WriteBehindBuffer
+from . import database_schema
+from . import readings_rollup
+from . import visit_counters
+from . import metrics
+from . import tracing
 
 class DatabaseService:
     _instance = None
@@ -24,8 +31,8 @@ class DatabaseService:
                     try:
                         self.client = MongoClient(
                             db_uri,
-                            tls=True,
-                            tlsCAFile=certifi.where(),
+                            tls=Config.MONGO_TLS,
+                            tlsCAFile=certifi.where() if Config.MONGO_TLS else None,
                             serverSelectionTimeoutMS=5000,
                             # Connection pool configuration for production
                             maxPoolSize=50,  # Maximum connections in pool
@@ -33,6 +40,7 @@ class DatabaseService:
                             maxIdleTimeMS=45000,  # Close idle connections after 45s
                             retryWrites=True,  # Automatically retry failed writes
                             retryReads=True,   # Automatically retry failed reads
+                            event_listeners=[metrics.MongoPoolListener(), tracing.MongoCommandTimer()],
                         )
                         self.client.admin.command('ping')
                         print("Conexión a MongoDB establecida con pool de conexiones.")
@@ -41,21 +49,71 @@ class DatabaseService:
                         print(f"ERROR CRÍTICO: No se pudo conectar a MongoDB. Error: {e}")
                         self.client = None
                         self.db = None
+
+                    # Inserts are queued and flushed in bulk off the request thread
+                    self.writer = None
+                    if self.db is not None and Config.WRITE_BEHIND_ENABLED:
+                        self.writer = WriteBehindBuffer(
+                            self.db,
+                            max_pending=Config.WRITE_BEHIND_MAX_PENDING,
+                            batch_size=Config.WRITE_BEHIND_BATCH_SIZE,
+                            flush_interval_seconds=Config.WRITE_BEHIND_FLUSH_INTERVAL
+                        )
+
+    def _insert(self, collection_name, document):
+        if self.writer is not None:
+            self.writer.insert(collection_name, document)
+        else:
+            self.db[collection_name].insert_one(document)
+
+    def _upsert(self, collection_name, filter, update):
+        if self.writer is not None:
+            self.writer.upsert(collection_name, filter, update)
+        else:
+            self.db[collection_name].update_one(filter, update, upsert=True)
+
+    def flush_writes(self):
+        """Writes out any buffered documents (called on worker exit)."""
+        if getattr(self, 'writer', None) is not None:
+            self.writer.close()
                 
+    def ensure_schema(self, dry_run=False):
+        """
+        Creates missing indexes, syncs TTLs and backfills GeoJSON locations.
+        With dry_run=True only reports the plan. Returns the list of changes.
+        """
+        if self.db is None: return []
+        if dry_run:
+            return database_schema.plan(self.db)
+        return database_schema.apply(self.db)
+
     def save_reading(self, reading_data):
         if self.db is None: return
         data_to_save = reading_data.copy()
         data_to_save['saved_at'] = datetime.utcnow()
-        self.db.air_readings.insert_one(data_to_save)
+        coordinates = data_to_save.get('coordinates') or {}
+        if 'lat' in coordinates and 'lon' in coordinates:
+            # GeoJSON point for the 2dsphere index used by get_history
+            data_to_save['location'] = {
+                "type": "Point",
+                "coordinates": [coordinates['lon'], coordinates['lat']]
+            }
+        self._insert("air_readings", data_to_save)
+
+        # Keep the per-cell daily rollup in step with the raw readings
+        rollup = readings_rollup.rollup_update(data_to_save)
+        if rollup is not None:
+            self._upsert(readings_rollup.ROLLUP_COLLECTION, *rollup)
 
     def get_history(self, lat, lon, days=7):
+        """Daily average AQI around a point, read from the pre-aggregated rollups"""
         if self.db is None: return []
-        start_date = datetime.utcnow() - timedelta(days=days)
-        query = { "location": { "$geoWithin": { "$centerSphere": [[lon, lat], 1 / 6378.1] } }, "saved_at": {"$gte": start_date} }
-        pipeline = [ {'$match': query}, {'$group': { '_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$saved_at'}}, 'avg_aqi': {'$avg': '$aqi'} }}, {'$sort': {'_id': -1}}, {'$limit': days} ]
-        results = list(self.db.air_readings.aggregate(pipeline))
-        formatted_results = [ {"date": item['_id'], "aqi": round(item['avg_aqi'])} for item in results ]
-        return formatted_results
+        return readings_rollup.read_history(self.db, lat, lon, days)
+
+    def rebuild_rollups(self, days=None):
+        """Recomputes daily rollups from raw readings (all, or the last N days)"""
+        if self.db is None: return 0
+        return readings_rollup.rebuild(self.db, days)
 
     def get_saved_locations(self, user_id):
         """Get saved locations for a specific user"""
@@ -66,6 +124,16 @@ class DatabaseService:
             loc['_id'] = str(loc['_id'])
         return locations
 
+    def get_saved_coordinates(self):
+        """(lat, lon) of every saved location, across all users"""
+        if self.db is None: return []
+        cursor = self.db.saved_locations.find({}, {"_id": 0, "latitude": 1, "longitude": 1})
+        return [
+            (doc['latitude'], doc['longitude'])
+            for doc in cursor
+            if doc.get('latitude') is not None and doc.get('longitude') is not None
+        ]
+
     def add_saved_location(self, location_data, user_id):
         """Add or update a saved location with user ownership"""
         if self.db is None: return
@@ -86,57 +154,18 @@ class DatabaseService:
     def record_location_visit(self, user_id, lat, lon, location_name):
         """Record a location visit/search by the user"""
         if self.db is None: return
-        visit_data = {
-            "user_id": user_id,
-            "latitude": lat,
-            "longitude": lon,
-            "location_name": location_name,
-            "visited_at": datetime.utcnow()
-        }
-        self.db.location_visits.insert_one(visit_data)
+        # One counter per user, location and day instead of one document per visit
+        filter, update = visit_counters.counter_update(
+            user_id, lat, lon, location_name, datetime.utcnow()
+        )
+        self._upsert(visit_counters.COUNTER_COLLECTION, filter, update)
 
     def get_location_history(self, user_id, days=7):
         """Get location visit history for user, grouped by location"""
         if self.db is None: return []
-        
-        start_date = datetime.utcnow() - timedelta(days=days)
-        pipeline = [
-            {
-                "$match": {
-                    "user_id": user_id,
-                    "visited_at": {"$gte": start_date}
-                }
-            },
-            {
-                "$group": {
-                    "_id": {
-                        "name": "$location_name",
-                        "lat": "$latitude",
-                        "lon": "$longitude"
-                    },
-                    "last_visit": {"$max": "$visited_at"},
-                    "visit_count": {"$sum": 1}
-                }
-            },
-            {
-                "$sort": {"last_visit": -1}
-            },
-            {
-                "$limit": 50
-            }
-        ]
-        
-        results = list(self.db.location_visits.aggregate(pipeline))
-        
-        formatted_results = [
-            {
-                "location_name": item['_id']['name'],
-                "latitude": item['_id']['lat'],
-                "longitude": item['_id']['lon'],
-                "visited_at": item['last_visit'].isoformat(),
-                "search_count": item['visit_count']
-            }
-            for item in results
-        ]
-        
-        return formatted_results
+        return visit_counters.read_history(self.db, user_id, days)
+
+    def migrate_location_visits(self):
+        """Folds raw one-per-visit documents into the daily counters"""
+        if self.db is None: return 0, 0
+        return visit_counters.migrate_raw_visits(self.db)
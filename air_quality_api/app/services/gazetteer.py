@@ -0,0 +1,164 @@
+"""
+Offline place-name index for /search autocomplete.
+
+Loads a GeoNames cities dump (e.g. cities15000.txt, optionally gzipped)
+into a sorted array of normalized names searched by binary search, so
+most keystrokes are answered locally instead of going to Nominatim.
+Names are matched accent- and case-insensitively by prefix and ranked by
+population. Results use Nominatim's field names so the app can't tell
+the two apart.
+"""
+import bisect
+import gzip
+import heapq
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+
+# Prefixes up to this length match too many names to rank on every query,
+# so their top results are computed once at load time
+SHORT_PREFIX_LENGTH = 3
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    """
+    Casefolded, accent-free, punctuation collapsed to single spaces. Letters
+    and digits of every script are kept ("Москва" stays "москва").
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_WORD.sub(" ", stripped.casefold()).strip()
+
+
+class Gazetteer:
+    def __init__(self, max_results=10):
+        self.max_results = max_results
+
+        self._keys = []              # sorted normalized names
+        self._ids = array("i")       # place index for each key
+        self._places = []            # (name, admin1, country, lat, lon, population)
+        self._population = array("q")  # population per place index (fast ranking key)
+        self._short = {}             # short prefix -> top place indexes
+        self._stats = {"hits": 0, "misses": 0}
+        self._stats_lock = threading.Lock()
+        self.loaded_from = None
+        self.load_seconds = 0.0
+
+    def __len__(self):
+        return len(self._places)
+
+    def load(self, path, alternate_names=True, min_population=0):
+        """
+        Loads a GeoNames dump. An admin1CodesASCII.txt next to it, if any,
+        adds region names to the results. Returns the number of places.
+        """
+        started = time.monotonic()
+        admin1 = self._load_admin1(os.path.join(os.path.dirname(path), "admin1CodesASCII.txt"))
+
+        places, entries = [], []
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) < 15:
+                    continue
+                try:
+                    population = int(cols[14] or 0)
+                    lat, lon = float(cols[4]), float(cols[5])
+                except ValueError:
+                    continue
+                if population < min_population:
+                    continue
+
+                idx = len(places)
+                country = cols[8]
+                places.append((cols[1], admin1.get(f"{country}.{cols[10]}", ""), country, lat, lon, population))
+
+                names = {cols[1], cols[2]}
+                if alternate_names and cols[3]:
+                    names.update(cols[3].split(","))
+                for key in {normalize(name) for name in names}:
+                    if key:
+                        entries.append((key, idx))
+
+        entries.sort()
+        self._places = places
+        self._population = array("q", (place[5] for place in places))
+        self._keys = [key for key, _ in entries]
+        self._ids = array("i", (idx for _, idx in entries))
+        self._short = self._build_short_prefixes()
+        self.loaded_from = path
+        self.load_seconds = round(time.monotonic() - started, 3)
+        return len(places)
+
+    def search(self, query, limit=5):
+        """Places whose name starts with query, most populated first."""
+        limit = min(limit, self.max_results)
+        prefix = normalize(query)
+        if not prefix or not self._keys:
+            return []
+
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            top = self._short.get(prefix, [])[:limit]
+        else:
+            top = self._rank(prefix, limit)
+
+        self._count("hits" if top else "misses")
+        return [self._to_result(idx) for idx in top]
+
+    def stats(self):
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return dict(counters, places=len(self._places), names=len(self._keys),
+                    load_seconds=self.load_seconds)
+
+    def _rank(self, prefix, limit):
+        # Every key starting with prefix sorts between prefix and its successor
+        start = bisect.bisect_left(self._keys, prefix)
+        end = bisect.bisect_left(self._keys, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo=start)
+        # Whole match range, deduplicated (alternate names) and ranked at C speed
+        return heapq.nlargest(limit, set(self._ids[start:end]), key=self._population.__getitem__)
+
+    def _build_short_prefixes(self):
+        best = {}
+        for key, idx in zip(self._keys, self._ids):
+            for n in range(1, min(len(key), SHORT_PREFIX_LENGTH) + 1):
+                best.setdefault(key[:n], set()).add(idx)
+        return {
+            prefix: heapq.nlargest(self.max_results, ids, key=self._population.__getitem__)
+            for prefix, ids in best.items()
+        }
+
+    def _to_result(self, idx):
+        name, admin1, country, lat, lon, population = self._places[idx]
+        return {
+            "place_id": f"geonames:{idx}",
+            "name": name,
+            "display_name": ", ".join(part for part in (name, admin1, country) if part),
+            "lat": str(lat),
+            "lon": str(lon),
+            "type": "city",
+            "population": population,
+            "source": "local"
+        }
+
+    @staticmethod
+    def _load_admin1(path):
+        names = {}
+        if not os.path.exists(path):
+            return names
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) >= 2:
+                    names[cols[0]] = cols[1]
+        return names
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
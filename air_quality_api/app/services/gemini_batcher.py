@@ -0,0 +1,135 @@
+"""
+Optional micro-batching of concurrent Gemini generations.
+
+Pending prompts are collected for a few milliseconds and sent as a single
+structured request that asks for a JSON array with one answer per item.
+If the reply can't be parsed into exactly one answer per item, every
+prompt in the batch is retried as a normal single call. Batches and single
+calls run on a bounded pool of their own (not the shared upstream pool,
+whose tasks may be the ones waiting on these results).
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import json
+import os
+import queue
+import threading
+import time
+
+BATCH_INSTRUCTIONS = """You will receive {count} independent tasks. Solve each one on its own, following its own instructions and language.
+Reply ONLY with a JSON array of {count} strings, where element i is the complete answer to task i.
+"""
+
+
+class GeminiBatcher:
+    def __init__(self, model, max_batch_size=8, max_wait_ms=15, timeout_seconds=30, max_concurrency=8):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000.0
+        self.timeout_seconds = timeout_seconds
+        self.max_concurrency = max_concurrency
+
+        self._queue = queue.Queue()
+        self._executor = None
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "batched_items": 0, "single_calls": 0, "fallbacks": 0}
+
+    def generate(self, prompt):
+        """Returns the generated text for prompt, possibly sharing a request with others."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((prompt, future))
+        try:
+            return future.result(timeout=self.timeout_seconds)
+        except FutureTimeoutError:
+            # Still queued behind a saturated pool: don't send it at all
+            future.cancel()
+            raise
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats, pending=self._queue.qsize())
+
+    def _ensure_started(self):
+        # One collector thread and pool per gunicorn worker
+        if self._thread_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                    thread_name_prefix="gemini-batch")
+                threading.Thread(target=self._run, name="gemini-batcher", daemon=True).start()
+                self._thread_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Don't hold up the next batch while this one is in flight
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        # Skip prompts whose caller already gave up waiting
+        batch = [(prompt, future) for prompt, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        if len(batch) == 1:
+            self._single(batch)
+            return
+        try:
+            answers = self._generate_batch([prompt for prompt, _ in batch])
+        except Exception as e:
+            print(f"Gemini batch of {len(batch)} failed, falling back to single calls: {e}")
+            answers = None
+        if answers is None:
+            self._count("fallbacks")
+            self._single(batch)
+            return
+        self._count("batches")
+        self._count("batched_items", len(batch))
+        for (_, future), answer in zip(batch, answers):
+            future.set_result(answer)
+
+    def _generate_batch(self, prompts):
+        parts = [BATCH_INSTRUCTIONS.format(count=len(prompts))]
+        for i, prompt in enumerate(prompts, start=1):
+            parts.append(f"### Task {i}\n{prompt.strip()}\n")
+        response = self.model.generate_content(
+            "\n".join(parts),
+            generation_config={"response_mime_type": "application/json"}
+        )
+        try:
+            answers = json.loads(response.text)
+        except ValueError:
+            return None
+        if not isinstance(answers, list) or len(answers) != len(prompts):
+            return None
+        if not all(isinstance(answer, str) and answer.strip() for answer in answers):
+            return None
+        return answers
+
+    def _single(self, batch):
+        self._count("single_calls", len(batch))
+        # The first call runs here; the rest go to the pool (queued if it is busy)
+        for prompt, future in batch[1:]:
+            self._executor.submit(self._generate_one, prompt, future)
+        self._generate_one(*batch[0])
+
+    def _generate_one(self, prompt, future):
+        try:
+            future.set_result(self.model.generate_content(prompt).text)
+        except Exception as e:
+            future.set_exception(e)
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
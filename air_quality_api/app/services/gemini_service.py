@@ -1,35 +1,88 @@
 import google.generativeai as genai
-import hashlib
-import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import contextvars
 import os
+import queue
+import threading
+import time
+from config import Config
+from . import advice_features
+from . import local_advice
+from . import metrics
+from .gemini_batcher import GeminiBatcher
 
 class GeminiService:
-    def __init__(self, api_key):
+    def __init__(self, api_key, archive=None):
         """
         Inicializa el servicio de Gemini con API key.
+        archive: optional UpstreamArchive recording or replaying generations.
        """
         if not api_key:
             raise ValueError("La clave de API de Gemini no puede estar vacía.")
-        genai.configure(api_key=api_key)
+        if Config.GEMINI_API_ENDPOINT:
+            # Alternate endpoint (e.g. a local stand-in for benchmarks) over REST
+            genai.configure(api_key=api_key, transport="rest",
+                            client_options={"api_endpoint": Config.GEMINI_API_ENDPOINT})
+        else:
+            genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel('gemini-2.5-flash-lite')
+        if archive is not None:
+            self.model = archive.wrap_model(self.model)
         
         # Cache service for Gemini responses (uses Upstash Redis)
         from .cache_service import CacheService
         self.cache_service = CacheService()
+        self._stats = {"hits": 0, "misses": 0, "local": 0}
+        self._stats_lock = threading.Lock()
+        self._budget_window_start = time.monotonic()
+        self._budget_used = 0
+        self._pending = set()
+        # Bounded pool for timed, background and timed streaming generations
+        self._executor = None
+        self._executor_pid = None
+
+        # Optional micro-batching of concurrent generations
+        self.batcher = GeminiBatcher(
+            self.model,
+            max_batch_size=Config.GEMINI_BATCH_MAX_SIZE,
+            max_wait_ms=Config.GEMINI_BATCH_MAX_WAIT_MS,
+            timeout_seconds=Config.GEMINI_BATCH_TIMEOUT,
+            max_concurrency=Config.GEMINI_BATCH_MAX_CONCURRENCY
+        ) if Config.GEMINI_BATCHING_ENABLED else None
     
-    def _get_cache_key(self, prompt):
-        """Generate cache key from prompt hash"""
-        prompt_hash = hashlib.md5(prompt.encode()).hexdigest()
-        return f"gemini:{prompt_hash}"
+    def _generate(self, prompt):
+        """Single generation, routed through the micro-batcher when enabled"""
+        with metrics.upstream_call("gemini", "generate_content"):
+            if self.batcher is not None:
+                return self.batcher.generate(prompt)
+            return self.model.generate_content(prompt).text
     
-    def get_health_advice(self, weather_summary, aqi_data, language='es'):
-        """
-        Genera consejos de salud personalizados usando Gemini.
-        Uses caching to avoid redundant API calls for identical prompts.
-        """
-        try:
-            if language == 'en':
-                prompt = f"""
+    def _get_cache_key(self, features):
+        """Generate cache key from the canonical feature vector"""
+        return advice_features.feature_key(features)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def cache_stats(self):
+        """Advice cache hits/misses; the hit ratio shows how well features collapse"""
+        with self._stats_lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            stats = dict(self._stats, hit_ratio=round(self._stats["hits"] / lookups, 4) if lookups else 0.0)
+        if self.batcher is not None:
+            stats["batching"] = self.batcher.stats()
+        return stats
+
+    def _render_health_prompt(self, features):
+        language = features['language']
+        pollutants = ", ".join(
+            f"{advice_features.POLLUTANT_NAMES.get(name, name)}: {advice_features.label(level, language)}"
+            for name, level in features['pollutants'].items()
+        ) or "-"
+        condition = advice_features.label(features['condition'], language)
+        if language == 'en':
+            return f"""
                 Act as an environmental health expert. Generate a personalized and direct recommendation (maximum 3 lines).
                 
                 Required format:
@@ -40,12 +93,11 @@ class GeminiService:
                 High: Wear a mask and avoid going outside.
                 
                 Current data:
-                Weather: {weather_summary}
-                AQI: {aqi_data.get('aqi')}
-                Components: {aqi_data.get('components')}
+                Weather: {condition}
+                AQI: {features['aqi']}
+                Pollutant levels: {pollutants}
                 """
-            else:  # Spanish
-                prompt = f"""
+        return f"""
                 Actúa como un experto en salud ambiental. Genera un consejo personalizado y directo (máximo 3 renglones).
                 
                 Formato obligatorio:
@@ -56,47 +108,22 @@ class GeminiService:
                 Alto: Usa mascarilla y evita salir.
                 
                 Datos actuales:
-                Clima: {weather_summary}
-                AQI: {aqi_data.get('aqi')}
-                Componentes: {aqi_data.get('components')}
+                Clima: {condition}
+                AQI: {features['aqi']}
+                Niveles de contaminantes: {pollutants}
                 """
-            
-            # Check cache first
-            cache_key = self._get_cache_key(prompt)
-            cached_response = self.cache_service.get(cache_key)
-            if cached_response:
-                print(f"Cache HIT for Gemini health advice")
-                return cached_response.decode('utf-8') if isinstance(cached_response, bytes) else cached_response
-            
-            # Call Gemini API
-            response = self.model.generate_content(prompt)
-            advice = response.text.strip()
-            
-            # Cache response for 1 hour (advice doesn't change frequently)
-            self.cache_service.set(cache_key,  advice, ttl_seconds=3600)
-            print(f"Cache MISS for Gemini health advice - cached for 1 hour")
-            
-            return advice
-        except Exception as e:
-            print(f"Error al llamar a Gemini: {e}")
-            if language == 'en':
-                return "Could not generate personalized advice at this time. Stay safe."
-            else:
-                return "No se pudo generar un consejo personalizado en este momento. Mantente seguro."
-    
-    def get_weather_advice(self, weather_data, language='es'):
-        """
-        Genera consejos personalizados para el clima usando Gemini.
-        Uses caching to avoid redundant API calls for identical prompts.
-        """
-        try:
-            temp = weather_data.get('temp')
-            condition = weather_data.get('condition')
-            min_temp = weather_data.get('min_temp')
-            max_temp = weather_data.get('max_temp')
-            
-            if language == 'en':
-                prompt = f"""
+
+    def _render_weather_prompt(self, features):
+        language = features['language']
+
+        def describe(band):
+            if band is None:
+                return "-"
+            return f"{advice_features.temperature_range(band)} ({advice_features.label(band, language)})"
+
+        condition = advice_features.label(features['condition'], language)
+        if language == 'en':
+            return f"""
                 Act as a meteorology expert. Generate personalized weather advice (maximum 3 lines).
                 
                 Required format:
@@ -107,13 +134,12 @@ class GeminiService:
                 🌡️ Cold (5°C): Dress warmly and wear layers.
                 
                 Current data:
-                Temperature: {temp}°C
+                Temperature: {describe(features['temp'])}
                 Condition: {condition}
-                Min: {min_temp}°C
-                Max: {max_temp}°C
+                Min: {describe(features['min_temp'])}
+                Max: {describe(features['max_temp'])}
                 """
-            else:  # Spanish
-                prompt = f"""
+        return f"""
                 Actúa como un experto en meteorología. Genera un consejo personalizado sobre el clima (máximo 3 renglones).
                 
                 Formato obligatorio:
@@ -124,31 +150,289 @@ class GeminiService:
                 🌡️ Frío (5°C): Abrígate bien y lleva capas de ropa.
                 
                 Datos actuales:
-                Temperatura: {temp}°C
+                Temperatura: {describe(features['temp'])}
                 Condición: {condition}
-                Mínima: {min_temp}°C
-                Máxima: {max_temp}°C
+                Mínima: {describe(features['min_temp'])}
+                Máxima: {describe(features['max_temp'])}
                 """
-            
-            # Check cache first
-            cache_key = self._get_cache_key(prompt)
-            cached_response = self.cache_service.get(cache_key)
-            if cached_response:
-                print(f"Cache HIT for Gemini weather advice")
-                return cached_response.decode('utf-8') if isinstance(cached_response, bytes) else cached_response
-            
+    
+    def get_health_advice(self, weather_summary, aqi_data, language='es'):
+        """
+        Genera consejos de salud personalizados usando Gemini.
+        Readings are reduced to canonical features first, so similar
+        readings share one prompt and one cached answer.
+        """
+        if language == 'en':
+            fallback = "Could not generate personalized advice at this time. Stay safe."
+        else:
+            fallback = "No se pudo generar un consejo personalizado en este momento. Mantente seguro."
+        try:
+            features = advice_features.health_features(weather_summary, aqi_data, language)
+            return self._advise(features, self._render_health_prompt, local_advice.health_advice, "health", fallback)
+        except Exception as e:
+            print(f"Error al llamar a Gemini: {e}")
+            return fallback
+    
+    def get_weather_advice(self, weather_data, language='es'):
+        """
+        Genera consejos personalizados para el clima usando Gemini.
+        Temperatures are banded, so nearby values share one cached answer.
+        """
+        if language == 'en':
+            fallback = "Could not generate weather advice at this time."
+        else:
+            fallback = "No se pudo generar un consejo del clima en este momento."
+        try:
+            features = advice_features.weather_features(weather_data, language)
+            return self._advise(features, self._render_weather_prompt, local_advice.weather_advice, "weather", fallback)
+        except Exception as e:
+            print(f"Error al llamar a Gemini para consejo del clima: {e}")
+            return fallback
+
+    def _advise(self, features, render_prompt, local_fn, label, fallback):
+        """
+        Cached Gemini advice for features. Depending on LOCAL_ADVICE_MODE the
+        local rule engine answers instead: always, when Gemini is slow, over
+        budget or failing ("fallback"), or right away while Gemini fills the
+        cache in the background ("initial").
+        """
+        mode = Config.LOCAL_ADVICE_MODE
+        if mode == "always":
+            self._count("local")
+            return local_fn(features)
+
+        # Check cache first
+        cache_key = self._get_cache_key(features)
+        cached_response = self.cache_service.get(cache_key)
+        if cached_response:
+            self._count("hits")
+            print(f"Cache HIT for Gemini {label} advice")
+            return cached_response.decode('utf-8') if isinstance(cached_response, bytes) else cached_response
+        self._count("misses")
+
+        prompt = render_prompt(features)
+        if mode == "initial":
+            self._generate_in_background(cache_key, prompt)
+            self._count("local")
+            return local_fn(features)
+
+        if mode == "fallback":
+            if not self._take_budget():
+                self._count("local")
+                return local_fn(features)
+            try:
+                advice = self._generate_with_timeout(prompt, Config.LOCAL_ADVICE_GEMINI_TIMEOUT).strip()
+            except Exception as e:
+                print(f"Gemini slow or failing ({e}) for {label} advice")
+                return self._answer_without_gemini(features, local_fn, fallback)
+        else:
             # Call Gemini API
-            response = self.model.generate_content(prompt)
-            advice = response.text.strip()
-            
-            # Cache response for 1 hour
-            self.cache_service.set(cache_key, advice, ttl_seconds=3600)
-            print(f"Cache MISS for Gemini weather advice - cached for 1 hour")
-            
-            return advice
+            try:
+                advice = self._generate(prompt).strip()
+            except Exception as e:
+                print(f"Error al llamar a Gemini para consejo ({label}): {e}")
+                return self._answer_without_gemini(features, local_fn, fallback)
+        
+        # Cache response for 1 hour (advice doesn't change frequently)
+        self.cache_service.set(cache_key, advice, ttl_seconds=3600)
+        print(f"Cache MISS for Gemini {label} advice - cached for 1 hour")
+        return advice
+
+    def _take_budget(self):
+        """Per-process Gemini call budget per minute (0 = unlimited)"""
+        if not Config.GEMINI_CALLS_PER_MINUTE:
+            return True
+        now = time.monotonic()
+        with self._stats_lock:
+            if now - self._budget_window_start >= 60:
+                self._budget_window_start = now
+                self._budget_used = 0
+            if self._budget_used >= Config.GEMINI_CALLS_PER_MINUTE:
+                return False
+            self._budget_used += 1
+            return True
+
+    def _get_executor(self):
+        # Created per process: threads don't survive gunicorn's fork
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._stats_lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=Config.GEMINI_MAX_CONCURRENCY,
+                                                        thread_name_prefix="gemini")
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _generate_with_timeout(self, prompt, timeout_seconds):
+        # Copy the request context so the call still shows in its timing spans
+        future = self._get_executor().submit(contextvars.copy_context().run, self._generate, prompt)
+        try:
+            return future.result(timeout=timeout_seconds)
+        except FutureTimeoutError:
+            # Not started yet (pool busy): drop it; a running call finishes on its own
+            future.cancel()
+            raise
+
+    def _generate_in_background(self, cache_key, prompt):
+        """Generates and caches advice without blocking; one job per key"""
+        with self._stats_lock:
+            if cache_key in self._pending:
+                return
+            self._pending.add(cache_key)
+
+        def run():
+            try:
+                if self._take_budget():
+                    advice = self._generate(prompt).strip()
+                    self.cache_service.set(cache_key, advice, ttl_seconds=3600)
+            except Exception as e:
+                print(f"Background Gemini generation failed: {e}")
+            finally:
+                with self._stats_lock:
+                    self._pending.discard(cache_key)
+
+        try:
+            self._get_executor().submit(run)
+        except Exception:
+            with self._stats_lock:
+                self._pending.discard(cache_key)
+            raise
+
+    def stream_health_advice(self, weather_summary, aqi_data, language='es'):
+        """
+        Streaming variant of get_health_advice: yields text chunks as Gemini
+        produces them. Cache hits are yielded as a single chunk.
+        """
+        if language == 'en':
+            fallback = "Could not generate personalized advice at this time. Stay safe."
+        else:
+            fallback = "No se pudo generar un consejo personalizado en este momento. Mantente seguro."
+        try:
+            features = advice_features.health_features(weather_summary, aqi_data, language)
+        except Exception as e:
+            # Same answer the blocking endpoint gives for unusable readings
+            print(f"Error al llamar a Gemini: {e}")
+            yield fallback
+            return
+        yield from self._stream_advice(features, self._render_health_prompt, fallback, local_advice.health_advice)
+
+    def stream_weather_advice(self, weather_data, language='es'):
+        """Streaming variant of get_weather_advice."""
+        if language == 'en':
+            fallback = "Could not generate weather advice at this time."
+        else:
+            fallback = "No se pudo generar un consejo del clima en este momento."
+        try:
+            features = advice_features.weather_features(weather_data, language)
         except Exception as e:
             print(f"Error al llamar a Gemini para consejo del clima: {e}")
-            if language == 'en':
-                return "Could not generate weather advice at this time."
-            else:
-                return "No se pudo generar un consejo del clima en este momento."
+            yield fallback
+            return
+        yield from self._stream_advice(features, self._render_weather_prompt, fallback, local_advice.weather_advice)
+
+    def _answer_without_gemini(self, features, local_fn, fallback):
+        """
+        Answer when Gemini failed before producing anything, shared by the
+        blocking and streaming paths: local advice in "fallback" mode, the
+        fallback message otherwise.
+        """
+        if Config.LOCAL_ADVICE_MODE == "fallback":
+            self._count("local")
+            return local_fn(features)
+        return fallback
+
+    def _stream_advice(self, features, render_prompt, fallback, local_fn):
+        """
+        Same modes as _advise: "initial" answers locally and fills the cache
+        in the background; "fallback" answers locally when over budget, or
+        when Gemini fails or sends nothing for LOCAL_ADVICE_GEMINI_TIMEOUT.
+        """
+        mode = Config.LOCAL_ADVICE_MODE
+        if mode == "always":
+            self._count("local")
+            yield local_fn(features)
+            return
+
+        cache_key = self._get_cache_key(features)
+        cached_response = self.cache_service.get(cache_key)
+        if cached_response:
+            self._count("hits")
+            yield cached_response.decode('utf-8') if isinstance(cached_response, bytes) else cached_response
+            return
+        self._count("misses")
+
+        if mode == "initial":
+            self._generate_in_background(cache_key, render_prompt(features))
+            self._count("local")
+            yield local_fn(features)
+            return
+        if mode == "fallback":
+            if not self._take_budget():
+                self._count("local")
+                yield local_fn(features)
+                return
+            yield from self._stream_with_timeout(cache_key, render_prompt(features), local_fn(features))
+            return
+
+        chunks = []
+        try:
+            with metrics.upstream_call("gemini", "generate_content_stream"):
+                for chunk in self.model.generate_content(render_prompt(features), stream=True):
+                    text = chunk.text
+                    if text:
+                        chunks.append(text)
+                        yield text
+        except Exception as e:
+            print(f"Error al llamar a Gemini (streaming): {e}")
+            if not chunks:
+                yield self._answer_without_gemini(features, local_fn, fallback)
+            return
+
+        # Only complete answers are cached, same entry as the blocking variant
+        advice = "".join(chunks).strip()
+        if advice:
+            self.cache_service.set(cache_key, advice, ttl_seconds=3600)
+
+    def _stream_with_timeout(self, cache_key, prompt, local_answer):
+        """
+        Streams Gemini's answer from a pool thread, giving up on it if no
+        chunk arrives within LOCAL_ADVICE_GEMINI_TIMEOUT. Before the first
+        chunk that means answering locally; after it, ending the stream. The
+        generation keeps going in the background and caches a complete answer.
+        """
+        chunks = queue.Queue()
+
+        def produce():
+            parts = []
+            try:
+                with metrics.upstream_call("gemini", "generate_content_stream"):
+                    for chunk in self.model.generate_content(prompt, stream=True):
+                        text = chunk.text
+                        if text:
+                            parts.append(text)
+                            chunks.put(text)
+                advice = "".join(parts).strip()
+                if advice:
+                    self.cache_service.set(cache_key, advice, ttl_seconds=3600)
+                chunks.put(None)
+            except Exception as e:
+                chunks.put(e)
+
+        self._get_executor().submit(contextvars.copy_context().run, produce)
+        started = False
+        while True:
+            try:
+                item = chunks.get(timeout=Config.LOCAL_ADVICE_GEMINI_TIMEOUT)
+            except queue.Empty:
+                item = TimeoutError("no chunk within the timeout")
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                if not started:
+                    print(f"Gemini slow or failing while streaming ({item}); using local advice")
+                    self._count("local")
+                    yield local_answer
+                else:
+                    print(f"Gemini stream stopped early: {item}")
+                return
+            started = True
+            yield item
@@ -0,0 +1,119 @@
+"""
+Spatial cache keys shared by every location-keyed cache.
+
+Coordinates are snapped to a cell (a geohash or a fixed lat/lon grid) so
+that nearby users share one entry. The precision of each kind of data is
+configured separately, since OpenWeather's pollution model is much coarser
+than its current-weather observations.
+
+Cells also have a containing (parent) cell: when CACHE_PARENT_FALLBACK is
+on, writes are mirrored to the parent and lookups fall back to it, so a
+neighbouring cell's fresh value can serve a miss.
+"""
+import math
+from config import Config
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat, lon, precision):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def geohash_bounds(geohash):
+    """Returns (min_lat, min_lon, max_lat, max_lon) of a geohash cell."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (bits >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def _precision(kind):
+    return Config.CACHE_GEOHASH_PRECISION.get(kind, Config.CACHE_GEOHASH_PRECISION["default"])
+
+
+def _grid_size(kind):
+    return Config.CACHE_GRID_DEGREES.get(kind, Config.CACHE_GRID_DEGREES["default"])
+
+
+def validate_coordinates(lat, lon):
+    """
+    Returns (lat, lon) as floats. Raises ValueError (TypeError for non-numbers)
+    unless both are finite and in range: geohashing would otherwise clamp
+    NaN or out-of-range input into a real edge cell.
+    """
+    if isinstance(lat, bool) or isinstance(lon, bool):
+        raise TypeError("Coordinates must be numbers")
+    lat, lon = float(lat), float(lon)
+    # NaN fails every comparison, infinities the range
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"Invalid coordinates: {lat}, {lon}")
+    return lat, lon
+
+
+def cell_id(lat, lon, kind, parent=False):
+    """Identifier of the cell containing (lat, lon) for a kind of data."""
+    lat, lon = validate_coordinates(lat, lon)
+    if Config.CACHE_KEY_SCHEME == "grid":
+        size = _grid_size(kind) * (2 if parent else 1)
+        return f"g{size:g}_{math.floor(lat / size)}_{math.floor(lon / size)}"
+    precision = _precision(kind) - (1 if parent else 0)
+    return geohash_encode(lat, lon, max(precision, 1))
+
+
+def cell_center(lat, lon, kind):
+    """Representative coordinate of the cell, used when fetching on its behalf."""
+    lat, lon = validate_coordinates(lat, lon)
+    if Config.CACHE_KEY_SCHEME == "grid":
+        size = _grid_size(kind)
+        return (
+            round((math.floor(lat / size) + 0.5) * size, 4),
+            round((math.floor(lon / size) + 0.5) * size, 4)
+        )
+    min_lat, min_lon, max_lat, max_lon = geohash_bounds(geohash_encode(lat, lon, _precision(kind)))
+    return round((min_lat + max_lat) / 2, 4), round((min_lon + max_lon) / 2, 4)
+
+
+def cache_keys(kind, lat, lon, *parts):
+    """
+    Cache keys for a location, most specific first.
+
+    Returns [cell_key] or, with parent fallback enabled, [cell_key, parent_key].
+    Extra parts (language, days...) are appended to every key.
+    """
+    suffix = "".join(f":{part}" for part in parts)
+    keys = [f"{kind}:{cell_id(lat, lon, kind)}{suffix}"]
+    if Config.CACHE_PARENT_FALLBACK:
+        keys.append(f"{kind}:^{cell_id(lat, lon, kind, parent=True)}{suffix}")
+    return keys
@@ -0,0 +1,185 @@
+"""
+Background health prober.
+
+Dependencies are probed on a fixed interval and the result is kept as a
+snapshot, so /api/health answers from memory instead of sending commands
+to Mongo and Redis on every call. Each dependency reports its status,
+probe latency and when it last succeeded.
+
+Only one worker per host probes: whichever holds an flock on
+<snapshot_path>.lock writes the snapshot to snapshot_path and the others
+read it from there. The lock goes away with its process, so another
+worker takes over within an interval when the prober's worker exits.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; every process probes for itself there
+    fcntl = None
+
+
+class HealthCheck:
+    def __init__(self, name, probe, critical=True):
+        """
+        Args:
+            name: Key under "services"
+            probe: Callable returning "connected" or "disconnected"; raising
+                counts as "error"
+            critical: A failing critical dependency makes the service
+                unhealthy, otherwise only degraded
+        """
+        self.name = name
+        self.probe = probe
+        self.critical = critical
+
+
+class HealthProber:
+    def __init__(self, checks, interval_seconds=15, timeout_seconds=3, snapshot_path=None):
+        self.checks = checks
+        self.interval_seconds = interval_seconds
+        self.timeout_seconds = timeout_seconds
+        self.snapshot_path = snapshot_path or os.path.join(tempfile.gettempdir(), "air_quality_api_health.json")
+
+        self._snapshot = None
+        self._last_success = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop = threading.Event()
+        self._leader_file = None
+        self._executor = None
+        self._inflight = {}          # check name -> future still running
+
+    def snapshot(self):
+        """Latest probe results; probes inline only before the first one exists."""
+        self._ensure_started()
+        if not self._is_leader():
+            self._read_shared()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self.probe_now()
+
+        age = time.time() - snapshot["checked_at"]
+        if age <= 3 * self.interval_seconds:
+            return dict(snapshot, age_seconds=round(age, 3))
+        # The prober has stopped updating; don't report stale good news
+        return dict(snapshot, age_seconds=round(age, 3), status="degraded", stale=True)
+
+    def probe_now(self):
+        """Runs every check live (?deep=1) and stores the result as the snapshot."""
+        services = {}
+        status = "healthy"
+        for check in self.checks:
+            result = self._run(check)
+            services[check.name] = result
+            if result["status"] == "connected":
+                continue
+            if check.critical and result["status"] != "disconnected":
+                status = "unhealthy"
+            elif status == "healthy":
+                status = "degraded"
+
+        snapshot = {"status": status, "services": services, "checked_at": time.time()}
+        self._snapshot = snapshot
+        self._write_shared(snapshot)
+        return dict(snapshot, age_seconds=0.0)
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, check):
+        started = time.monotonic()
+        result = {}
+        with self._lock:
+            future = self._inflight.get(check.name)
+            if future is None or future.done():
+                # Pool threads are reused; at most one probe per check runs at
+                # a time, so a hung dependency ties up one thread, not one per cycle
+                future = self._get_executor().submit(check.probe)
+                self._inflight[check.name] = future
+        try:
+            result["status"] = future.result(timeout=self.timeout_seconds)
+        except FutureTimeoutError:
+            result["status"] = "timeout"
+        except Exception as e:
+            print(f"Health probe {check.name} failed: {e}")
+            result["status"] = "error"
+            result["error"] = str(e)
+
+        now = time.time()
+        result["latency_ms"] = round((time.monotonic() - started) * 1000, 2)
+        with self._lock:
+            if result["status"] == "connected":
+                self._last_success[check.name] = now
+            result["last_success"] = self._last_success.get(check.name)
+        result["last_checked"] = now
+        return result
+
+    def _get_executor(self):
+        # Called with self._lock held; a pool inherited through fork has no threads
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=len(self.checks), thread_name_prefix="health-probe")
+            self._inflight = {}
+        return self._executor
+
+    def _ensure_started(self):
+        # One loop per forked worker, started on first use; only the leader probes
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._leader_file = None
+            self._executor = None
+            threading.Thread(target=self._loop, name="health-prober", daemon=True).start()
+
+    def _loop(self):
+        while True:
+            try:
+                if self._try_lead():
+                    self.probe_now()
+            except Exception as e:
+                print(f"Health probe cycle failed: {e}")
+            if self._stop.wait(self.interval_seconds):
+                return
+
+    def _is_leader(self):
+        return fcntl is None or self._leader_file is not None
+
+    def _try_lead(self):
+        """Takes the per-host prober lock if it is free; kept until the process exits."""
+        if self._is_leader():
+            return True
+        lock_file = open(self.snapshot_path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._leader_file = lock_file
+        return True
+
+    def _write_shared(self, snapshot):
+        try:
+            tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"Could not write health snapshot: {e}")
+
+    def _read_shared(self):
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return
+        current = self._snapshot
+        if current is None or snapshot.get("checked_at", 0) > current["checked_at"]:
+            self._snapshot = snapshot
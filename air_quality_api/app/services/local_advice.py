@@ -0,0 +1,98 @@
+"""
+Deterministic, template-based advice in Spanish and English.
+
+Answers instantly from the same canonical features used for Gemini
+(advice_features), in the same output formats:
+    health:  "[Risk Level]: [Advice]"
+    weather: "🌡️ [Temperature]: [Advice]"
+"""
+from . import advice_features
+
+# OpenWeather AQI 1..5 -> (risk level, advice)
+HEALTH_TEMPLATES = {
+    "es": {
+        1: ("Bajo", "Disfruta del aire libre sin preocupaciones."),
+        2: ("Moderado", "Puedes salir con normalidad; las personas sensibles deben evitar esfuerzos intensos prolongados."),
+        3: ("Medio", "Reduce la actividad física intensa al aire libre, sobre todo si tienes asma o problemas respiratorios."),
+        4: ("Alto", "Usa mascarilla, limita el tiempo al aire libre y mantén las ventanas cerradas."),
+        5: ("Muy alto", "Evita salir, usa mascarilla N95 si es necesario y mantén el aire interior filtrado."),
+    },
+    "en": {
+        1: ("Low", "Enjoy the outdoors without worries."),
+        2: ("Moderate", "Going out is fine; sensitive people should avoid prolonged intense exertion."),
+        3: ("Medium", "Cut down on intense outdoor exercise, especially if you have asthma or breathing problems."),
+        4: ("High", "Wear a mask, limit time outdoors and keep windows closed."),
+        5: ("Very high", "Avoid going outside, wear an N95 mask if needed and keep indoor air filtered."),
+    },
+}
+
+POLLUTANT_NOTES = {
+    "es": "El contaminante principal es {name} (nivel {level}).",
+    "en": "The main pollutant is {name} ({level} level).",
+}
+
+CONDITION_NOTES = {
+    "es": {"rain": "Lleva paraguas.", "storm": "Evita zonas abiertas durante la tormenta.",
+           "snow": "Cuidado con superficies resbaladizas.", "fog": "Conduce con precaución por la baja visibilidad.",
+           "clear": "Usa protector solar si pasas tiempo al sol."},
+    "en": {"rain": "Bring an umbrella.", "storm": "Stay away from open areas during the storm.",
+           "snow": "Watch out for slippery surfaces.", "fog": "Drive carefully, visibility is low.",
+           "clear": "Wear sunscreen if you spend time in the sun."},
+}
+
+TEMPERATURE_TEMPLATES = {
+    "es": {
+        "freezing": ("Helado", "Abrígate con varias capas, gorro y guantes."),
+        "cold": ("Frío", "Abrígate bien y lleva capas de ropa."),
+        "cool": ("Fresco", "Lleva una chaqueta ligera."),
+        "mild": ("Templado", "Temperatura agradable; ropa cómoda."),
+        "warm": ("Cálido", "Usa ropa ligera y mantente hidratado."),
+        "hot": ("Caluroso", "Mantente hidratado, usa protector solar y evita el sol del mediodía."),
+    },
+    "en": {
+        "freezing": ("Freezing", "Wear several layers, a hat and gloves."),
+        "cold": ("Cold", "Dress warmly and wear layers."),
+        "cool": ("Cool", "Bring a light jacket."),
+        "mild": ("Mild", "Pleasant temperature; dress comfortably."),
+        "warm": ("Warm", "Wear light clothes and stay hydrated."),
+        "hot": ("Hot", "Stay hydrated, use sunscreen and avoid the midday sun."),
+    },
+}
+
+
+def _language(features):
+    return "en" if features.get('language') == 'en' else "es"
+
+
+def health_advice(features):
+    language = _language(features)
+    aqi = features.get('aqi')
+    level = min(max(int(aqi), 1), 5) if isinstance(aqi, (int, float)) else 1
+    risk, advice = HEALTH_TEMPLATES[language][level]
+
+    notes = [advice]
+    # Dominant pollutant: the one in the worst band, if it is above "fair"
+    pollutants = features.get('pollutants') or {}
+    if pollutants:
+        name, band = max(pollutants.items(), key=lambda item: advice_features.POLLUTANT_LEVELS.index(item[1]))
+        if advice_features.POLLUTANT_LEVELS.index(band) >= 2:
+            notes.append(POLLUTANT_NOTES[language].format(
+                name=advice_features.POLLUTANT_NAMES.get(name, name),
+                level=advice_features.label(band, language)
+            ))
+    condition_note = CONDITION_NOTES[language].get(features.get('condition'))
+    if condition_note:
+        notes.append(condition_note)
+    return f"{risk}: {' '.join(notes)}"
+
+
+def weather_advice(features):
+    language = _language(features)
+    band = features.get('temp') or "mild"
+    label, advice = TEMPERATURE_TEMPLATES[language][band]
+
+    notes = [advice]
+    condition_note = CONDITION_NOTES[language].get(features.get('condition'))
+    if condition_note:
+        notes.append(condition_note)
+    return f"🌡️ {label} ({advice_features.temperature_range(band)}): {' '.join(notes)}"
@@ -0,0 +1,87 @@
+"""
+Bounded in-process LRU cache with per-entry TTL.
+
+Sits in front of the Upstash REST cache so hot keys are served from worker
+memory instead of an HTTPS round trip. Entries expire no later than their
+Redis counterparts, and the cache is bounded both by entry count and by an
+approximate byte budget.
+"""
+from collections import OrderedDict
+import sys
+import threading
+import time
+
+
+def _approx_size(key, value):
+    if isinstance(value, (str, bytes)):
+        value_size = len(value)
+    else:
+        value_size = sys.getsizeof(value)
+    return len(key) + value_size
+
+
+class LocalCache:
+    def __init__(self, max_entries=4096, max_bytes=32 * 1024 * 1024, max_ttl_seconds=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_ttl_seconds = max_ttl_seconds
+
+        # key -> (value, expires_at, size); ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key, value, ttl_seconds):
+        if ttl_seconds is None or ttl_seconds <= 0:
+            return
+        if self.max_ttl_seconds:
+            ttl_seconds = min(ttl_seconds, self.max_ttl_seconds)
+        size = _approx_size(key, value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl_seconds, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self._stats["evictions"] += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                hit_ratio=round(self._stats["hits"] / lookups, 4) if lookups else 0.0
+            )
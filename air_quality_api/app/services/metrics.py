@@ -0,0 +1,210 @@
+"""
+Prometheus metrics.
+
+Under gunicorn every worker writes its samples to files in
+PROMETHEUS_MULTIPROC_DIR (set up in gunicorn.conf.py) and /api/metrics
+aggregates all of them, so counters add up across workers no matter which
+one serves the scrape. Without that variable (flask run, scripts) the
+default in-process registry is used.
+"""
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+import pybreaker
+from . import tracing
+from pymongo import monitoring
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route",
+    ["method", "route"]
+)
+REQUESTS = Counter(
+    "http_requests_total", "Requests by route and status code",
+    ["method", "route", "status"]
+)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds", "Latency of calls to external services",
+    ["service", "operation"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30)
+)
+UPSTREAM_ERRORS = Counter(
+    "upstream_errors_total", "Failed calls to external services",
+    ["service", "operation"]
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "Cache lookups by key prefix and result (hit/miss)",
+    ["prefix", "result"]
+)
+CIRCUIT_BREAKER_STATE = Gauge(
+    "circuit_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open), worst worker",
+    ["name"], multiprocess_mode="max"
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "mongo_pool_connections", "Open MongoDB pool connections",
+    multiprocess_mode="livesum"
+)
+MONGO_POOL_CHECKED_OUT = Gauge(
+    "mongo_pool_checked_out", "MongoDB pool connections in use",
+    multiprocess_mode="livesum"
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total", "Requests rejected by the rate limiter",
+    ["route"]
+)
+SWR_LOOKUPS = Counter(
+    "swr_lookups_total", "Stale-while-revalidate lookups (fresh, early_refresh, stale, miss)",
+    ["result"]
+)
+SWR_PREWARMED_HITS = Counter(
+    "swr_prewarmed_hits_total", "SWR hits on entries written by the pre-warmer"
+)
+# Set once in the gunicorn master (preload). Forked workers get zero entries
+# for it in their own files, which "mostrecent" ignores (they were never set)
+START_TIME = Gauge(
+    "app_start_time_seconds", "Unix time the application was loaded",
+    multiprocess_mode="mostrecent"
+)
+STARTED_AT = time.time()
+START_TIME.set(STARTED_AT)
+
+_BREAKER_STATES = {"closed": 0, "half-open": 1, "open": 2}
+
+
+def _failed(result):
+    """Services report failures as None or {"error": ...} instead of raising."""
+    return result is None or (isinstance(result, dict) and "error" in result)
+
+
+@contextmanager
+def upstream_call(service, operation):
+    """Times a block calling an external service; exceptions count as errors."""
+    started = time.perf_counter()
+    try:
+        with tracing.span(service):
+            yield
+    except Exception:
+        UPSTREAM_ERRORS.labels(service, operation).inc()
+        raise
+    finally:
+        UPSTREAM_LATENCY.labels(service, operation).observe(time.perf_counter() - started)
+
+
+def track_upstream(service, operation=None, failed=_failed):
+    """Decorator form of upstream_call; failed(result) flags error results."""
+    def decorator(func):
+        name = operation or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with upstream_call(service, name):
+                result = func(*args, **kwargs)
+            if failed(result):
+                UPSTREAM_ERRORS.labels(service, name).inc()
+            return result
+        return wrapper
+    return decorator
+
+
+def record_cache_lookup(key, hit):
+    prefix, _, rest = key.partition(":")
+    if rest.startswith("^"):
+        # Parent-cell fallback keys (geo_keys) are tracked apart from the exact cell
+        prefix += "_parent"
+    CACHE_LOOKUPS.labels(prefix, "hit" if hit else "miss").inc()
+
+
+def record_swr_lookup(result, prewarmed=False):
+    SWR_LOOKUPS.labels(result).inc()
+    if prewarmed:
+        SWR_PREWARMED_HITS.inc()
+
+
+def counter_total(name):
+    """Current total of a counter (all label sets), across workers when multiprocess."""
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return sum(
+        sample.value
+        for metric in registry.collect() if metric.name == name
+        for sample in metric.samples if sample.name == f"{name}_total"
+    )
+
+
+def record_request(method, route, status, seconds):
+    REQUEST_LATENCY.labels(method, route).observe(seconds)
+    REQUESTS.labels(method, route, str(status)).inc()
+
+
+def record_rate_limit_rejection(route):
+    RATE_LIMIT_REJECTIONS.labels(route).inc()
+
+
+class BreakerStateListener(pybreaker.CircuitBreakerListener):
+    def __init__(self, name):
+        self.name = name
+        CIRCUIT_BREAKER_STATE.labels(name).set(0)
+
+    def state_change(self, cb, old_state, new_state):
+        CIRCUIT_BREAKER_STATE.labels(self.name).set(_BREAKER_STATES.get(new_state.name, 0))
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc()
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec()
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CHECKED_OUT.inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec()
+
+    # Remaining pool events aren't tracked
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+
+def render():
+    """(body, content type) of every metric, aggregated across workers when multiprocess."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """
+    Drops a process's live gauges: dead workers (gunicorn's child_exit) and
+    the master once the app is preloaded (when_ready), whose pre-fork Mongo
+    pool counts would otherwise be added to every scrape.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
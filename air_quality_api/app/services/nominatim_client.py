@@ -0,0 +1,126 @@
+"""
+Client for Nominatim place search.
+
+Nominatim's usage policy allows about one request per second, so every
+outbound call takes a slot from a global GCRA rate limit kept in Redis and
+shared by all workers. Callers queue for their slot up to a short maximum
+delay; beyond that the search is shed at once instead of piling up.
+Responses are cached for a long time under the normalized query, and
+identical queries in flight share one upstream call.
+"""
+import json
+import threading
+import time
+import requests
+from .gazetteer import normalize
+from . import metrics
+
+RATE_LIMIT_KEY = "nominatim:rate"
+
+
+class NominatimClient:
+    def __init__(self, cache_service, coalescer, base_url="https://nominatim.openstreetmap.org",
+                 user_agent="AuraClimaApp/1.0", cache_ttl_seconds=604800, rate_per_second=1.0,
+                 max_queue_seconds=2.0, timeout_seconds=10, archive=None):
+        self.cache_service = cache_service
+        self.coalescer = coalescer
+        self.base_url = base_url.rstrip("/")
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.interval_ms = 1000.0 / rate_per_second
+        self.max_queue_ms = max_queue_seconds * 1000
+        self.timeout_seconds = timeout_seconds
+
+        # Connection pooling with requests.Session
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+        adapter_kwargs = dict(pool_connections=2, pool_maxsize=10, max_retries=0)
+        if archive is not None:
+            # Record/replay of upstream responses (see upstream_archive)
+            adapter = archive.adapter("nominatim", **adapter_kwargs)
+        else:
+            adapter = requests.adapters.HTTPAdapter(**adapter_kwargs)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # In-process fallback when Redis is unavailable (theoretical arrival time, ms)
+        self._local_tat = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"cache_hits": 0, "upstream_calls": 0, "shed": 0, "errors": 0}
+
+    def search(self, query, limit=5):
+        """
+        Nominatim results for query, or {"error": ...} on failure. Shed
+        searches also carry "retry_after" (seconds).
+        """
+        normalized = normalize(query)[:200]
+        if not normalized:
+            return []
+        cache_key = f"search:{limit}:{normalized}"
+
+        cached = self._lookup(cache_key)
+        if cached is not None:
+            self._count("cache_hits")
+            return cached
+
+        return self.coalescer.do(
+            cache_key,
+            lambda: self._fetch(cache_key, query, limit),
+            lookup=lambda: self._lookup(cache_key)
+        )
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _lookup(self, cache_key):
+        raw = self.cache_service.get(cache_key)
+        if raw is None:
+            return None
+        try:
+            return json.loads(raw)
+        except (TypeError, ValueError):
+            return None
+
+    def _fetch(self, cache_key, query, limit):
+        wait_ms = self._reserve_slot()
+        if wait_ms < 0:
+            self._count("shed")
+            return {"error": "Demasiadas búsquedas, inténtalo de nuevo en unos segundos",
+                    "retry_after": max(1, int(self.max_queue_ms / 1000))}
+        if wait_ms:
+            time.sleep(wait_ms / 1000)
+
+        self._count("upstream_calls")
+        try:
+            with metrics.upstream_call("nominatim", "search"):
+                response = self.session.get(
+                    f"{self.base_url}/search",
+                    params={"format": "json", "q": query, "limit": limit},
+                    timeout=self.timeout_seconds
+                )
+                response.raise_for_status()
+                results = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error al llamar a Nominatim: {e}")
+            self._count("errors")
+            return {"error": "Failed to fetch from Nominatim"}
+
+        self.cache_service.set(cache_key, json.dumps(results), ttl_seconds=self.cache_ttl_seconds)
+        return results
+
+    def _reserve_slot(self):
+        wait_ms = self.cache_service.reserve_slot(RATE_LIMIT_KEY, self.interval_ms, self.max_queue_ms)
+        if wait_ms is not None:
+            return wait_ms
+        # No Redis: same GCRA, enforced per worker only
+        with self._lock:
+            now = time.time() * 1000
+            tat = max(self._local_tat, now)
+            if tat - now > self.max_queue_ms:
+                return -1
+            self._local_tat = tat + self.interval_ms
+            return tat - now
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
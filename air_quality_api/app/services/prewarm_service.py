@@ -0,0 +1,178 @@
+"""
+Background pre-warmer for saved locations.
+
+Every saved location is known in advance, so instead of waiting for a user
+to hit a cold key, the scheduler periodically walks saved_locations,
+dedupes them by cache cell and refreshes every target (AQI, history...)
+that is missing or about to go stale. Upstream calls are spread out at a
+fixed rate.
+
+Runs either as a thread in one leader-elected gunicorn worker (a Redis lock
+per cycle) or as a separate process via `flask prewarm`. The leader renews
+its lock before every upstream call of a cycle and stops if it loses it;
+without Redis the lock can't be confirmed and no worker runs cycles.
+"""
+import threading
+import time
+from . import metrics
+
+LEADER_LOCK_KEY = "prewarm:leader"
+WARM_KEYS_KEY = "prewarm:warm_keys"
+# Leader lock TTL while a cycle runs. Renewed before each upstream call, so
+# it only has to outlive one fetch with retries (3 x 10s plus backoff)
+LEADER_LEASE_SECONDS = 90
+
+
+class _LeaseLost(Exception):
+    pass
+
+
+class PrewarmTarget:
+    def __init__(self, name, keys_for, loader_for, soft_ttl, hard_ttl):
+        """
+        Args:
+            name: Label used in stats
+            keys_for: (lat, lon) -> cache keys, most specific first
+            loader_for: (lat, lon) -> zero-argument loader
+            soft_ttl, hard_ttl: Same TTLs (or TTL callables) the serving path uses
+        """
+        self.name = name
+        self.keys_for = keys_for
+        self.loader_for = loader_for
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+
+
+class PrewarmScheduler:
+    def __init__(self, db_service, swr_cache, targets, interval_seconds=300, lead_seconds=450, rate_per_second=1.0):
+        self.db_service = db_service
+        self.swr_cache = swr_cache
+        self.cache_service = swr_cache.cache_service
+        self.targets = targets
+        self.interval_seconds = interval_seconds
+        self.lead_seconds = lead_seconds
+        self.rate_per_second = rate_per_second
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._leader_token = None
+        self._lease_renewed = 0.0
+        self._stats = {"cycles": 0, "refreshed": 0, "skipped_fresh": 0, "failed": 0, "warm_keys": 0}
+
+    def start(self):
+        """Starts the leader-elected loop in this process (once)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="prewarm", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self):
+        """Loop for the standalone process; still takes the leader lock."""
+        self._loop()
+
+    def run_cycle(self):
+        """Refreshes every target for every saved-location cell once."""
+        cells = {}
+        for lat, lon in self.db_service.get_saved_coordinates():
+            for target in self.targets:
+                try:
+                    keys = target.keys_for(lat, lon)
+                except (TypeError, ValueError):
+                    # A saved location with unusable coordinates has no cell
+                    break
+                cells.setdefault((target.name, keys[0]), (target, keys, lat, lon))
+
+        min_interval = 1.0 / self.rate_per_second if self.rate_per_second > 0 else 0
+        for target, keys, lat, lon in cells.values():
+            if self._stop.is_set():
+                break
+            if not self._renew_lease():
+                print("Pre-warm leader lock lost; stopping this cycle")
+                break
+            started = time.monotonic()
+            try:
+                refreshed = self.swr_cache.refresh_ahead(
+                    keys, self._leased(target.loader_for(lat, lon)),
+                    soft_ttl=target.soft_ttl, hard_ttl=target.hard_ttl,
+                    lead_seconds=self.lead_seconds
+                )
+            except _LeaseLost:
+                print("Pre-warm leader lock lost; stopping this cycle")
+                break
+            except Exception as e:
+                print(f"Pre-warm of {keys[0]} failed: {e}")
+                self._stats["failed"] += 1
+                continue
+            if not refreshed:
+                self._stats["skipped_fresh"] += 1
+                continue
+            self._stats["refreshed"] += 1
+            # Spread upstream calls over time instead of bursting
+            self._stop.wait(max(0, min_interval - (time.monotonic() - started)))
+
+        self._stats["cycles"] += 1
+        self._stats["warm_keys"] = len(cells)
+        self.cache_service.set(WARM_KEYS_KEY, str(len(cells)), ttl_seconds=self.interval_seconds * 3)
+        return len(cells)
+
+    def stats(self):
+        """
+        Scheduler counters (this process) plus the user-facing share of
+        pre-warmed hits, counted across all workers.
+        """
+        lookups = metrics.counter_total("swr_lookups")
+        prewarmed_hits = metrics.counter_total("swr_prewarmed_hits")
+        warm_keys = self.cache_service.get(WARM_KEYS_KEY)
+        return dict(
+            self._stats,
+            warm_keys=int(warm_keys) if warm_keys else self._stats["warm_keys"],
+            prewarmed_hits=int(prewarmed_hits),
+            prewarmed_hit_ratio=round(prewarmed_hits / lookups, 4) if lookups else 0.0
+        )
+
+    def _loop(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            # One leader per cycle across all workers
+            token = self.cache_service.acquire_lock(LEADER_LOCK_KEY, LEADER_LEASE_SECONDS, fail_open=False)
+            if token:
+                self._leader_token = token
+                self._lease_renewed = time.monotonic()
+                try:
+                    self.run_cycle()
+                except Exception as e:
+                    print(f"Pre-warm cycle failed: {e}")
+                finally:
+                    self._leader_token = None
+                    # Keep the lock until the next cycle is due so no other
+                    # worker starts one early
+                    remaining = int(self.interval_seconds * 0.9 - (time.monotonic() - started))
+                    if remaining >= 1:
+                        self.cache_service.extend_lock(LEADER_LOCK_KEY, token, remaining)
+                    else:
+                        self.cache_service.release_lock(LEADER_LOCK_KEY, token)
+            self._stop.wait(max(0, self.interval_seconds - (time.monotonic() - started)))
+
+    def _leased(self, loader):
+        """Wraps a loader so the lease is renewed right before it goes upstream."""
+        def load():
+            if not self._renew_lease(force=True):
+                raise _LeaseLost()
+            return loader()
+        return load
+
+    def _renew_lease(self, force=False):
+        """Extends the leader lock during a long cycle; False once it is lost."""
+        if self._leader_token is None:
+            # Single cycle run by hand (`flask prewarm --once`)
+            return True
+        if not force and time.monotonic() - self._lease_renewed < LEADER_LEASE_SECONDS / 3:
+            return True
+        if not self.cache_service.extend_lock(LEADER_LOCK_KEY, self._leader_token, LEADER_LEASE_SECONDS):
+            return False
+        self._lease_renewed = time.monotonic()
+        return True
@@ -0,0 +1,137 @@
+"""
+Daily AQI rollups per grid cell.
+
+Every saved reading also bumps one air_readings_daily document, keyed by
+the reading's geohash cell (fixed precision) and UTC day, holding running
+sum/count/min/max for the AQI and each pollutant. History queries then read
+at most one small document per day instead of aggregating raw readings;
+/history serves them when they cover every requested day. rebuild()
+recomputes the rollups from the raw collection.
+"""
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne
+from . import geo_keys
+
+ROLLUP_COLLECTION = "air_readings_daily"
+# Fixed geohash precision (~5 km cells) of the rollup key. Deliberately not the
+# configurable cache-key precision: changing that would split stored history
+CELL_PRECISION = 5
+
+
+def rollup_cell(lat, lon):
+    lat, lon = geo_keys.validate_coordinates(lat, lon)
+    return geo_keys.geohash_encode(lat, lon, CELL_PRECISION)
+
+
+def _metrics(reading):
+    """Flattens a reading into {metric_name: value} for the numeric fields."""
+    metrics = {}
+    if isinstance(reading.get('aqi'), (int, float)):
+        metrics['aqi'] = reading['aqi']
+    for name, value in (reading.get('components') or {}).items():
+        if isinstance(value, (int, float)):
+            metrics[f"components.{name}"] = value
+    return metrics
+
+
+def rollup_key(reading):
+    """(cell, day) a reading belongs to, or None if it has no usable coordinates."""
+    coordinates = reading.get('coordinates') or {}
+    try:
+        cell = rollup_cell(coordinates['lat'], coordinates['lon'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    day = reading['saved_at'].strftime('%Y-%m-%d')
+    return cell, day
+
+
+def rollup_update(reading):
+    """Filter and $inc/$min/$max update folding one reading into its rollup."""
+    key = rollup_key(reading)
+    if key is None:
+        return None
+    cell, day = key
+    inc = {"count": 1}
+    mins = {}
+    maxs = {}
+    for name, value in _metrics(reading).items():
+        inc[f"{name}.sum"] = value
+        inc[f"{name}.count"] = 1
+        mins[f"{name}.min"] = value
+        maxs[f"{name}.max"] = value
+    update = {
+        "$inc": inc,
+        "$setOnInsert": {"date": datetime.strptime(day, '%Y-%m-%d')},
+        "$max": dict(maxs, updated_at=reading['saved_at'])
+    }
+    if mins:
+        update["$min"] = mins
+    return {"cell": cell, "day": day}, update
+
+
+def read_history(db, lat, lon, days=7):
+    """Daily average AQI for the cell containing (lat, lon), newest first."""
+    cell = rollup_cell(lat, lon)
+    start_day = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d')
+    cursor = db[ROLLUP_COLLECTION].find(
+        {"cell": cell, "day": {"$gte": start_day}},
+        {"day": 1, "aqi": 1}
+    ).sort("day", -1).limit(days)
+    return [
+        {"date": doc['day'], "aqi": round(doc['aqi']['sum'] / doc['aqi']['count'])}
+        for doc in cursor
+        if doc.get('aqi', {}).get('count')
+    ]
+
+
+def rebuild(db, days=None):
+    """
+    Recomputes rollups from raw readings (all of them, or the last N days).
+    Rollups are replaced in place and only stale ones are deleted afterwards,
+    so readers never see a day go missing. Returns the number written.
+    """
+    query = {}
+    if days is not None:
+        start = datetime.utcnow() - timedelta(days=days)
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        query["saved_at"] = {"$gte": start}
+
+    rollups = {}
+    projection = {"coordinates": 1, "saved_at": 1, "aqi": 1, "components": 1}
+    for reading in db.air_readings.find(query, projection):
+        key = rollup_key(reading)
+        if key is None:
+            continue
+        doc = rollups.setdefault(key, {
+            "cell": key[0], "day": key[1],
+            "date": datetime.strptime(key[1], '%Y-%m-%d'),
+            "count": 0, "updated_at": reading['saved_at']
+        })
+        doc["count"] += 1
+        doc["updated_at"] = max(doc["updated_at"], reading['saved_at'])
+        for name, value in _metrics(reading).items():
+            target = doc
+            for part in name.split('.'):
+                target = target.setdefault(part, {})
+            if not target:
+                target.update({"sum": 0, "count": 0, "min": value, "max": value})
+            target["sum"] += value
+            target["count"] += 1
+            target["min"] = min(target["min"], value)
+            target["max"] = max(target["max"], value)
+
+    rollup_query = {}
+    if days is not None:
+        rollup_query["day"] = {"$gte": query["saved_at"]["$gte"].strftime('%Y-%m-%d')}
+    stale = [
+        doc['_id'] for doc in db[ROLLUP_COLLECTION].find(rollup_query, {"cell": 1, "day": 1})
+        if (doc['cell'], doc['day']) not in rollups
+    ]
+    if rollups:
+        db[ROLLUP_COLLECTION].bulk_write([
+            ReplaceOne({"cell": cell, "day": day}, doc, upsert=True)
+            for (cell, day), doc in rollups.items()
+        ], ordered=False)
+    if stale:
+        db[ROLLUP_COLLECTION].delete_many({"_id": {"$in": stale}})
+    return len(rollups)
@@ -0,0 +1,118 @@
+"""
+Single-flight coalescing for expensive cache-miss paths.
+
+Within a process, concurrent callers for the same key share one call: the
+first caller (the leader) runs the loader and the rest wait on its result.
+Across gunicorn workers a Redis lock elects a single leader. It outlives a
+worst-case fetch with retries and is released as soon as the leader is done;
+workers that lose the race poll the cache, backing off up to once a second,
+until the leader publishes the value. If the leader gives up without
+publishing, the first waiter to take the lock over loads it instead; they
+only all fall back to loading it themselves once the lock's TTL has passed.
+"""
+import threading
+import time
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RequestCoalescer:
+    def __init__(self, cache_service, lock_ttl_seconds=60, wait_timeout_seconds=None,
+                 poll_interval_seconds=0.1, max_poll_interval_seconds=1.0):
+        self.cache_service = cache_service
+        self.lock_ttl_seconds = lock_ttl_seconds
+        # Waiting less than the lock lives lets waiters duplicate a slow fetch
+        self.wait_timeout_seconds = lock_ttl_seconds if wait_timeout_seconds is None else wait_timeout_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_poll_interval_seconds = max_poll_interval_seconds
+
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "followers": 0, "remote_waits": 0, "fallbacks": 0}
+
+    def do(self, key, loader, lookup=None):
+        """
+        Runs loader() at most once per key among concurrent callers.
+
+        Args:
+            key: Coalescing key (usually the cache key being filled)
+            loader: Callable that fetches and publishes the value
+            lookup: Optional callable returning the value once another
+                worker has published it, or None while it is still missing
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+            self._stats["leaders" if is_leader else "followers"] += 1
+
+        if not is_leader:
+            if not call.done.wait(self.wait_timeout_seconds):
+                # Leader is stuck; don't make this request wait forever
+                self._count("fallbacks")
+                return loader()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._lead(key, loader, lookup)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _lead(self, key, loader, lookup):
+        lock_key = f"lock:{key}"
+        token = self.cache_service.acquire_lock(lock_key, self.lock_ttl_seconds)
+        if token:
+            return self._load_locked(lock_key, token, loader)
+
+        # Another worker holds the lock: wait for it to publish the value
+        self._count("remote_waits")
+        if lookup is not None:
+            deadline = time.monotonic() + self.wait_timeout_seconds
+            interval = self.poll_interval_seconds
+            while time.monotonic() < deadline:
+                time.sleep(min(interval, max(0, deadline - time.monotonic())))
+                interval = min(interval * 2, self.max_poll_interval_seconds)
+                value = lookup()
+                if value is not None:
+                    return value
+                # Lock free but nothing published: the leader failed, take over
+                token = self.cache_service.acquire_lock(lock_key, self.lock_ttl_seconds)
+                if token:
+                    # ...unless it published between the lookup and the lock
+                    value = lookup()
+                    if value is not None:
+                        self.cache_service.release_lock(lock_key, token)
+                        return value
+                    return self._load_locked(lock_key, token, loader)
+
+        self._count("fallbacks")
+        return loader()
+
+    def _load_locked(self, lock_key, token, loader):
+        try:
+            return loader()
+        finally:
+            self.cache_service.release_lock(lock_key, token)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
@@ -0,0 +1,213 @@
+"""
+Stale-while-revalidate layer over CacheService.
+
+Entries are stored as a small JSON envelope carrying the value, a soft
+expiry and how long the value took to compute; the Redis TTL is the hard
+expiry. Between the soft and hard expiry the stale value is served at once
+and a single background refresh is scheduled. Refreshes also start a bit
+early at random ("XFetch": the slower a value is to compute, the earlier it
+may refresh), so hot keys written together don't all expire together.
+"""
+import json
+import math
+import random
+import threading
+import time
+from . import metrics
+from .upstream_executor import get_executor
+
+
+def is_cacheable(value):
+    """Upstream failures come back as None or {"error": ...}; never cache those."""
+    if not value:
+        return False
+    return not (isinstance(value, dict) and "error" in value)
+
+
+class StaleWhileRevalidateCache:
+    def __init__(self, cache_service, coalescer, beta=1.0, refresh_lock_seconds=30):
+        self.cache_service = cache_service
+        self.coalescer = coalescer
+        self.beta = beta
+        self.refresh_lock_seconds = refresh_lock_seconds
+
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._stats = {"fresh_hits": 0, "stale_hits": 0, "early_refreshes": 0, "misses": 0,
+                       "refreshes": 0, "refreshes_skipped": 0, "prewarmed_hits": 0}
+
+    def get(self, keys, loader, soft_ttl, hard_ttl):
+        """
+        Value for keys (most specific first), loading it on a miss.
+
+        Args:
+            keys: Cache keys; the first one is written and coalesced on
+            loader: Callable fetching the value (side effects allowed)
+            soft_ttl: Seconds after which the value is served stale and refreshed
+            hard_ttl: Seconds after which the value is gone (Redis TTL)
+            Either TTL may also be a callable taking the loaded value, for
+            data whose freshness comes from upstream timestamps.
+        """
+        hit = self.resolve(keys, self.read(keys), loader, soft_ttl, hard_ttl)
+        if hit is not None:
+            return hit[0]
+        return self.load(keys, loader, soft_ttl, hard_ttl)
+
+    def read(self, keys, skip_local=False):
+        """
+        Raw cache values for keys. Local (L1) copies never outlive the soft
+        expiry, so once any worker refreshes an entry the others pick up the
+        new envelope from Redis instead of refreshing it again.
+        """
+        return self.cache_service.get_many(keys, skip_local=skip_local, local_ttl=self._local_ttl)
+
+    def resolve(self, keys, raw_values, loader, soft_ttl, hard_ttl):
+        """
+        Serves already-fetched raw cache values for keys (e.g. from a batched
+        read). Returns (value, "fresh"|"stale") or None on a miss; stale and
+        early-expiring hits schedule a background refresh.
+        """
+        entry = next((self._unwrap(raw) for raw in raw_values if raw), None)
+        if entry is None:
+            self._count("misses")
+            metrics.record_swr_lookup("miss")
+            return None
+
+        if entry.get("pw"):
+            self._count("prewarmed_hits")
+
+        now = time.time()
+        if now < entry["soft"]:
+            # XFetch: refresh early with a probability that grows near the soft expiry
+            early = now - entry["delta"] * self.beta * math.log(1.0 - random.random()) >= entry["soft"]
+            if not early:
+                self._count("fresh_hits")
+                metrics.record_swr_lookup("fresh", entry.get("pw"))
+                return entry["v"], "fresh"
+            self._count("early_refreshes")
+            metrics.record_swr_lookup("early_refresh", entry.get("pw"))
+            self.schedule_refresh(keys, loader, soft_ttl, hard_ttl, seen_soft=entry["soft"])
+            return entry["v"], "fresh"
+
+        self._count("stale_hits")
+        metrics.record_swr_lookup("stale", entry.get("pw"))
+        self.schedule_refresh(keys, loader, soft_ttl, hard_ttl, seen_soft=entry["soft"])
+        return entry["v"], "stale"
+
+    def load(self, keys, loader, soft_ttl, hard_ttl):
+        """Miss path: one loader call per key across threads and workers."""
+        return self.coalescer.do(
+            keys[0],
+            lambda: self._load_if_missing(keys, loader, soft_ttl, hard_ttl),
+            lookup=lambda: self.peek(keys)
+        )
+
+    def peek(self, keys):
+        """Cached value regardless of staleness, or None."""
+        for raw in self.read(keys):
+            entry = self._unwrap(raw) if raw else None
+            if entry is not None:
+                return entry["v"]
+        return None
+
+    def put(self, keys, value, soft_ttl, hard_ttl, compute_seconds=0.0, prewarmed=False):
+        soft_ttl = soft_ttl(value) if callable(soft_ttl) else soft_ttl
+        hard_ttl = hard_ttl(value) if callable(hard_ttl) else hard_ttl
+        envelope = {"v": value, "soft": time.time() + soft_ttl, "delta": compute_seconds}
+        if prewarmed:
+            envelope["pw"] = True
+        envelope = json.dumps(envelope)
+        for key in keys:
+            self.cache_service.set(key, envelope, ttl_seconds=hard_ttl, local_ttl_seconds=soft_ttl)
+
+    def refresh_ahead(self, keys, loader, soft_ttl, hard_ttl, lead_seconds):
+        """
+        Recomputes the entry if it is missing or goes stale within
+        lead_seconds (used by the pre-warmer). Returns True if it loaded.
+        """
+        raw = next((raw for raw in self.read(keys[:1]) if raw), None)
+        entry = self._unwrap(raw) if raw else None
+        if entry is not None and entry["soft"] - time.time() > lead_seconds:
+            return False
+        self._compute(keys, loader, soft_ttl, hard_ttl, prewarmed=True)
+        return True
+
+    def schedule_refresh(self, keys, loader, soft_ttl, hard_ttl, seen_soft=None):
+        """
+        Background refresh of keys. seen_soft is the soft expiry of the
+        entry that triggered it; if Redis already holds a newer one the
+        refresh is skipped.
+        """
+        key = keys[0]
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        try:
+            get_executor().submit(self._refresh, keys, loader, soft_ttl, hard_ttl, seen_soft)
+        except Exception:
+            with self._lock:
+                self._refreshing.discard(key)
+            raise
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, refreshing=len(self._refreshing))
+
+    def _refresh(self, keys, loader, soft_ttl, hard_ttl, seen_soft=None):
+        lock_key = f"refresh:{keys[0]}"
+        try:
+            # Another worker may already be refreshing this key
+            token = self.cache_service.acquire_lock(lock_key, self.refresh_lock_seconds)
+            if not token:
+                return
+            try:
+                # ...or may have refreshed it already and released the lock
+                raw = self.read(keys[:1], skip_local=True)[0]
+                entry = self._unwrap(raw) if raw else None
+                if entry is not None and seen_soft is not None and entry["soft"] > seen_soft:
+                    self._count("refreshes_skipped")
+                    return
+                self._count("refreshes")
+                self._compute(keys, loader, soft_ttl, hard_ttl)
+            finally:
+                self.cache_service.release_lock(lock_key, token)
+        except Exception as e:
+            print(f"Background refresh of {keys[0]} failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(keys[0])
+
+    def _load_if_missing(self, keys, loader, soft_ttl, hard_ttl):
+        # A previous leader may have filled the key while we queued
+        value = self.peek(keys)
+        if value is not None:
+            return value
+        return self._compute(keys, loader, soft_ttl, hard_ttl)
+
+    def _compute(self, keys, loader, soft_ttl, hard_ttl, prewarmed=False):
+        started = time.monotonic()
+        value = loader()
+        if is_cacheable(value):
+            self.put(keys, value, soft_ttl, hard_ttl,
+                     compute_seconds=time.monotonic() - started, prewarmed=prewarmed)
+        return value
+
+    def _local_ttl(self, raw):
+        entry = self._unwrap(raw)
+        return int(entry["soft"] - time.time()) if entry is not None else 0
+
+    def _unwrap(self, raw):
+        try:
+            entry = json.loads(raw)
+        except (TypeError, ValueError):
+            return None
+        if isinstance(entry, dict) and "soft" in entry and "v" in entry:
+            entry.setdefault("delta", 0.0)
+            return entry
+        # Entry written before envelopes existed: serve it, but as stale
+        return {"v": entry, "soft": 0, "delta": 0.0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
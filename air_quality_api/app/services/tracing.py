@@ -0,0 +1,184 @@
+"""
+Lightweight per-request timing spans.
+
+Each request gets a trace in a context variable; I/O points wrap their
+calls in span("cache"), span("openweather")... and the time is summed per
+span name. The breakdown goes out in a Server-Timing header (admins only)
+and the logs, and requests slower than SLOW_REQUEST_THRESHOLD_MS are sampled
+into a ring buffer (in Redis when available, so the admin endpoint sees
+every worker), written from a background thread.
+Outside a request, spans cost a context variable lookup and nothing else.
+"""
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from pymongo import monitoring
+
+SLOW_REQUESTS_KEY = "admin:slow_requests"
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}          # name -> [total seconds, calls]
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        # Spans may be recorded from run_parallel threads at the same time
+        with self._lock:
+            entry = self.spans.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def breakdown(self):
+        with self._lock:
+            return {name: {"ms": round(total * 1000, 2), "calls": calls}
+                    for name, (total, calls) in self.spans.items()}
+
+
+def start():
+    trace = Trace()
+    _current.set(trace)
+    return trace
+
+
+def current():
+    return _current.get()
+
+
+def finish():
+    trace = _current.get()
+    _current.set(None)
+    return trace
+
+
+@contextmanager
+def span(name):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+def server_timing_header(trace):
+    """Server-Timing value: one metric per span plus the total."""
+    parts = [f'{name};dur={data["ms"]};desc="{data["calls"]} calls"'
+             for name, data in trace.breakdown().items()]
+    parts.append(f"total;dur={round(trace.elapsed_ms(), 2)}")
+    return ", ".join(parts)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Adds every Mongo command's server round trip to the "mongo" span."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    @staticmethod
+    def _record(event):
+        trace = _current.get()
+        if trace is not None:
+            trace.add("mongo", event.duration_micros / 1e6)
+
+
+class Profiler:
+    """cProfile capture for a single request (opt-in per request)."""
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self, limit=30):
+        self._profile.disable()
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+class SlowRequestLog:
+    """Ring buffer of slow (or profiled) requests, shared through Redis."""
+
+    def __init__(self, cache_service, size=100, max_pending=1000):
+        self.cache_service = cache_service
+        self.size = size
+        self._local = deque(maxlen=size)
+        # Slow requests shouldn't also wait on Redis: a worker thread pushes them
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._start_lock = threading.Lock()
+        self._thread_pid = None
+
+    def add(self, record):
+        """Queues the record and returns its id right away."""
+        record = dict(record, id=uuid.uuid4().hex[:12], pid=os.getpid(), at=time.time())
+        if not self.cache_service.client:
+            self._local.appendleft(record)
+            return record["id"]
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._local.appendleft(record)
+        return record["id"]
+
+    def _ensure_started(self):
+        # Threads don't survive gunicorn's fork, so start one per worker on first use
+        if self._thread_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread_pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name="slow-requests", daemon=True).start()
+            self._thread_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            while len(records) < self.size:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                pipeline = self.cache_service.client.pipeline()
+                for record in records:
+                    pipeline.lpush(SLOW_REQUESTS_KEY, json.dumps(record))
+                pipeline.ltrim(SLOW_REQUESTS_KEY, 0, self.size - 1)
+                pipeline.exec()
+            except Exception as e:
+                print(f"Error storing slow requests in Redis: {e}")
+                self._local.extendleft(records)
+
+    def recent(self, limit=None):
+        limit = min(limit or self.size, self.size)
+        client = self.cache_service.client
+        if client:
+            try:
+                return [json.loads(raw) for raw in client.lrange(SLOW_REQUESTS_KEY, 0, limit - 1)]
+            except Exception as e:
+                print(f"Error reading slow requests from Redis: {e}")
+        return list(self._local)[:limit]
@@ -0,0 +1,288 @@
+"""
+Record/replay of upstream traffic (OpenWeather, Nominatim, Gemini).
+
+In "record" mode every upstream call goes out as usual and its response
+(or error) is appended, with how long it took, to a gzip JSON-lines
+archive in UPSTREAM_ARCHIVE_PATH (one file per worker). In "replay" mode
+nothing leaves the process: responses are served from the archive after
+the recorded latency times UPSTREAM_REPLAY_LATENCY_SCALE (0 = instant).
+
+Requests are matched on a normalized key: API keys dropped, coordinates
+rounded, the history window reduced to its length in days, text
+casefolded with whitespace collapsed and Gemini prompts hashed. A key
+recorded several times replays its responses in order, round robin.
+Requests not in the archive fail like an unreachable upstream, or go
+out for real when UPSTREAM_REPLAY_MISSES is "live".
+
+Replayed payloads keep their recorded timestamps, so expiry derived from
+them (weather observation time, forecast slots) falls back to the
+minimum TTLs; compare runs replayed from the same archive with each other.
+"""
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from datetime import timedelta
+from types import SimpleNamespace
+from urllib.parse import parse_qsl, urlsplit
+import requests
+from requests.structures import CaseInsensitiveDict
+
+MODES = ("off", "record", "replay")
+
+# Never part of a key (and never written to the archive)
+SECRET_PARAMS = {"appid", "key", "api_key"}
+_SECRET_VALUE = re.compile(r"\b(" + "|".join(sorted(SECRET_PARAMS)) + r")=[^&\s'\"]*", re.IGNORECASE)
+
+
+class ReplayMiss(requests.exceptions.ConnectionError):
+    """No recorded response for a request; callers see an unreachable upstream."""
+
+
+def _normalize_text(value):
+    # Only case and spacing are ignored; any other difference is a different request
+    return " ".join(unicodedata.normalize("NFC", value).casefold().split())
+
+
+def redact(text):
+    """Masks secret query values in text, e.g. a URL quoted in an error message."""
+    return _SECRET_VALUE.sub(lambda match: f"{match.group(1)}=REDACTED", text)
+
+
+def normalize_params(params):
+    """Stable form of query parameters for matching recorded requests."""
+    params = {name: value for name, value in params.items() if name not in SECRET_PARAMS}
+    if "start" in params and "end" in params:
+        # History windows end "now"; only their length identifies the request
+        try:
+            params["days"] = round((int(params.pop("end")) - int(params.pop("start"))) / 86400)
+        except (TypeError, ValueError):
+            pass
+    normalized = {}
+    for name, value in params.items():
+        try:
+            normalized[name] = round(float(value), 4)
+        except (TypeError, ValueError):
+            normalized[name] = _normalize_text(str(value))
+    return normalized
+
+
+class UpstreamArchive:
+    def __init__(self, path, mode="record", latency_scale=1.0, live_misses=False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown upstream archive mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.live_misses = live_misses
+        self._entries = {}       # key -> [entry, ...]
+        self._cursor = {}        # key -> next entry index
+        self._file = None
+        self._file_pid = None
+        self._lock = threading.Lock()
+        self._stats = {}
+        if mode == "replay":
+            self._load()
+
+    @property
+    def recording(self):
+        return self.mode == "record"
+
+    def adapter(self, service, **adapter_kwargs):
+        """requests transport adapter recording or replaying this service's calls."""
+        return ArchiveAdapter(self, service, **adapter_kwargs)
+
+    def wrap_model(self, model, service="gemini"):
+        """Gemini GenerativeModel stand-in recording or replaying generate_content."""
+        return ArchivedModel(self, model, service)
+
+    def key(self, service, operation, params):
+        return json.dumps([service, operation, params], sort_keys=True, separators=(",", ":"))
+
+    def record(self, service, key, elapsed_ms, **payload):
+        if "message" in payload:
+            # Request errors quote the full URL, API key included
+            payload["message"] = redact(payload["message"])
+        entry = dict(payload, key=redact(key), service=service, elapsed_ms=round(elapsed_ms, 2), at=time.time())
+        line = (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            # One gzip member per entry: the file stays readable even if the worker dies mid-run
+            self._open_file().write(gzip.compress(line))
+            self._file.flush()
+        self._count(service, "recorded")
+
+    def lookup(self, service, key):
+        """Next recorded entry for key (round robin), or None."""
+        with self._lock:
+            entries = self._entries.get(key)
+            if entries:
+                index = self._cursor.get(key, 0)
+                self._cursor[key] = index + 1
+        if not entries:
+            self._count(service, "misses")
+            return None
+        self._count(service, "replayed")
+        return entries[index % len(entries)]
+
+    def delay(self, elapsed_ms):
+        if self.latency_scale > 0 and elapsed_ms:
+            time.sleep(elapsed_ms * self.latency_scale / 1000)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "keys": len(self._entries),
+                "services": {service: dict(counts) for service, counts in self._stats.items()}
+            }
+
+    def _open_file(self):
+        # Opened lazily so each gunicorn worker appends to its own file
+        if self._file is None or self._file_pid != os.getpid():
+            os.makedirs(self.path, exist_ok=True)
+            self._file = open(os.path.join(self.path, f"upstream-{os.getpid()}-{int(time.time())}.jsonl.gz"), "ab")
+            self._file_pid = os.getpid()
+        return self._file
+
+    def _load(self):
+        count = 0
+        for filename in sorted(glob.glob(os.path.join(self.path, "*.jsonl.gz"))):
+            try:
+                with gzip.open(filename, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["key"], []).append(entry)
+                        count += 1
+            except (OSError, EOFError, ValueError) as e:
+                # A worker killed mid-write leaves a truncated last entry
+                print(f"Stopped reading {filename} early: {e}")
+        for entries in self._entries.values():
+            entries.sort(key=lambda entry: entry["at"])
+        print(f"Loaded {count} recorded upstream responses ({len(self._entries)} keys) from {self.path}")
+
+    def _count(self, service, name):
+        with self._lock:
+            counts = self._stats.setdefault(service, {})
+            counts[name] = counts.get(name, 0) + 1
+
+
+class ArchiveAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter that records responses, or serves them from the archive."""
+
+    def __init__(self, archive, service, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+        self.service = service
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        params = normalize_params(dict(parse_qsl(url.query)))
+        key = self.archive.key(self.service, f"{request.method} {url.path.rstrip('/')}", params)
+
+        if not self.archive.recording:
+            entry = self.archive.lookup(self.service, key)
+            if entry is not None:
+                return self._replay(request, entry)
+            if not self.archive.live_misses:
+                raise ReplayMiss(f"No recorded response for {self.service} {url.path}", request=request)
+            return super().send(request, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+            body = response.text
+        except requests.exceptions.RequestException as e:
+            self.archive.record(self.service, key, (time.perf_counter() - started) * 1000,
+                                error=type(e).__name__, message=str(e))
+            raise
+        self.archive.record(
+            self.service, key, (time.perf_counter() - started) * 1000,
+            status=response.status_code, reason=response.reason,
+            content_type=response.headers.get("Content-Type"), body=body
+        )
+        return response
+
+    def _replay(self, request, entry):
+        self.archive.delay(entry["elapsed_ms"])
+        if "error" in entry:
+            error = getattr(requests.exceptions, entry["error"], requests.exceptions.ConnectionError)
+            raise error(entry.get("message", "Recorded upstream error"), request=request)
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry.get("reason")
+        response.headers = CaseInsensitiveDict({"Content-Type": entry.get("content_type") or "application/json"})
+        response._content = entry["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(milliseconds=entry["elapsed_ms"])
+        return response
+
+
+class ArchivedModel:
+    """Wraps a GenerativeModel; responses are recorded or replayed as plain text."""
+
+    def __init__(self, archive, model, service="gemini"):
+        self.archive = archive
+        self.model = model
+        self.service = service
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        key = self.archive.key(self.service, "stream" if stream else "generate", {
+            "prompt": hashlib.sha256(str(contents).encode("utf-8")).hexdigest(),
+            "config": json.dumps(kwargs.get("generation_config"), sort_keys=True, default=str)
+        })
+        if not self.archive.recording:
+            entry = self.archive.lookup(self.service, key)
+            if entry is not None:
+                return self._replay_stream(entry) if stream else self._replay(entry)
+            if not self.archive.live_misses:
+                raise ReplayMiss(f"No recorded {self.service} response for this prompt")
+            return self.model.generate_content(contents, stream=stream, **kwargs)
+
+        if stream:
+            return self._record_stream(key, contents, kwargs)
+        started = time.perf_counter()
+        try:
+            text = self.model.generate_content(contents, **kwargs).text
+        except Exception as e:
+            self.archive.record(self.service, key, (time.perf_counter() - started) * 1000,
+                                error=type(e).__name__, message=str(e))
+            raise
+        self.archive.record(self.service, key, (time.perf_counter() - started) * 1000, text=text)
+        return SimpleNamespace(text=text)
+
+    def _record_stream(self, key, contents, kwargs):
+        started = time.perf_counter()
+        chunks = []      # [ms since start, text]
+        try:
+            for chunk in self.model.generate_content(contents, stream=True, **kwargs):
+                text = chunk.text
+                chunks.append([round((time.perf_counter() - started) * 1000, 2), text])
+                yield chunk
+        except Exception as e:
+            self.archive.record(self.service, key, (time.perf_counter() - started) * 1000,
+                                chunks=chunks, error=type(e).__name__, message=str(e))
+            raise
+        self.archive.record(self.service, key, (time.perf_counter() - started) * 1000, chunks=chunks)
+
+    def _replay(self, entry):
+        self.archive.delay(entry["elapsed_ms"])
+        if "error" in entry:
+            raise RuntimeError(f"Recorded {entry['error']}: {entry.get('message')}")
+        return SimpleNamespace(text=entry["text"])
+
+    def _replay_stream(self, entry):
+        previous = 0.0
+        for offset_ms, text in entry.get("chunks", []):
+            self.archive.delay(offset_ms - previous)
+            previous = offset_ms
+            yield SimpleNamespace(text=text)
+        self.archive.delay(entry["elapsed_ms"] - previous)
+        if "error" in entry:
+            raise RuntimeError(f"Recorded {entry['error']}: {entry.get('message')}")
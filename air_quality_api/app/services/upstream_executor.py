@@ -0,0 +1,80 @@
+"""
+Shared, bounded thread pool for issuing independent upstream calls at once.
+
+The pool is created lazily per process: gunicorn preloads the app in the
+master and forks workers afterwards, and threads do not survive a fork.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+import contextvars
+import os
+import threading
+import time
+from config import Config
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(
+                    max_workers=Config.UPSTREAM_MAX_WORKERS,
+                    thread_name_prefix="upstream"
+                )
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def run_parallel(tasks, timeout_seconds, max_concurrency=None):
+    """
+    Runs zero-argument callables concurrently and waits for all of them,
+    but never longer than timeout_seconds overall.
+
+    Args:
+        tasks: dict of name -> callable
+        timeout_seconds: Deadline for the whole group
+        max_concurrency: Optional cap on how many of these tasks may be in
+            flight at once, so one large request can't take the whole pool
+
+    Returns:
+        (results, failures): results maps name -> return value for the calls
+        that finished in time; failures maps name -> "timeout" or the error
+        message for the rest.
+    """
+    executor = get_executor()
+    deadline = time.monotonic() + timeout_seconds
+    futures = {}
+    slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+    for name, fn in tasks.items():
+        if slots is not None:
+            if not slots.acquire(timeout=max(0, deadline - time.monotonic())):
+                break
+        # Run in a copy of the caller's context so request timing spans follow
+        future = executor.submit(contextvars.copy_context().run, fn)
+        if slots is not None:
+            future.add_done_callback(lambda _: slots.release())
+        futures[name] = future
+    wait(futures.values(), timeout=max(0, deadline - time.monotonic()))
+
+    results = {}
+    failures = {}
+    for name, future in futures.items():
+        if not future.done():
+            # Can't interrupt a running thread; let it finish in the background
+            future.cancel()
+            failures[name] = "timeout"
+            print(f"Upstream call '{name}' exceeded the {timeout_seconds}s deadline")
+        elif future.exception() is not None:
+            failures[name] = str(future.exception())
+            print(f"Upstream call '{name}' failed: {future.exception()}")
+        else:
+            results[name] = future.result()
+    for name in tasks:
+        if name not in futures:
+            # Never started: the deadline passed while waiting for a slot
+            failures[name] = "timeout"
+    return results, failures
@@ -0,0 +1,162 @@
+"""
+Location visits stored as per-(user, location, day) counters.
+
+Instead of one document per search, each visit upserts a single
+location_visits_daily document with $inc/$max, so history reads are an
+indexed range scan over at most one document per location and day.
+migrate_raw_visits() folds the old one-document-per-visit collection in.
+"""
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+COUNTER_COLLECTION = "location_visits_daily"
+RAW_COLLECTION = "location_visits"
+HISTORY_LIMIT = 50
+# Migration batches already folded into a counter (removed when a run completes)
+MIGRATED_FIELD = "migrated_batches"
+DUPLICATE_KEY = 11000
+# Fields of the unique "visit_key" index (see database_schema)
+COUNTER_KEY = ["user_id", "location_name", "latitude", "longitude", "day"]
+
+
+def counter_update(user_id, lat, lon, location_name, visited_at, count=1):
+    """Filter and $inc/$max update recording `count` visits."""
+    day = visited_at.strftime('%Y-%m-%d')
+    filter = {
+        "user_id": user_id,
+        "location_name": location_name,
+        "latitude": lat,
+        "longitude": lon,
+        "day": day
+    }
+    update = {
+        "$inc": {"visit_count": count},
+        "$max": {"last_visit": visited_at},
+        "$setOnInsert": {"date": datetime.strptime(day, '%Y-%m-%d')}
+    }
+    return filter, update
+
+
+def read_history(db, user_id, days=7):
+    """Visits per location over the last N days, most recent first."""
+    start_day = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d')
+    cursor = db[COUNTER_COLLECTION].find(
+        {"user_id": user_id, "day": {"$gte": start_day}},
+        {"_id": 0, "location_name": 1, "latitude": 1, "longitude": 1, "visit_count": 1, "last_visit": 1}
+    )
+
+    # At most `days` counters per location: merge them here instead of $group
+    locations = {}
+    for doc in cursor:
+        key = (doc['location_name'], doc['latitude'], doc['longitude'])
+        merged = locations.get(key)
+        if merged is None:
+            locations[key] = dict(doc)
+        else:
+            merged['visit_count'] += doc['visit_count']
+            merged['last_visit'] = max(merged['last_visit'], doc['last_visit'])
+
+    ordered = sorted(locations.values(), key=lambda item: item['last_visit'], reverse=True)
+    return [
+        {
+            "location_name": item['location_name'],
+            "latitude": item['latitude'],
+            "longitude": item['longitude'],
+            "visited_at": item['last_visit'].isoformat(),
+            "search_count": item['visit_count']
+        }
+        for item in ordered[:HISTORY_LIMIT]
+    ]
+
+
+def migrate_raw_visits(db, batch_size=1000):
+    """
+    Folds raw visit documents into daily counters and removes them, one
+    batch at a time, so the migration can be re-run safely even after a
+    crash. Returns (raw visits folded, counters touched).
+
+    Each batch's raw documents are stamped with a batch id before their
+    counters are incremented, and a counter only takes a batch's $inc once
+    (it records the id). A re-run after a crash reuses the stamped ids, so
+    visits already counted are deleted rather than counted again. That
+    relies on the unique counter index, so without it nothing is migrated.
+    """
+    if not _has_unique_counter_key(db):
+        raise RuntimeError(f"{COUNTER_COLLECTION} has no unique index on {', '.join(COUNTER_KEY)}; "
+                           f"run ensure-schema first")
+    cutoff = datetime.utcnow()
+    pipeline = [
+        {"$match": {"visited_at": {"$lte": cutoff}}},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "name": "$location_name",
+                "lat": "$latitude",
+                "lon": "$longitude",
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$visited_at"}},
+                "batch": "$migration_batch"
+            },
+            "last_visit": {"$max": "$visited_at"},
+            "visit_count": {"$sum": 1},
+            "ids": {"$push": "$_id"}
+        }}
+    ]
+
+    folded = 0
+    touched = 0
+    batch = []
+    for group in db[RAW_COLLECTION].aggregate(pipeline, allowDiskUse=True):
+        batch.append(group)
+        if len(batch) >= batch_size:
+            folded, touched = _migrate_batch(db, batch, folded, touched)
+            batch = []
+    if batch:
+        folded, touched = _migrate_batch(db, batch, folded, touched)
+
+    # Every stamped raw document is gone now; drop the bookkeeping
+    db[COUNTER_COLLECTION].update_many({MIGRATED_FIELD: {"$exists": True}}, {"$unset": {MIGRATED_FIELD: ""}})
+    return folded, touched
+
+
+def _has_unique_counter_key(db):
+    for info in db[COUNTER_COLLECTION].index_information().values():
+        if info.get("unique") and [field for field, _ in info["key"]] == COUNTER_KEY:
+            return True
+    return False
+
+
+def _migrate_batch(db, groups, folded, touched):
+    batch_id = ObjectId()
+    fresh_ids = [raw_id for group in groups if group['_id'].get('batch') is None for raw_id in group['ids']]
+    if fresh_ids:
+        db[RAW_COLLECTION].update_many({"_id": {"$in": fresh_ids}}, {"$set": {"migration_batch": batch_id}})
+
+    operations = []
+    for group in groups:
+        key = group['_id']
+        group_batch = key.get('batch') or batch_id
+        filter, update = counter_update(
+            key['user_id'], key['lat'], key['lon'], key['name'],
+            group['last_visit'], count=group['visit_count']
+        )
+        # Already applied for this batch: the filter misses and the upsert
+        # collides with the unique counter index instead of counting twice
+        filter[MIGRATED_FIELD] = {"$ne": group_batch}
+        update["$addToSet"] = {MIGRATED_FIELD: group_batch}
+        operations.append(UpdateOne(filter, update, upsert=True))
+        folded += group['visit_count']
+    try:
+        db[COUNTER_COLLECTION].bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Only "already applied" collisions are expected; anything else aborts
+        # before this batch's raw visits are deleted
+        write_errors = e.details.get("writeErrors", [])
+        if (e.details.get("writeConcernErrors") or not write_errors
+                or any(error.get("code") != DUPLICATE_KEY for error in write_errors)):
+            raise
+    touched += len(operations)
+
+    db[RAW_COLLECTION].delete_many({"_id": {"$in": [raw_id for group in groups for raw_id in group['ids']]}})
+    return folded, touched
@@ -1,34 +1,71 @@
 import requests
 import os
+import time
+from datetime import datetime, timezone
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 import pybreaker
+from . import metrics
+
+# OpenWeather publishes a new current observation about every 10 minutes and a
+# new forecast slot every 3 hours
+OBSERVATION_INTERVAL_SECONDS = 600
+FORECAST_SLOT_SECONDS = 3 * 3600
+
+
+def next_observation(observed_at, now=None):
+    """Unix time a newer observation than the one taken at observed_at is due."""
+    now = now or time.time()
+    if not observed_at:
+        return now + OBSERVATION_INTERVAL_SECONDS
+    return observed_at + OBSERVATION_INTERVAL_SECONDS
+
+
+def next_forecast_slot(slot_texts, now=None):
+    """First forecast slot (dt_txt, UTC) still ahead of now, as unix time."""
+    now = now or time.time()
+    for text in slot_texts:
+        try:
+            slot = datetime.strptime(text, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            continue
+        if slot > now:
+            return slot
+    return now + FORECAST_SLOT_SECONDS
+
 
 class WeatherService:
     # Circuit breaker for OpenWeather API
     circuit_breaker = pybreaker.CircuitBreaker(
         fail_max=5,  # Open circuit after 5 failures
-        reset_timeout=60  # Stay open for 60 seconds (correct parameter name)
+        reset_timeout=60,  # Stay open for 60 seconds (correct parameter name)
+        listeners=[metrics.BreakerStateListener("openweather")]
     )
     
-    def __init__(self, api_key):
+    def __init__(self, api_key, base_url="https://api.openweathermap.org/data/2.5", archive=None):
         """
         El constructor ahora requiere la clave de la API.
+        archive: optional UpstreamArchive recording or replaying the calls.
         """
         if not api_key:
             raise ValueError("La clave de API de OpenWeather no puede estar vacía.")
         self.api_key = api_key
-        self.base_url = "https://api.openweathermap.org/data/2.5"
+        self.base_url = base_url.rstrip("/")
         
         # Connection pooling with requests.Session
         self.session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(
+        adapter_kwargs = dict(
             pool_connections=10,
             pool_maxsize=20,
             max_retries=0  # We handle retries with tenacity
         )
+        if archive is not None:
+            adapter = archive.adapter("openweather", **adapter_kwargs)
+        else:
+            adapter = requests.adapters.HTTPAdapter(**adapter_kwargs)
         self.session.mount('https://', adapter)
         self.session.mount('http://', adapter)
 
+    @metrics.track_upstream("openweather")
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=1, max=10),
@@ -73,12 +110,6 @@ class WeatherService:
             print(f"Error al llamar a la API de OpenWeather (Air Quality): {e}")
             return {"error": f"No se pudo conectar a la API de OpenWeather: {e}"}
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=1, max=10),
-        retry=retry_if_exception_type((requests.exceptions.RequestException, requests.exceptions.Timeout))
-    )
-    @circuit_breaker
     def get_current_weather(self, lat, lon, lang='es'):
         """
         Obtiene el clima actual.
@@ -87,6 +118,21 @@ class WeatherService:
             lon: Longitude
             lang: Language code (es, en, etc.)
         """
+        entry = self.fetch_current_weather(lat, lon, lang)
+        return entry["current"] if entry else None
+
+    @metrics.track_upstream("openweather")
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=1, max=10),
+        retry=retry_if_exception_type((requests.exceptions.RequestException, requests.exceptions.Timeout))
+    )
+    @circuit_breaker
+    def fetch_current_weather(self, lat, lon, lang='es'):
+        """
+        Current weather plus when OpenWeather will have a newer observation:
+        {"current": {...}, "expires_at": unix}. None on failure.
+        """
         params = {
             'lat': lat,
             'lon': lon,
@@ -96,7 +142,7 @@ class WeatherService:
         }
         try:
             response = self.session.get(
-                "https://api.openweathermap.org/data/2.5/weather", 
+                f"{self.base_url}/weather", 
                 params=params, 
                 timeout=10
             )
@@ -104,9 +150,12 @@ class WeatherService:
             data = response.json()
             
             return {
-                "temp": data['main']['temp'],
-                "condition": data['weather'][0]['description'],
-                "icon": data['weather'][0]['icon']
+                "current": {
+                    "temp": data['main']['temp'],
+                    "condition": data['weather'][0]['description'],
+                    "icon": data['weather'][0]['icon']
+                },
+                "expires_at": next_observation(data.get('dt'))
             }
         except pybreaker.CircuitBreakerError:
             print("Circuit breaker is OPEN - OpenWeather API is unavailable")
@@ -115,12 +164,6 @@ class WeatherService:
             print(f"Error getting weather: {e}")
             return None
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=1, max=10),
-        retry=retry_if_exception_type((requests.exceptions.RequestException, requests.exceptions.Timeout))
-    )
-    @circuit_breaker
     def get_forecast(self, lat, lon, lang='es'):
         """
         Obtiene el pronóstico de 5 días.
@@ -129,6 +172,23 @@ class WeatherService:
             lon: Longitude
             lang: Language code (es, en, etc.)
         """
+        entry = self.fetch_forecast(lat, lon, lang)
+        return entry["forecast"] if entry else []
+
+    @metrics.track_upstream("openweather")
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=1, max=10),
+        retry=retry_if_exception_type((requests.exceptions.RequestException, requests.exceptions.Timeout))
+    )
+    @circuit_breaker
+    def fetch_forecast(self, lat, lon, lang='es'):
+        """
+        Daily forecast plus the time of the next 3-hour slot, when the
+        upstream list moves on: {"forecast": [...], "expires_at": unix}.
+        The summary only uses the untranslated 'main' condition, so the
+        result is the same for every language. None on failure.
+        """
         params = {
             'lat': lat,
             'lon': lon,
@@ -138,7 +198,7 @@ class WeatherService:
         }
         try:
             response = self.session.get(
-                f"https://api.openweathermap.org/data/2.5/forecast", 
+                f"{self.base_url}/forecast", 
                 params=params, 
                 timeout=10
             )
@@ -168,15 +228,21 @@ class WeatherService:
                     **info
                 })
             
-            return forecast_list[:5]
+            if not forecast_list:
+                return None
+            return {
+                "forecast": forecast_list[:5],
+                "expires_at": next_forecast_slot(item['dt_txt'] for item in data['list'])
+            }
             
         except pybreaker.CircuitBreakerError:
             print("Circuit breaker is OPEN - OpenWeather API is unavailable")
-            return []
+            return None
         except Exception as e:
             print(f"Error getting forecast: {e}")
-            return []
+            return None
 
+    @metrics.track_upstream("openweather", failed=lambda history: not history)
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=1, max=10),
@@ -0,0 +1,147 @@
+"""
+Per-process write-behind buffer for MongoDB inserts and upserts.
+
+Request threads only enqueue documents; a background thread flushes them
+per collection with an unordered insert_many (or bulk_write for upserts)
+once a batch fills up or the flush interval passes. The queue is bounded:
+when it is full, the caller waits briefly and then writes its document
+synchronously instead of dropping it (backpressure).
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from pymongo import UpdateOne, errors
+
+DUPLICATE_KEY = 11000
+
+
+class WriteBehindBuffer:
+    def __init__(self, db, max_pending=10000, batch_size=500, flush_interval_seconds=1.0, enqueue_timeout_seconds=0.05):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.enqueue_timeout_seconds = enqueue_timeout_seconds
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+        self._stopping = threading.Event()
+        self._stats = {"queued": 0, "written": 0, "failed": 0, "sync_writes": 0, "flushes": 0}
+
+    def insert(self, collection_name, document):
+        """Queues a document for insertion; returns as soon as it is queued."""
+        self._enqueue(collection_name, document)
+
+    def upsert(self, collection_name, filter, update):
+        """Queues an update_one(filter, update, upsert=True)."""
+        self._enqueue(collection_name, UpdateOne(filter, update, upsert=True))
+
+    def _enqueue(self, collection_name, operation):
+        self._ensure_started()
+        try:
+            self._queue.put((collection_name, operation), timeout=self.enqueue_timeout_seconds)
+            self._stats["queued"] += 1
+        except queue.Full:
+            # Buffer is saturated: slow this request down instead of losing data
+            self._stats["sync_writes"] += 1
+            if isinstance(operation, UpdateOne):
+                self.db[collection_name].bulk_write([operation])
+            else:
+                self.db[collection_name].insert_one(operation)
+
+    def flush(self):
+        """Writes everything currently queued. Safe to call from any thread."""
+        with self._flush_lock:
+            while True:
+                batch = self._drain(self.batch_size)
+                if not batch:
+                    return
+                self._write(batch)
+
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval_seconds * 2)
+        self.flush()
+
+    def stats(self):
+        return dict(self._stats, pending=self._queue.qsize())
+
+    def _ensure_started(self):
+        # Threads don't survive gunicorn's fork, so start one per worker on first use
+        if self._thread_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+            self._thread_pid = os.getpid()
+            atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval_seconds)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval_seconds
+            while len(batch) < self.batch_size and not self._stopping.is_set():
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            with self._flush_lock:
+                self._write(batch)
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        inserts = {}
+        updates = {}
+        for collection_name, operation in batch:
+            target = updates if isinstance(operation, UpdateOne) else inserts
+            target.setdefault(collection_name, []).append(operation)
+
+        for collection_name, documents in inserts.items():
+            self._run_bulk(collection_name, len(documents),
+                           lambda c: c.insert_many(documents, ordered=False))
+        for collection_name, operations in updates.items():
+            self._run_bulk(collection_name, len(operations),
+                           lambda c: c.bulk_write(operations, ordered=False), operations)
+        self._stats["flushes"] += 1
+
+    def _run_bulk(self, collection_name, count, write, upserts=None):
+        try:
+            write(self.db[collection_name])
+            self._stats["written"] += count
+        except errors.BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            retry = []
+            if upserts:
+                # Two upserts raced to insert the same key: the document exists
+                # now, so running the loser again applies it as an update
+                retry = [upserts[error["index"]] for error in write_errors if error.get("code") == DUPLICATE_KEY]
+            failed = len(write_errors) - len(retry)
+            self._stats["written"] += count - len(write_errors)
+            self._stats["failed"] += failed
+            if failed:
+                print(f"Write-behind: {failed} of {count} writes to {collection_name} failed")
+            if retry:
+                self._run_bulk(collection_name, len(retry), lambda c: c.bulk_write(retry, ordered=False))
+        except Exception as e:
+            self._stats["failed"] += count
+            print(f"Write-behind: could not write {count} operations to {collection_name}: {e}")
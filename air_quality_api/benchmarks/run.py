@@ -0,0 +1,323 @@
+"""
+Offline load test: the real app under gunicorn.conf.py against local stubs.
+
+Starts the stand-ins from stubs.py, launches gunicorn with this repo's
+gunicorn.conf.py pointed at them, drives a seeded mix of requests from
+concurrent clients and reports req/s, p50/p95/p99 per endpoint and how
+many upstream calls each stub received. Results are saved as JSON;
+--compare prints the change against a previous run.
+
+Run from air_quality_api/:
+
+    python -m benchmarks.run --duration 30 --concurrency 16
+    python -m benchmarks.run --openweather-latency 300 --error-rate openweather=0.05 \\
+        --compare benchmarks/results/baseline.json
+
+Without --mongo-uri the app runs without MongoDB (as it does when Atlas is
+unreachable), so persistence costs are not measured; pass a local mongod
+(MONGO_TLS is turned off) to include them.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from .stubs import GeminiStub, NominatimStub, OpenWeatherStub, UpstashStub
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(APP_DIR, "benchmarks", "results")
+
+DEFAULT_MIX = "air_quality=30,weather=15,dashboard=15,history=10,advice=10,batch=5,search=10,health=5"
+
+SEARCH_TERMS = ["mad", "madrid", "barc", "sevilla", "valen", "bilbao", "lisboa", "paris", "londres", "roma",
+                "berlin", "mexico", "bogota", "lima", "santiago", "quito", "caracas", "buenos aires"]
+
+
+def parse_pairs(text, cast=float):
+    pairs = {}
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        name, _, value = item.partition("=")
+        pairs[name.strip()] = cast(value)
+    return pairs
+
+
+def make_locations(count, seed):
+    """Fixed set of points around a few cities; same seed, same points."""
+    rng = random.Random(seed)
+    centers = [(40.4168, -3.7038), (41.3874, 2.1686), (19.4326, -99.1332), (4.7110, -74.0721), (-34.6037, -58.3816)]
+    return [(round(lat + rng.uniform(-0.3, 0.3), 5), round(lon + rng.uniform(-0.3, 0.3), 5))
+            for lat, lon in (rng.choice(centers) for _ in range(count))]
+
+
+class Workload:
+    """Builds requests for each endpoint; locations are picked with a hot-spot skew."""
+
+    def __init__(self, base_url, locations, skew):
+        self.base_url = base_url
+        self.locations = locations
+        # Zipf-like weights: a few locations get most of the traffic, as in production
+        self.weights = [1.0 / (rank + 1) ** skew for rank in range(len(locations))]
+
+    def location(self, rng):
+        return rng.choices(self.locations, weights=self.weights)[0]
+
+    def request(self, endpoint, rng):
+        lat, lon = self.location(rng)
+        lang = rng.choice(["es", "en"])
+        url = self.base_url
+        if endpoint == "air_quality":
+            return "GET", f"{url}/api/air_quality", {"params": {"lat": lat, "lon": lon}}
+        if endpoint == "weather":
+            return "GET", f"{url}/api/weather", {"params": {"lat": lat, "lon": lon, "lang": lang}}
+        if endpoint == "dashboard":
+            return "GET", f"{url}/api/dashboard", {"params": {"lat": lat, "lon": lon, "lang": lang}}
+        if endpoint == "history":
+            return "GET", f"{url}/api/history", {"params": {"lat": lat, "lon": lon, "days": 7}}
+        if endpoint == "advice":
+            aqi = {"aqi": rng.randint(1, 5), "components": {"pm2_5": rng.randint(0, 90), "pm10": rng.randint(0, 150)}}
+            return "POST", f"{url}/api/advice", {"json": {
+                "weather": rng.choice(["clear sky", "light rain", "mist"]), "aqi": aqi, "language": lang}}
+        if endpoint == "batch":
+            points = [dict(zip(("lat", "lon"), self.location(rng))) for _ in range(5)]
+            return "POST", f"{url}/api/air_quality/batch", {"json": {"coordinates": points}}
+        if endpoint == "search":
+            term = rng.choice(SEARCH_TERMS)
+            return "GET", f"{url}/api/search", {"params": {"q": term[:rng.randint(3, len(term))]}}
+        if endpoint == "health":
+            return "GET", f"{url}/api/health", {}
+        raise ValueError(f"unknown endpoint {endpoint}")
+
+
+def client_loop(workload, mix, seed, users, warmup_until, stop_at, samples, lock):
+    rng = random.Random(seed)
+    session = requests.Session()
+    names, weights = zip(*mix.items())
+    while time.monotonic() < stop_at:
+        endpoint = rng.choices(names, weights=weights)[0]
+        method, url, kwargs = workload.request(endpoint, rng)
+        headers = {"X-User-Id": f"bench-{rng.randrange(users)}"}
+        started = time.monotonic()
+        try:
+            response = session.request(method, url, headers=headers, timeout=60, **kwargs)
+            ok = response.status_code < 400
+            status = response.status_code
+        except requests.RequestException as e:
+            ok, status = False, type(e).__name__
+        elapsed_ms = (time.monotonic() - started) * 1000
+        if started >= warmup_until:
+            with lock:
+                samples.setdefault(endpoint, []).append((elapsed_ms, ok, status))
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return round(sorted_values[index], 2)
+
+
+def summarize(samples, seconds):
+    report = {}
+    for endpoint, items in sorted(samples.items()) + [("ALL", [s for items in samples.values() for s in items])]:
+        latencies = sorted(ms for ms, _, _ in items)
+        statuses = {}
+        for _, _, status in items:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        report[endpoint] = {
+            "requests": len(items),
+            "errors": sum(1 for _, ok, _ in items if not ok),
+            "req_per_s": round(len(items) / seconds, 2) if seconds else None,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": round(latencies[-1], 2) if latencies else None,
+            "statuses": statuses
+        }
+    return report
+
+
+def stub_deltas(before, after):
+    deltas = {}
+    for name in after:
+        calls = {op: n - before[name]["calls"].get(op, 0) for op, n in after[name]["calls"].items()}
+        errors = {op: n - before[name]["errors"].get(op, 0) for op, n in after[name]["errors"].items()}
+        deltas[name] = {"calls": {op: n for op, n in calls.items() if n},
+                        "errors": {op: n for op, n in errors.items() if n},
+                        "total_calls": sum(calls.values())}
+    return deltas
+
+
+def wait_until_ready(base_url, process, timeout_seconds):
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/api/health", timeout=2).status_code < 600:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("app did not become ready in time")
+
+
+def start_app(args, stubs, port, log_file):
+    env = dict(
+        os.environ,
+        OPENWEATHER_API_KEY="bench",
+        GEMINI_API_KEY="bench",
+        OPENWEATHER_BASE_URL=stubs["openweather"].url,
+        GEMINI_API_ENDPOINT=stubs["gemini"].url,
+        NOMINATIM_URL=stubs["nominatim"].url,
+        UPSTASH_REDIS_REST_URL=stubs["upstash"].url,
+        UPSTASH_REDIS_REST_TOKEN="bench",
+        MONGO_URI=args.mongo_uri or "mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=500",
+        MONGO_TLS="false",
+        RATELIMIT_ENABLED="true" if args.rate_limit else "false",
+        RATELIMIT_STORAGE="local",
+        PROMETHEUS_MULTIPROC_DIR=tempfile.mkdtemp(prefix="bench-metrics-"),
+    )
+    env.update(parse_pairs(args.env, cast=str))
+    command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-b", f"127.0.0.1:{port}"]
+    if args.workers:
+        command += ["-w", str(args.workers)]
+    command.append("main:app")
+    return subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def print_report(result, baseline=None):
+    print(f"\n{'endpoint':<12} {'req':>7} {'err':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for endpoint, row in result["endpoints"].items():
+        line = (f"{endpoint:<12} {row['requests']:>7} {row['errors']:>5} {row['req_per_s']:>8} "
+                f"{row['p50_ms']!s:>8} {row['p95_ms']!s:>8} {row['p99_ms']!s:>8}")
+        base = (baseline or {}).get("endpoints", {}).get(endpoint)
+        if base:
+            line += "   vs baseline: " + ", ".join(
+                f"{key} {_change(base.get(key), row.get(key))}" for key in ("req_per_s", "p95_ms", "p99_ms"))
+        print(line)
+    print("\nupstream calls:")
+    for name, data in result["upstream"].items():
+        line = f"  {name:<12} {data['total_calls']:>7}  {data['calls']}"
+        base = (baseline or {}).get("upstream", {}).get(name)
+        if base:
+            line += f"   vs baseline {_change(base['total_calls'], data['total_calls'])}"
+        print(line)
+
+
+def _change(old, new):
+    if old in (None, 0) or new is None:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds excluded from the results")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--workers", type=int, help="override gunicorn.conf.py's worker count")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight,... (%(default)s)")
+    parser.add_argument("--locations", type=int, default=200, help="distinct client locations")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of location popularity")
+    parser.add_argument("--users", type=int, default=10000, help="distinct X-User-Id values")
+    parser.add_argument("--no-rate-limit", dest="rate_limit", action="store_false")
+    parser.add_argument("--openweather-latency", type=float, default=120)
+    parser.add_argument("--gemini-latency", type=float, default=600)
+    parser.add_argument("--nominatim-latency", type=float, default=250)
+    parser.add_argument("--upstash-latency", type=float, default=3)
+    parser.add_argument("--jitter", type=float, default=0.25, help="latency jitter as a fraction of latency")
+    parser.add_argument("--error-rate", default="", help="service=rate,... e.g. openweather=0.05")
+    parser.add_argument("--mongo-uri", help="local MongoDB to include persistence (no TLS)")
+    parser.add_argument("--env", default="", help="extra app settings, NAME=value,...")
+    parser.add_argument("--output", help="result file (default benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="previous result file to compare against")
+    args = parser.parse_args(argv)
+
+    mix = parse_pairs(args.mix)
+    error_rates = parse_pairs(args.error_rate)
+    latencies = {"openweather": args.openweather_latency, "gemini": args.gemini_latency,
+                 "nominatim": args.nominatim_latency, "upstash": args.upstash_latency}
+    stubs = {}
+    for i, cls in enumerate((OpenWeatherStub, GeminiStub, NominatimStub, UpstashStub)):
+        latency = latencies[cls.name]
+        stubs[cls.name] = cls(latency_ms=latency, jitter_ms=latency * args.jitter,
+                              error_rate=error_rates.get(cls.name, 0.0), seed=args.seed + i).start()
+
+    log_file = tempfile.NamedTemporaryFile(prefix="bench-gunicorn-", suffix=".log", delete=False)
+    process = start_app(args, stubs, args.port, log_file)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_until_ready(base_url, process, timeout_seconds=90)
+        workload = Workload(base_url, make_locations(args.locations, args.seed), args.skew)
+
+        samples, lock = {}, threading.Lock()
+        start = time.monotonic()
+        warmup_until = start + args.warmup
+        stop_at = warmup_until + args.duration
+        threads = [threading.Thread(target=client_loop, daemon=True,
+                                    args=(workload, mix, args.seed * 1000 + i, args.users,
+                                          warmup_until, stop_at, samples, lock))
+                   for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+
+        time.sleep(max(0, warmup_until - time.monotonic()))
+        before = {name: stub.stats() for name, stub in stubs.items()}
+        for thread in threads:
+            thread.join()
+        after = {name: stub.stats() for name, stub in stubs.items()}
+        measured = time.monotonic() - warmup_until
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        for stub in stubs.values():
+            stub.stop()
+
+    result = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "args": vars(args),
+            "measured_seconds": round(measured, 2),
+            "gunicorn_log": log_file.name,
+        },
+        "endpoints": summarize(samples, measured),
+        "upstream": stub_deltas(before, after),
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"\nSaved to {output}")
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    main()
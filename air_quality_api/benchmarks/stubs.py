@@ -0,0 +1,354 @@
+"""
+Local stand-ins for the services the API depends on, for benchmarks.
+
+Each stub is a threaded HTTP server speaking just enough of the real
+protocol for this app: OpenWeather's REST API, Nominatim search, Gemini's
+generateContent (REST transport) and the Upstash Redis REST protocol.
+Every stub takes a latency (fixed + random jitter) and an error rate, and
+counts the calls it receives per operation (GET /__stats).
+"""
+import base64
+import json
+import math
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubServer:
+    name = "stub"
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._errors = {}
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self, host="127.0.0.1", port=0):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub._dispatch(self, "GET")
+
+            def do_POST(self):
+                stub._dispatch(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=f"stub-{self.name}", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {"calls": dict(self._calls), "errors": dict(self._errors)}
+
+    # Subclasses implement handle(method, path, query, body) -> (status, payload)
+    def handle(self, method, path, query, body, headers):
+        raise NotImplementedError
+
+    def _dispatch(self, request, method):
+        parsed = urlparse(request.path)
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+        if parsed.path == "/__stats":
+            return self._send(request, 200, self.stats())
+
+        operation = self.operation(method, parsed.path)
+        with self._lock:
+            self._calls[operation] = self._calls.get(operation, 0) + 1
+            delay = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms))
+            fail = self._random.random() < self.error_rate
+        if delay:
+            time.sleep(delay / 1000)
+        if fail:
+            with self._lock:
+                self._errors[operation] = self._errors.get(operation, 0) + 1
+            return self._send(request, 500, self.error_payload())
+
+        try:
+            status, payload = self.handle(method, parsed.path, parse_qs(parsed.query), body, request.headers)
+        except Exception as e:
+            status, payload = 500, {"error": f"stub failure: {e}"}
+        self._send(request, status, payload)
+
+    def operation(self, method, path):
+        return path.rsplit("/", 1)[-1] or "/"
+
+    def error_payload(self):
+        return {"error": "injected failure"}
+
+    @staticmethod
+    def _send(request, status, payload):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+
+def _seeded(lat, lon):
+    """Deterministic per-location generator, so repeated runs see the same data."""
+    return random.Random(f"{round(float(lat), 2)}:{round(float(lon), 2)}")
+
+
+class OpenWeatherStub(StubServer):
+    name = "openweather"
+
+    def operation(self, method, path):
+        return "air_pollution_history" if path.endswith("/history") else path.rsplit("/", 1)[-1]
+
+    def handle(self, method, path, query, body, headers):
+        lat, lon = query.get("lat", ["0"])[0], query.get("lon", ["0"])[0]
+        rng = _seeded(lat, lon)
+        now = int(time.time())
+
+        if path.endswith("/air_pollution/history"):
+            start = int(query.get("start", [now - 86400])[0])
+            end = int(query.get("end", [now])[0])
+            return 200, {"coord": {"lat": float(lat), "lon": float(lon)},
+                         "list": [self._pollution(rng, ts) for ts in range(start, end, 3600)]}
+        if path.endswith("/air_pollution"):
+            return 200, {"coord": {"lat": float(lat), "lon": float(lon)}, "list": [self._pollution(rng, now)]}
+        if path.endswith("/weather"):
+            return 200, {"dt": now - rng.randint(0, 500),
+                         "main": {"temp": round(rng.uniform(-5, 38), 1)},
+                         "weather": [self._condition(rng)]}
+        if path.endswith("/forecast"):
+            # 3-hour slots starting at the next slot boundary, like the real API
+            first = datetime.fromtimestamp(now - now % 10800 + 10800, tz=timezone.utc)
+            items = []
+            for i in range(40):
+                slot = first + timedelta(hours=3 * i)
+                temp = rng.uniform(-5, 38)
+                items.append({"dt": int(slot.timestamp()), "dt_txt": slot.strftime("%Y-%m-%d %H:%M:%S"),
+                              "main": {"temp_min": round(temp - 2, 1), "temp_max": round(temp + 2, 1)},
+                              "weather": [self._condition(rng)]})
+            return 200, {"list": items}
+        return 404, {"cod": "404", "message": "not found"}
+
+    @staticmethod
+    def _pollution(rng, ts):
+        return {"dt": ts, "main": {"aqi": rng.randint(1, 5)},
+                "components": {name: round(rng.uniform(0, 120), 2)
+                               for name in ("co", "no", "no2", "o3", "so2", "pm2_5", "pm10", "nh3")}}
+
+    @staticmethod
+    def _condition(rng):
+        main, description, icon = rng.choice([
+            ("Clear", "clear sky", "01d"), ("Clouds", "broken clouds", "04d"),
+            ("Rain", "light rain", "10d"), ("Snow", "light snow", "13d"), ("Mist", "mist", "50d"),
+        ])
+        return {"main": main, "description": description, "icon": icon}
+
+
+class NominatimStub(StubServer):
+    name = "nominatim"
+
+    def handle(self, method, path, query, body, headers):
+        q = query.get("q", [""])[0]
+        limit = int(query.get("limit", ["5"])[0])
+        rng = random.Random(q.lower())
+        return 200, [{"place_id": rng.randint(1, 10 ** 8),
+                      "display_name": f"{q.title()} {i + 1}, Stubland",
+                      "lat": str(round(rng.uniform(-60, 60), 5)),
+                      "lon": str(round(rng.uniform(-180, 180), 5)),
+                      "type": "city"}
+                     for i in range(rng.randint(1, limit))]
+
+
+class GeminiStub(StubServer):
+    name = "gemini"
+
+    ADVICE = "Moderate: sensitive groups should limit prolonged outdoor exertion."
+
+    def operation(self, method, path):
+        return path.rsplit(":", 1)[-1]
+
+    def handle(self, method, path, query, body, headers):
+        request = json.loads(body or b"{}")
+        prompt = " ".join(part.get("text", "") for content in request.get("contents", [])
+                          for part in content.get("parts", []))
+        config = request.get("generationConfig") or request.get("generation_config") or {}
+        mime = config.get("responseMimeType") or config.get("response_mime_type")
+        tasks = len(re.findall(r"^### Task \d+", prompt, flags=re.M))
+        if mime == "application/json" and tasks:
+            # Micro-batched prompt (GeminiBatcher): one answer per task
+            text = json.dumps([f"{self.ADVICE} ({i})" for i in range(1, tasks + 1)])
+        else:
+            text = self.ADVICE
+
+        if path.endswith(":streamGenerateContent"):
+            words = text.split(" ")
+            step = max(1, math.ceil(len(words) / 4))
+            chunks = [" ".join(words[i:i + step]) + " " for i in range(0, len(words), step)]
+            return 200, [self._response(chunk) for chunk in chunks]
+        return 200, self._response(text)
+
+    @staticmethod
+    def _response(text):
+        return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                                "finishReason": "STOP", "index": 0}],
+                "usageMetadata": {"promptTokenCount": 1, "candidatesTokenCount": 1, "totalTokenCount": 2}}
+
+
+class UpstashStub(StubServer):
+    """
+    In-memory Redis behind the Upstash REST protocol: POST / with one
+    command, POST /pipeline or /multi-exec with a list of them. Only the
+    commands this app sends are implemented; the app's Lua scripts are
+    recognised and emulated.
+    """
+    name = "upstash"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._data = {}        # key -> (value, expires_at or None)
+        self._data_lock = threading.Lock()
+
+    def operation(self, method, path):
+        return path.strip("/") or "command"
+
+    def error_payload(self):
+        return {"error": "ERR injected failure"}
+
+    def handle(self, method, path, query, body, headers):
+        encode = headers.get("Upstash-Encoding") == "base64"
+        commands = json.loads(body or b"[]")
+        with self._data_lock:
+            if path.strip("/") in ("pipeline", "multi-exec"):
+                return 200, [self._reply(command, encode) for command in commands]
+            return 200, self._reply(commands, encode)
+
+    def _reply(self, command, encode):
+        try:
+            result = self._execute([str(part) for part in command])
+        except Exception as e:
+            return {"error": f"ERR {e}"}
+        return {"result": self._encode(result) if encode else result}
+
+    def _encode(self, value):
+        if isinstance(value, list):
+            return [self._encode(item) for item in value]
+        if isinstance(value, str) and value != "OK":
+            return base64.b64encode(value.encode()).decode()
+        return value
+
+    def _get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self._data[key]
+            return None
+        return entry[0]
+
+    def _put(self, key, value, ttl=None, keep_ttl=False):
+        expires_at = time.time() + ttl if ttl else None
+        if keep_ttl and key in self._data:
+            expires_at = self._data[key][1]
+        self._data[key] = (value, expires_at)
+
+    def _execute(self, command):
+        name, args = command[0].upper(), command[1:]
+        if name == "PING":
+            return "PONG"
+        if name == "GET":
+            value = self._get(args[0])
+            return value if isinstance(value, str) or value is None else None
+        if name == "MGET":
+            return [self._get(key) for key in args]
+        if name == "SET":
+            key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+            ttl = None
+            if "EX" in options:
+                ttl = float(args[2 + options.index("EX") + 1])
+            if "PX" in options:
+                ttl = float(args[2 + options.index("PX") + 1]) / 1000
+            if "NX" in options and self._get(key) is not None:
+                return None
+            self._put(key, value, ttl)
+            return "OK"
+        if name == "SETEX":
+            self._put(args[0], args[2], float(args[1]))
+            return "OK"
+        if name == "DEL":
+            return sum(1 for key in args if self._data.pop(key, None) is not None)
+        if name == "TTL":
+            if self._get(args[0]) is None:
+                return -2
+            expires_at = self._data[args[0]][1]
+            return -1 if expires_at is None else max(0, int(expires_at - time.time()))
+        if name == "EXPIRE":
+            if self._get(args[0]) is None:
+                return 0
+            self._put(args[0], self._data[args[0]][0], float(args[1]))
+            return 1
+        if name in ("INCR", "INCRBY"):
+            value = int(self._get(args[0]) or 0) + (int(args[1]) if name == "INCRBY" else 1)
+            self._put(args[0], str(value), keep_ttl=True)
+            return value
+        if name == "LPUSH":
+            items = self._get(args[0]) or []
+            self._put(args[0], list(reversed(args[1:])) + items, keep_ttl=True)
+            return len(self._data[args[0]][0])
+        if name == "LTRIM":
+            items = self._get(args[0]) or []
+            start, stop = int(args[1]), int(args[2])
+            self._put(args[0], items[start:None if stop == -1 else stop + 1], keep_ttl=True)
+            return "OK"
+        if name == "LRANGE":
+            items = self._get(args[0]) or []
+            start, stop = int(args[1]), int(args[2])
+            return items[start:None if stop == -1 else stop + 1]
+        if name == "EVAL":
+            return self._eval(args[0], args[2:2 + int(args[1])], args[2 + int(args[1]):])
+        raise ValueError(f"unsupported command {name}")
+
+    def _eval(self, script, keys, argv):
+        if "redis.call('del'" in script:
+            # CacheService lock release: delete only if we still own it
+            if self._get(keys[0]) == argv[0]:
+                del self._data[keys[0]]
+                return 1
+            return 0
+        if "redis.call('expire'" in script:
+            # CacheService.extend_lock: reset the TTL only if we still own it
+            if self._get(keys[0]) == argv[0]:
+                self._put(keys[0], argv[0], float(argv[1]))
+                return 1
+            return 0
+        if "interval" in script:
+            # CacheService.reserve_slot (GCRA)
+            now, interval, max_wait = float(argv[0]), float(argv[1]), float(argv[2])
+            tat = max(float(self._get(keys[0]) or now), now)
+            wait = tat - now
+            if wait > max_wait:
+                return -1
+            self._put(keys[0], str(tat + interval), (wait + interval + 1000) / 1000)
+            return int(wait)
+        raise ValueError("unsupported script")
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,4 +13,170 @@ class Config:
     # Si no la encuentra (en local), usa la URL por defecto para docker-compose.
     REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
     
-    MONGO_DB_NAME = "air_quality_db"
\ No newline at end of file
+    MONGO_DB_NAME = "air_quality_db"
+    # Atlas requires TLS; a local mongod (e.g. for benchmarks) usually doesn't
+    MONGO_TLS = os.getenv("MONGO_TLS", "true").lower() == "true"
+
+    # Upstream endpoints, overridable to point at local stand-ins
+    OPENWEATHER_BASE_URL = os.getenv("OPENWEATHER_BASE_URL", "https://api.openweathermap.org/data/2.5")
+    GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+    # Single-flight coalescing of cache misses (seconds). The lock must outlive
+    # a worst-case fetch (3 attempts x 10s timeout plus up to 10s of backoff between them),
+    # or it expires mid-fetch and a second worker starts the same one
+    COALESCE_LOCK_TTL = int(os.getenv("COALESCE_LOCK_TTL", "60"))
+    # Waiters give up (and fetch themselves) only once the leader's lock would
+    # have expired anyway; a failed leader is noticed sooner (see RequestCoalescer)
+    COALESCE_WAIT_TIMEOUT = float(os.getenv("COALESCE_WAIT_TIMEOUT", str(COALESCE_LOCK_TTL)))
+
+    # In-process L1 cache in front of Upstash
+    L1_CACHE_ENABLED = os.getenv("L1_CACHE_ENABLED", "true").lower() == "true"
+    L1_CACHE_MAX_ENTRIES = int(os.getenv("L1_CACHE_MAX_ENTRIES", "4096"))
+    L1_CACHE_MAX_BYTES = int(os.getenv("L1_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    # Optional cap on how long a key may live locally (0 = follow the Redis TTL)
+    L1_CACHE_MAX_TTL = int(os.getenv("L1_CACHE_MAX_TTL", "0"))
+
+    # Shared pool for concurrent upstream calls
+    UPSTREAM_MAX_WORKERS = int(os.getenv("UPSTREAM_MAX_WORKERS", "16"))
+    # Overall deadline for /weather's parallel OpenWeather calls (seconds)
+    WEATHER_REQUEST_DEADLINE = float(os.getenv("WEATHER_REQUEST_DEADLINE", "15"))
+    # Overall deadline for /dashboard, advice included (seconds)
+    DASHBOARD_REQUEST_DEADLINE = float(os.getenv("DASHBOARD_REQUEST_DEADLINE", "20"))
+
+    # Spatial cache keys: "geohash" or "grid" cells, per kind of data
+    CACHE_KEY_SCHEME = os.getenv("CACHE_KEY_SCHEME", "geohash")
+    # Geohash length: 5 ~ 4.9 km x 4.9 km, 6 ~ 1.2 km x 0.6 km
+    CACHE_GEOHASH_PRECISION = {
+        "default": int(os.getenv("CACHE_GEOHASH_PRECISION", "5")),
+        "air_quality": int(os.getenv("CACHE_GEOHASH_PRECISION_AIR_QUALITY", "5")),
+        "history": int(os.getenv("CACHE_GEOHASH_PRECISION_HISTORY", "5")),
+        "weather": int(os.getenv("CACHE_GEOHASH_PRECISION_WEATHER", "6")),
+        "forecast": int(os.getenv("CACHE_GEOHASH_PRECISION_FORECAST", "5")),
+    }
+    # Grid cell size in degrees
+    CACHE_GRID_DEGREES = {
+        "default": float(os.getenv("CACHE_GRID_DEGREES", "0.05")),
+        "air_quality": float(os.getenv("CACHE_GRID_DEGREES_AIR_QUALITY", "0.05")),
+        "history": float(os.getenv("CACHE_GRID_DEGREES_HISTORY", "0.05")),
+        "weather": float(os.getenv("CACHE_GRID_DEGREES_WEATHER", "0.01")),
+        "forecast": float(os.getenv("CACHE_GRID_DEGREES_FORECAST", "0.05")),
+    }
+    # Mirror entries to the containing cell and serve misses from it
+    CACHE_PARENT_FALLBACK = os.getenv("CACHE_PARENT_FALLBACK", "false").lower() == "true"
+
+    # POST /air_quality/batch
+    BATCH_MAX_POINTS = int(os.getenv("BATCH_MAX_POINTS", "200"))
+    BATCH_FETCH_CONCURRENCY = int(os.getenv("BATCH_FETCH_CONCURRENCY", "8"))
+    BATCH_REQUEST_DEADLINE = float(os.getenv("BATCH_REQUEST_DEADLINE", "20"))
+
+    # Write-behind buffer for Mongo inserts (readings and visits)
+    WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() == "true"
+    WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))
+
+    # Mongo schema/index management and retention (TTL indexes). The startup
+    # apply runs from gunicorn's on_starting, never from `flask` commands
+    DB_ENSURE_SCHEMA_ON_STARTUP = os.getenv("DB_ENSURE_SCHEMA_ON_STARTUP", "true").lower() == "true"
+    READINGS_RETENTION_DAYS = int(os.getenv("READINGS_RETENTION_DAYS", "90"))
+    VISITS_RETENTION_DAYS = int(os.getenv("VISITS_RETENTION_DAYS", "365"))
+
+    # Stale-while-revalidate: past the soft TTL entries are served stale and
+    # refreshed in the background; the hard TTL is the Redis expiry (seconds)
+    AIR_QUALITY_SOFT_TTL = int(os.getenv("AIR_QUALITY_SOFT_TTL", "900"))
+    AIR_QUALITY_HARD_TTL = int(os.getenv("AIR_QUALITY_HARD_TTL", "3600"))
+    HISTORY_SOFT_TTL = int(os.getenv("HISTORY_SOFT_TTL", "21600"))
+    HISTORY_HARD_TTL = int(os.getenv("HISTORY_HARD_TTL", "86400"))
+    # Weather/forecast go stale when OpenWeather publishes newer data; these
+    # bound that TTL from below and set how long stale data may still be served
+    WEATHER_MIN_TTL = int(os.getenv("WEATHER_MIN_TTL", "60"))
+    WEATHER_STALE_GRACE = int(os.getenv("WEATHER_STALE_GRACE", "600"))
+    FORECAST_STALE_GRACE = int(os.getenv("FORECAST_STALE_GRACE", "3600"))
+    # XFetch early-refresh aggressiveness (0 disables early refresh)
+    SWR_BETA = float(os.getenv("SWR_BETA", "1.0"))
+
+    # Pre-warming of saved locations (leader-elected worker thread or `flask prewarm`)
+    PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "false").lower() == "true"
+    PREWARM_INTERVAL = int(os.getenv("PREWARM_INTERVAL", "300"))
+    # Refresh entries that would go stale within this many seconds
+    PREWARM_LEAD_SECONDS = int(os.getenv("PREWARM_LEAD_SECONDS", "450"))
+    # Upstream calls per second the pre-warmer may make
+    PREWARM_RATE_PER_SECOND = float(os.getenv("PREWARM_RATE_PER_SECOND", "1.0"))
+    # Languages whose current weather is kept warm for saved locations
+    PREWARM_WEATHER_LANGS = [l.strip() for l in os.getenv("PREWARM_WEATHER_LANGS", "es").split(",") if l.strip()]
+
+    # Gemini advice feature bands (JSON override of advice_features.DEFAULT_BANDS)
+    ADVICE_BANDS = os.getenv("ADVICE_BANDS")
+
+    # Micro-batching of concurrent Gemini generations
+    GEMINI_BATCHING_ENABLED = os.getenv("GEMINI_BATCHING_ENABLED", "false").lower() == "true"
+    GEMINI_BATCH_MAX_SIZE = int(os.getenv("GEMINI_BATCH_MAX_SIZE", "8"))
+    GEMINI_BATCH_MAX_WAIT_MS = int(os.getenv("GEMINI_BATCH_MAX_WAIT_MS", "15"))
+    GEMINI_BATCH_TIMEOUT = float(os.getenv("GEMINI_BATCH_TIMEOUT", "30"))
+    # Threads per worker sending batches and single-call fallbacks
+    GEMINI_BATCH_MAX_CONCURRENCY = int(os.getenv("GEMINI_BATCH_MAX_CONCURRENCY", "8"))
+
+    # Local rule-based advice: "off", "always", "fallback" (Gemini slow, over
+    # budget or failing) or "initial" (answer locally, fill cache in background)
+    LOCAL_ADVICE_MODE = os.getenv("LOCAL_ADVICE_MODE", "off")
+    LOCAL_ADVICE_GEMINI_TIMEOUT = float(os.getenv("LOCAL_ADVICE_GEMINI_TIMEOUT", "3"))
+    # Threads per worker for timed, background and timed streaming generations
+    GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+    # Gemini calls per minute per worker before falling back (0 = unlimited)
+    GEMINI_CALLS_PER_MINUTE = int(os.getenv("GEMINI_CALLS_PER_MINUTE", "0"))
+
+    # Offline place index for /search: a GeoNames dump such as cities15000.txt
+    # (https://download.geonames.org/export/dump/), optionally .gz, with
+    # admin1CodesASCII.txt alongside for region names. Missing file = Nominatim only.
+    GAZETTEER_PATH = os.getenv(
+        "GAZETTEER_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cities15000.txt")
+    )
+    GAZETTEER_ALTERNATE_NAMES = os.getenv("GAZETTEER_ALTERNATE_NAMES", "true").lower() == "true"
+    GAZETTEER_MIN_POPULATION = int(os.getenv("GAZETTEER_MIN_POPULATION", "0"))
+
+    # Nominatim fallback for /search: shared rate limit (usage policy is about
+    # 1 request/s), max queueing delay before shedding, and result cache TTL
+    NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org")
+    NOMINATIM_USER_AGENT = os.getenv("NOMINATIM_USER_AGENT", "AuraClimaApp/1.0")
+    NOMINATIM_RATE_PER_SECOND = float(os.getenv("NOMINATIM_RATE_PER_SECOND", "1.0"))
+    NOMINATIM_MAX_QUEUE_SECONDS = float(os.getenv("NOMINATIM_MAX_QUEUE_SECONDS", "2"))
+    NOMINATIM_CACHE_TTL = int(os.getenv("NOMINATIM_CACHE_TTL", "604800"))
+
+    # Read by Flask-Limiter through app.config
+    RATELIMIT_ENABLED = os.getenv("RATELIMIT_ENABLED", "true").lower() == "true"
+    # Rate limit storage: "redis" (every check goes to Redis) or "local"
+    # (in-process counters synced to Redis every RATELIMIT_SYNC_INTERVAL_MS)
+    RATELIMIT_STORAGE = os.getenv("RATELIMIT_STORAGE", "redis")
+    RATELIMIT_SYNC_INTERVAL_MS = int(os.getenv("RATELIMIT_SYNC_INTERVAL_MS", "250"))
+    # Header carrying the user id used as rate limit key (falls back to ?user_id, then IP)
+    RATELIMIT_KEY_HEADER = os.getenv("RATELIMIT_KEY_HEADER", "X-User-Id")
+
+    # /api/health serves a snapshot refreshed by a background prober (seconds)
+    HEALTH_PROBE_INTERVAL = int(os.getenv("HEALTH_PROBE_INTERVAL", "15"))
+    HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "3"))
+    # One worker per host probes and shares the snapshot through this file
+    HEALTH_SNAPSHOT_PATH = os.getenv(
+        "HEALTH_SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "air_quality_api_health.json")
+    )
+
+    # Per-request timing: Server-Timing header (off by default, and only ever
+    # sent to admins), logging ("off", "slow", "all") and a ring buffer of
+    # requests slower than SLOW_REQUEST_THRESHOLD_MS
+    SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+    REQUEST_TIMING_LOG = os.getenv("REQUEST_TIMING_LOG", "slow")
+    SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "1000"))
+    SLOW_REQUEST_BUFFER_SIZE = int(os.getenv("SLOW_REQUEST_BUFFER_SIZE", "100"))
+    # Token for /api/admin/* and per-request profiling (X-Profile: 1); unset = disabled
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+    # Upstream record/replay: "off", "record" (archive real responses with
+    # timing) or "replay" (serve them back offline, latency scaled; 0 = instant).
+    # Replay misses fail like an outage, or go to the network with "live".
+    UPSTREAM_ARCHIVE_MODE = os.getenv("UPSTREAM_ARCHIVE_MODE", "off")
+    UPSTREAM_ARCHIVE_PATH = os.getenv(
+        "UPSTREAM_ARCHIVE_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "upstream_archive")
+    )
+    UPSTREAM_REPLAY_LATENCY_SCALE = float(os.getenv("UPSTREAM_REPLAY_LATENCY_SCALE", "1.0"))
+    UPSTREAM_REPLAY_MISSES = os.getenv("UPSTREAM_REPLAY_MISSES", "error")
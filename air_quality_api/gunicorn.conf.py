@@ -1,6 +1,14 @@
 # Gunicorn configuration for production deployment
 import multiprocessing
 import os
+import shutil
+
+# Prometheus multiprocess mode: every worker writes its metrics to files
+# here and /api/metrics aggregates them. Must be set before the app (and
+# prometheus_client) is imported, and emptied so restarts start from zero.
+prometheus_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/air_quality_api_metrics")
+shutil.rmtree(prometheus_dir, ignore_errors=True)
+os.makedirs(prometheus_dir, exist_ok=True)
 
 # Server socket
 bind = "0.0.0.0:5000"
@@ -50,6 +58,19 @@ def on_starting(server):
     """
     print("Starting Gunicorn server...")
 
+    # Idempotent index/schema bootstrap, once per start in the master. Kept
+    # out of create_app so `flask ensure-schema --plan` still sees the diff
+    from config import Config
+    if Config.DB_ENSURE_SCHEMA_ON_STARTUP:
+        from app.controllers.quality_routes import db_service
+        try:
+            changes = db_service.ensure_schema()
+            failed = [change for change in changes if "error" in change]
+            if changes:
+                print(f"Database schema updated: {len(changes) - len(failed)} change(s), {len(failed)} failed")
+        except Exception as e:
+            print(f"Database schema update failed: {e}")
+
 def on_reload(server):
     """
     Called to recycle workers during a reload via SIGHUP.
@@ -63,14 +84,45 @@ def when_ready(server):
     print(f"Gunicorn server is ready. Listening on: {bind}")
     print(f"Workers: {workers}")
 
+    # The master doesn't serve requests: drop the live gauges (Mongo pool
+    # counts) it recorded while preloading the app, so scrapes only sum workers
+    from app.services import metrics
+    metrics.mark_process_dead(os.getpid())
+
+def _flush_pending_writes():
+    # Only touch the singleton if this worker actually created it
+    from app.services.database_service import DatabaseService
+    if DatabaseService._instance is not None:
+        DatabaseService._instance.flush_writes()
+
 def worker_int(worker):
     """
     Called during worker shutdown.
     """
     print(f"Worker {worker.pid} interrupted")
+    _flush_pending_writes()
+
+def worker_exit(server, worker):
+    """
+    Called in the worker process just after it exits; flushes the write-behind buffer.
+    """
+    _flush_pending_writes()
+
+def child_exit(server, worker):
+    """
+    Called in the master after a worker exits; drops its live gauges.
+    """
+    from app.services import metrics
+    metrics.mark_process_dead(worker.pid)
 
 def post_fork(server, worker):
     """
     Called just after a worker has been forked.
     """
     print(f"Worker spawned (pid: {worker.pid})")
+
+    # Every worker runs the pre-warm loop; a Redis lock picks one per cycle
+    from config import Config
+    if Config.PREWARM_ENABLED:
+        from app.controllers.quality_routes import prewarmer
+        prewarmer.start()
@@ -0,0 +1,42 @@
+import pytest
+
+from app.services import advice_features
+
+
+# Descriptions OpenWeather returns with lang=es, by condition group
+@pytest.mark.parametrize("description, expected", [
+    ("tormenta con lluvia ligera", "storm"),
+    ("tormenta", "storm"),
+    ("llovizna de intensidad ligera", "rain"),
+    ("lluvia ligera", "rain"),
+    ("lluvia de gran intensidad", "rain"),
+    ("lluvia helada", "rain"),
+    ("chubasco de lluvia", "rain"),
+    ("nevada ligera", "snow"),
+    ("nieve", "snow"),
+    ("aguanieve", "snow"),
+    ("niebla", "fog"),
+    ("bruma", "fog"),
+    ("humo", "fog"),
+    ("calima", "fog"),
+    ("remolinos de arena/polvo", "fog"),
+    ("ceniza volcánica", "fog"),
+    ("cielo claro", "clear"),
+    ("algo de nubes", "clouds"),
+    ("nubes dispersas", "clouds"),
+    ("muy nuboso", "clouds"),
+    ("nubes", "clouds"),
+])
+def test_condition_class_covers_openweather_spanish(description, expected):
+    assert advice_features.condition_class(description) == expected
+
+
+def test_unsupported_languages_share_the_spanish_key():
+    weather = {"temp": 21, "condition": "nubes dispersas"}
+    keys = {
+        advice_features.feature_key(advice_features.weather_features(weather, language))
+        for language in ("es", "fr", "xx-unknown", None)
+    }
+    assert len(keys) == 1
+    english = advice_features.feature_key(advice_features.weather_features(weather, "en"))
+    assert english not in keys
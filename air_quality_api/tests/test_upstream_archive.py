@@ -0,0 +1,33 @@
+import glob
+import gzip
+import os
+
+import pytest
+import requests
+
+from app.services.upstream_archive import UpstreamArchive, redact
+
+
+def test_redact_masks_secret_params():
+    url = "https://api.openweathermap.org/data/2.5/weather?lat=1&appid=SUPERSECRET&key=K2&api_key=K3"
+    assert redact(url) == "https://api.openweathermap.org/data/2.5/weather?lat=1&appid=REDACTED&key=REDACTED&api_key=REDACTED"
+
+
+def test_recorded_errors_never_store_the_api_key(tmp_path):
+    archive = UpstreamArchive(str(tmp_path), mode="record")
+    session = requests.Session()
+    session.mount("http://", archive.adapter("openweather"))
+
+    # Nothing listens on port 1: the ConnectionError message quotes the full URL
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.get("http://127.0.0.1:1/data/2.5/weather",
+                    params={"lat": 1, "lon": 2, "appid": "SUPERSECRET"}, timeout=2)
+    archive._file.close()
+
+    files = glob.glob(os.path.join(str(tmp_path), "*.jsonl.gz"))
+    assert files
+    for filename in files:
+        with gzip.open(filename, "rt", encoding="utf-8") as f:
+            content = f.read()
+        assert "ConnectionError" in content
+        assert "SUPERSECRET" not in content
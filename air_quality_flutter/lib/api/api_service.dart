@@ -38,12 +38,22 @@ class ApiService {
     return _userId!;
   }
 
+  // Cabeceras comunes: el backend limita las peticiones por X-User-Id
+  Future<Map<String, String>> _headers({bool isJson = false}) async {
+    final userId = await _getUserId();
+    return {
+      'X-User-Id': userId,
+      if (isJson) 'Content-Type': 'application/json',
+    };
+  }
+
   // --- OBTENER DATOS ACTUALES ---
   Future<AirQualityData> getAirQuality(
       double latitude, double longitude) async {
     final response = await http
         .get(
           Uri.parse('$flaskBackendUrl/air_quality?lat=$latitude&lon=$longitude'),
+          headers: await _headers(),
         )
         .timeout(_kHttpTimeout);
     if (response.statusCode == 200) {
@@ -57,7 +67,8 @@ class ApiService {
   // --- BUSCAR UBICACIONES (Nominatim via Proxy) ---
   Future<List<LocationSearchResult>> searchLocation(String query) async {
     final response = await http
-        .get(Uri.parse('$flaskBackendUrl/search?q=$query'))
+        .get(Uri.parse('$flaskBackendUrl/search?q=$query'),
+            headers: await _headers())
         .timeout(_kHttpTimeout);
     if (response.statusCode == 200) {
       final List<dynamic> data = json.decode(response.body);
@@ -73,6 +84,7 @@ class ApiService {
     final response = await http
         .get(
           Uri.parse('$flaskBackendUrl/history?lat=$latitude&lon=$longitude'),
+          headers: await _headers(),
         )
         .timeout(_kHttpTimeout);
     if (response.statusCode == 200) {
@@ -87,8 +99,9 @@ class ApiService {
   // --- GESTIÓN DE UBICACIONES GUARDADAS ---
   Future<List<SavedLocation>> getSavedLocations() async {
     final userId = await _getUserId();
-    final response =
-        await http.get(Uri.parse('$flaskBackendUrl/locations?user_id=$userId'));
+    final response = await http.get(
+        Uri.parse('$flaskBackendUrl/locations?user_id=$userId'),
+        headers: await _headers());
     if (response.statusCode == 200) {
       final List<dynamic> data = json.decode(response.body);
       return data.map((json) => SavedLocation.fromJson(json)).toList();
@@ -106,7 +119,7 @@ class ApiService {
 
     final response = await http.post(
       Uri.parse('$flaskBackendUrl/locations'),
-      headers: {'Content-Type': 'application/json'},
+      headers: await _headers(isJson: true),
       body: json.encode(locationData),
     );
     if (response.statusCode != 200 && response.statusCode != 201) {
@@ -117,8 +130,9 @@ class ApiService {
   // --- ELIMINAR UBICACIÓN GUARDADA ---
   Future<void> deleteSavedLocation(String id) async {
     final userId = await _getUserId();
-    final response = await http
-        .delete(Uri.parse('$flaskBackendUrl/locations/$id?user_id=$userId'));
+    final response = await http.delete(
+        Uri.parse('$flaskBackendUrl/locations/$id?user_id=$userId'),
+        headers: await _headers());
     if (response.statusCode != 200) {
       throw Exception('Failed to delete location');
     }
@@ -131,6 +145,7 @@ class ApiService {
         .get(
           Uri.parse(
               '$flaskBackendUrl/weather?lat=$latitude&lon=$longitude&lang=$language'),
+          headers: await _headers(),
         )
         .timeout(_kHttpTimeout);
     if (response.statusCode == 200) {
@@ -156,7 +171,7 @@ class ApiService {
   }) async {
     final response = await http.post(
       Uri.parse('$flaskBackendUrl/advice'),
-      headers: {'Content-Type': 'application/json'},
+      headers: await _headers(isJson: true),
       body: json.encode({
         'weather': weatherCondition,
         'aqi': {
@@ -186,7 +201,7 @@ class ApiService {
   }) async {
     final response = await http.post(
       Uri.parse('$flaskBackendUrl/weather-advice'),
-      headers: {'Content-Type': 'application/json'},
+      headers: await _headers(isJson: true),
       body: json.encode({
         'temp': temp,
         'condition': condition,
@@ -213,6 +228,7 @@ class ApiService {
     final response = await http.get(
       Uri.parse(
           '$flaskBackendUrl/locations/history?user_id=$userId&days=$days'),
+      headers: await _headers(),
     );
 
     if (response.statusCode == 200) {
@@ -230,7 +246,7 @@ class ApiService {
 
     final response = await http.post(
       Uri.parse('$flaskBackendUrl/locations/visit'),
-      headers: {'Content-Type': 'application/json'},
+      headers: await _headers(isJson: true),
       body: json.encode({
         'user_id': userId,
         'latitude': lat,
@@ -59,6 +59,11 @@ Future<void> _runBackgroundCheck() async {
   final prefs = await SharedPreferences.getInstance();
   final String backendUrl =
       dotenv.env['API_URL'] ?? 'http://127.0.0.1:5000/api';
+  // Mismo ID que ApiService: el backend limita las peticiones por X-User-Id
+  final String? userId = prefs.getString('user_id');
+  final Map<String, String> headers = {
+    if (userId != null) 'X-User-Id': userId,
+  };
 
   // 2. Cargar ubicaciones de alerta configuradas y activas
   final String? alertsString = prefs.getString('alertLocations');
@@ -133,10 +138,14 @@ Future<void> _runBackgroundCheck() async {
 
       // Fetch paralelo: AQI + clima
       final results = await Future.wait([
-        http.get(Uri.parse(
-            '$backendUrl/air_quality?lat=${location.latitude}&lon=${location.longitude}')),
-        http.get(Uri.parse(
-            '$backendUrl/weather?lat=${location.latitude}&lon=${location.longitude}&lang=es')),
+        http.get(
+            Uri.parse(
+                '$backendUrl/air_quality?lat=${location.latitude}&lon=${location.longitude}'),
+            headers: headers),
+        http.get(
+            Uri.parse(
+                '$backendUrl/weather?lat=${location.latitude}&lon=${location.longitude}&lang=es'),
+            headers: headers),
       ]);
 
       final airResponse = results[0];